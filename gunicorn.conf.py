@@ -0,0 +1,53 @@
+"""
+Gunicorn configuration for the production launch mode.
+
+The application is loaded and warmed up once in the master process (preload_app and when_ready),
+then forked into the workers. Migrations are not run here, see the migrate service in docker-compose.prod.yml,
+and neither are the queued jobs, see the worker service.
+
+Every worker is its own process, so with more than one worker the push events (see api/push.py) need a broker
+shared by all of them: docker-compose.prod.yml sets PUSH_BROKER=api.push.PostgresBroker. The same goes for the
+shared tier of the cache (see api/caching.py): docker-compose.prod.yml sets CACHE_URL to a file cache on a volume
+shared by the web and worker services.
+
+    gunicorn -c gunicorn.conf.py
+
+The settings can be changed with the WEB_CONCURRENCY, WEB_WORKER_CLASS, WEB_BIND and WEB_TIMEOUT environment variables.
+"""
+import multiprocessing
+import os
+
+chdir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'src')
+wsgi_app = 'carpool.asgi:application'
+worker_class = os.environ.get('WEB_WORKER_CLASS', 'uvicorn_worker.UvicornWorker')
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count() * 2 + 1))
+bind = os.environ.get('WEB_BIND', '0.0.0.0:8000')
+timeout = int(os.environ.get('WEB_TIMEOUT', 30))
+graceful_timeout = 30
+keepalive = 5
+preload_app = True
+max_requests = 10000
+max_requests_jitter = 1000
+accesslog = '-'
+
+
+def when_ready(server):
+    from carpool.warmup import warm_up
+
+    warm_up()
+    server.log.info('Application warmed up')
+
+    from django.conf import settings
+
+    if server.num_workers > 1 and settings.PUSH_BROKER == 'api.push.InProcessBroker':
+        server.log.warning(
+            'PUSH_BROKER is api.push.InProcessBroker with %s workers: the push events only reach the clients '
+            'connected to the worker that published them, set PUSH_BROKER=api.push.PostgresBroker', server.num_workers,
+        )
+
+    backend = settings.CACHES['default']['BACKEND']
+    if server.num_workers > 1 and backend == 'django.core.cache.backends.locmem.LocMemCache':
+        server.log.warning(
+            'CACHES uses the local memory cache with %s workers: every worker has its own shared tier and the cache '
+            'invalidations only reach the worker that made them, set CACHE_URL to a file or network cache', server.num_workers,
+        )
@@ -1,3 +1,20 @@
 from django.contrib import admin
 
-# Register your models here.
+from .models import ChangeLogEntry
+
+
+@admin.register(ChangeLogEntry)
+class ChangeLogEntryAdmin(admin.ModelAdmin):
+    list_display = ('id', 'user', 'model', 'object_id', 'action', 'created_at')
+    list_select_related = ('user',)
+    list_filter = ('model', 'action')
+    date_hierarchy = 'created_at'
+    search_fields = ('=user__email',)
+    ordering = ('-id',)
+    show_full_result_count = False
+
+    def has_add_permission(self, request):
+        return False # written by the api signals
+
+    def has_change_permission(self, request, obj=None):
+        return False
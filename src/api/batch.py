@@ -0,0 +1,75 @@
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+from django.conf import settings
+from django.db import connections
+from django.http import HttpRequest, QueryDict
+from django.urls import Resolver404, resolve
+
+
+BATCH_MAX_REQUESTS = 20
+BATCH_EXCLUDED_PREFIXES = ('/api/batch/', '/api/export/')
+# headers of the batch request that do not apply to its sub-requests: its body and its preconditions
+BATCH_EXCLUDED_HEADERS = (
+    'CONTENT_TYPE', 'CONTENT_LENGTH', 'HTTP_CONTENT_ENCODING', 'HTTP_TRANSFER_ENCODING',
+    'HTTP_IF_MATCH', 'HTTP_IF_NONE_MATCH', 'HTTP_IF_MODIFIED_SINCE', 'HTTP_IF_UNMODIFIED_SINCE', 'HTTP_IF_RANGE', 'HTTP_RANGE',
+    'wsgi.input',
+)
+
+
+def _build_request(request, path):
+    """
+    Builds a GET sub-request for the path that shares the headers and the authentication of the batch request,
+    except for the body and conditional headers, which belong to the batch request itself.
+    """
+    url = urlsplit(path)
+    sub_request = HttpRequest()
+    sub_request.method = 'GET'
+    sub_request.path = sub_request.path_info = url.path
+    sub_request.META = {key: value for key, value in request.META.items() if key not in BATCH_EXCLUDED_HEADERS}
+    sub_request.META.update({'REQUEST_METHOD': 'GET', 'PATH_INFO': url.path, 'QUERY_STRING': url.query})
+    sub_request.GET = QueryDict(url.query)
+    if request.user and request.user.is_authenticated:
+        # reuse the user authenticated by the batch request instead of validating the token again
+        sub_request._force_auth_user = request.user
+        sub_request._force_auth_token = request.auth
+    return sub_request
+
+
+def run_request(request, path):
+    """
+    Runs a GET request for the path through the project URLs and returns its status, ETag and data.
+    """
+    url_path = urlsplit(path).path
+    if not url_path.startswith('/api/') or url_path.startswith(BATCH_EXCLUDED_PREFIXES):
+        return {'status': 400, 'body': {'detail': 'La ruta especificada no puede usarse en un lote'}}
+    try:
+        match = resolve(url_path)
+    except Resolver404:
+        return {'status': 404, 'body': {'detail': 'No encontrado.'}}
+
+    response = match.func(_build_request(request, path), *match.args, **match.kwargs)
+    result = {'status': response.status_code, 'body': getattr(response, 'data', None)}
+    if response.has_header('ETag'):
+        result['etag'] = response['ETag']
+    return result
+
+
+def _run_in_thread(request, path):
+    try:
+        return run_request(request, path)
+    finally:
+        connections.close_all() # the worker threads do not get the request_finished signal
+
+
+def run_batch(request, paths, parallel=False):
+    """
+    Runs every path as a GET sub-request and returns the results in the same order.
+    With parallel, the sub-requests run on a thread pool of at most BATCH_MAX_WORKERS threads,
+    each one with its own database connection.
+    """
+    if not parallel or len(paths) < 2:
+        return [run_request(request, path) for path in paths]
+    max_workers = min(len(paths), getattr(settings, 'BATCH_MAX_WORKERS', 4))
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='batch') as executor:
+        return list(executor.map(lambda path: _run_in_thread(request, path), paths))
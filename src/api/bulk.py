@@ -0,0 +1,183 @@
+"""
+Bulk list-create mode of the create endpoints.
+
+When the body of a create request is a JSON array instead of an object, the view validates and creates every
+item of the list in one request (see BulkCreateMixin) with a constant number of queries:
+
+    - The primary keys referenced by the items are resolved with one in_bulk() query per related model, shared by
+      every BulkPrimaryKeyRelatedField of the serializer (origin_city, destination_city and stops are one query).
+    - The unique fields are checked with one query per field for the whole list, which also rejects values
+      repeated inside the list.
+    - The checks that need other rows are loaded once by the get_bulk_lookups() hook of the serializer, and its
+      validate() reads them from bulk_lookups instead of querying per item.
+    - The objects are inserted with bulk_create() by the bulk_create() hook of the serializer.
+
+bulk_create() does not send the model signals, so the bulk_create() hooks take care of the rows the signals
+would maintain. The whole list is created in a single transaction, and any invalid item rejects the request
+with the errors listed by position.
+"""
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.db import transaction
+from rest_framework import serializers, status
+from rest_framework.response import Response
+from rest_framework.validators import UniqueValidator
+
+
+class BulkPrimaryKeyRelatedField(serializers.PrimaryKeyRelatedField):
+    """
+    PrimaryKeyRelatedField that takes the related object from the ones loaded by BulkListSerializer,
+    and queries it like its parent outside of the bulk mode.
+    """
+    def to_internal_value(self, data):
+        model = self.get_queryset().model
+        objects = self.context.get('related_objects', {}).get(model)
+        if objects is None or self.pk_field is not None:
+            return super().to_internal_value(data)
+        if isinstance(data, bool):
+            self.fail('incorrect_type', data_type=type(data).__name__)
+        try:
+            pk = model._meta.pk.to_python(data)
+        except (TypeError, DjangoValidationError):
+            self.fail('incorrect_type', data_type=type(data).__name__)
+        if pk not in objects:
+            self.fail('does_not_exist', pk_value=data)
+        return objects[pk]
+
+
+class _PrefetchedUniqueValidator:
+    """
+    Replaces the UniqueValidator of a field in the bulk mode, checking the values against the ones already
+    taken in the database and in the previous items of the list.
+    """
+    def __init__(self, message, taken):
+        self.message = message
+        self.taken = taken
+
+    def __call__(self, value):
+        if value in self.taken:
+            raise serializers.ValidationError(self.message, code='unique')
+        self.taken.add(value)
+
+
+def _relation(field):
+    relation = field.child_relation if isinstance(field, serializers.ManyRelatedField) else field
+    return relation if isinstance(relation, BulkPrimaryKeyRelatedField) and not field.read_only else None
+
+
+class BulkListSerializer(serializers.ListSerializer):
+    """
+    List serializer of the bulk mode. Loads everything the items reference before validating them,
+    and creates them through the bulk_create() hook of the child serializer.
+    """
+    def __init__(self, *args, **kwargs):
+        kwargs.setdefault('allow_empty', False)
+        kwargs.setdefault('max_length', getattr(settings, 'BULK_CREATE_MAX_ITEMS', 500))
+        super().__init__(*args, **kwargs)
+
+    def to_internal_value(self, data):
+        if isinstance(data, list) and len(data) <= self.max_length:
+            items = [item for item in data if isinstance(item, dict)]
+            self._context['related_objects'] = self.load_related_objects(items)
+            self.replace_unique_validators(items)
+            self._context['bulk_lookups'] = self.child.get_bulk_lookups(items)
+        return super().to_internal_value(data)
+
+    def load_related_objects(self, items):
+        """
+        Returns the objects referenced by the items as {model: {pk: object}}, with one query per model.
+        """
+        querysets, pks = {}, defaultdict(set)
+        for name, field in self.child.fields.items():
+            relation = _relation(field)
+            if relation is None:
+                continue
+            queryset = relation.get_queryset()
+            querysets.setdefault(queryset.model, queryset)
+            for item in items:
+                values = item.get(name)
+                if not isinstance(field, serializers.ManyRelatedField):
+                    values = [values]
+                elif not isinstance(values, list):
+                    continue
+                for value in values:
+                    try:
+                        pks[queryset.model].add(queryset.model._meta.pk.to_python(value))
+                    except (TypeError, DjangoValidationError):
+                        pass # reported by the field
+        return {model: queryset.in_bulk(pks[model] - {None}) for model, queryset in querysets.items()}
+
+    def replace_unique_validators(self, items):
+        """
+        Replaces the UniqueValidators of the fields with a single query per field for the whole list.
+        """
+        for name, field in self.child.fields.items():
+            validators = [validator for validator in field.validators if isinstance(validator, UniqueValidator) and validator.lookup == 'exact']
+            if not validators:
+                continue
+            values = set()
+            for item in items:
+                try:
+                    values.add(field.to_internal_value(item[name]))
+                except (KeyError, TypeError, serializers.ValidationError):
+                    pass # reported by the field
+            field.validators = [validator for validator in field.validators if validator not in validators] + [
+                _PrefetchedUniqueValidator(validator.message, set(validator.queryset.filter(**{f'{field.source}__in': values}).values_list(field.source, flat=True)))
+                for validator in validators
+            ]
+
+    def create(self, validated_data):
+        return self.child.bulk_create(validated_data)
+
+
+class BulkCreateSerializerMixin:
+    """
+    Mixin for the model serializers that support the bulk mode. Their Meta must set
+    `list_serializer_class = BulkListSerializer`.
+
+    The related fields generated by the model serializer are BulkPrimaryKeyRelatedFields, and the declared ones
+    should be too. validate() must not query per item when in_bulk is True: the rows it needs are loaded for the
+    whole list by get_bulk_lookups() and available as bulk_lookups.
+    """
+    serializer_related_field = BulkPrimaryKeyRelatedField
+
+    @property
+    def in_bulk(self):
+        return isinstance(self.parent, BulkListSerializer)
+
+    @property
+    def bulk_lookups(self):
+        return self.context.get('bulk_lookups', {})
+
+    def get_related_objects(self, model):
+        """
+        Returns the objects of the model referenced by the items of the list as {pk: object}.
+        """
+        return self.context.get('related_objects', {}).get(model, {})
+
+    def get_bulk_lookups(self, items):
+        return {}
+
+    def bulk_create(self, validated_data):
+        ModelClass = self.Meta.model
+        return ModelClass.objects.bulk_create(ModelClass(**attrs) for attrs in validated_data)
+
+
+class BulkCreateMixin:
+    """
+    Viewset mixin that accepts a JSON array in the create action and creates every item of it.
+    The list is saved by perform_bulk_create(), which receives the list serializer.
+    """
+    def create(self, request, *args, **kwargs):
+        if not isinstance(request.data, list):
+            return super().create(request, *args, **kwargs)
+        serializer = self.get_serializer(data=request.data, many=True)
+        serializer.is_valid(raise_exception=True)
+        with transaction.atomic():
+            self.perform_bulk_create(serializer)
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
+
+    def perform_bulk_create(self, serializer):
+        serializer.save()
@@ -0,0 +1,177 @@
+"""
+Two-tier cache for the hot read paths.
+
+Values are kept in a bounded per-process LRU (CACHE_LOCAL_MAX_ENTRIES entries, at most CACHE_LOCAL_TIMEOUT
+seconds each) in front of the shared Django cache (CACHES['default'], local memory by default, a file or network
+cache in production through CACHE_URL).
+
+Every value is stored with the tags it depends on. Each tag has a version number in the shared cache, and a
+value read from the shared tier is only used if the versions of its tags didn't change since it was written.
+The model signals at the bottom of this module bump the tags of the changed rows once the transaction commits:
+
+    - `states` when a state changes and `cities` when a city changes.
+    - `trips` and `trip:<id>` when a trip changes.
+    - `user:<id>` when a user changes and `vehicle:<id>` when a vehicle changes.
+
+Invalidating a tag drops the local entries of the process that made the change right away; the other processes
+stop using theirs when they expire, so their reads can be stale for up to CACHE_LOCAL_TIMEOUT seconds.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from authentication.models import CustomUser
+from trip.models import State, City, Vehicle, Trip
+
+KEY_PREFIX = 'tiered'
+
+
+class TieredCache:
+    def __init__(self, alias='default'):
+        self.alias = alias
+        self._local = OrderedDict() # key -> (expires, tags, value)
+        self._lock = threading.Lock()
+        self._stats = {'local_hits': 0, 'shared_hits': 0, 'misses': 0, 'invalidations': 0}
+
+    @property
+    def shared(self):
+        return caches[self.alias]
+
+    def _count(self, name):
+        with self._lock:
+            self._stats[name] += 1
+
+    def _tag_versions(self, tags):
+        """
+        Returns the current versions of the tags, creating the missing ones. New versions start at the current
+        time instead of 1, so a tag evicted from the shared cache can't come back with a version already used.
+        """
+        if not tags:
+            return ()
+        keys = [f'{KEY_PREFIX}:tag:{tag}' for tag in tags]
+        versions = self.shared.get_many(keys)
+        for key in keys:
+            if key not in versions:
+                self.shared.add(key, time.time_ns(), None)
+                versions[key] = self.shared.get(key)
+        return tuple(versions[key] for key in keys)
+
+    def _get_local(self, key):
+        with self._lock:
+            entry = self._local.get(key)
+            if entry is None:
+                return None
+            if entry[0] < time.monotonic():
+                del self._local[key]
+                return None
+            self._local.move_to_end(key)
+            return entry
+
+    def _set_local(self, key, tags, value, timeout):
+        local_timeout = getattr(settings, 'CACHE_LOCAL_TIMEOUT', 30)
+        if timeout is not None:
+            local_timeout = min(local_timeout, timeout)
+        with self._lock:
+            self._local[key] = (time.monotonic() + local_timeout, frozenset(tags), value)
+            self._local.move_to_end(key)
+            while len(self._local) > getattr(settings, 'CACHE_LOCAL_MAX_ENTRIES', 1000):
+                self._local.popitem(last=False)
+
+    def get_or_set(self, key, loader, tags=(), timeout=None):
+        """
+        Returns the cached value of key, or calls loader() and caches its result with the given tags for
+        timeout seconds (the default timeout of the shared cache if None). The value must be picklable.
+        """
+        entry = self._get_local(key)
+        if entry is not None:
+            self._count('local_hits')
+            return entry[2]
+
+        stored = self.shared.get(f'{KEY_PREFIX}:{key}')
+        if stored is not None:
+            stored_tags, versions, value = stored
+            if versions == self._tag_versions(stored_tags):
+                self._count('shared_hits')
+                self._set_local(key, stored_tags, value, timeout)
+                return value
+
+        self._count('misses')
+        tags = tuple(tags)
+        versions = self._tag_versions(tags) # read before loading, so a concurrent invalidation isn't missed
+        value = loader()
+        if timeout is None:
+            self.shared.set(f'{KEY_PREFIX}:{key}', (tags, versions, value))
+        else:
+            self.shared.set(f'{KEY_PREFIX}:{key}', (tags, versions, value), timeout)
+        self._set_local(key, tags, value, timeout)
+        return value
+
+    def invalidate(self, *tags):
+        """
+        Bumps the versions of the tags, which invalidates every value stored with one of them.
+        """
+        for tag in tags:
+            key = f'{KEY_PREFIX}:tag:{tag}'
+            try:
+                self.shared.incr(key)
+            except ValueError: # not set yet or evicted
+                self.shared.set(key, time.time_ns(), None)
+        tags = set(tags)
+        with self._lock:
+            for key in [key for key, entry in self._local.items() if entry[1] & tags]:
+                del self._local[key]
+            self._stats['invalidations'] += 1
+
+    def clear_local(self):
+        with self._lock:
+            self._local.clear()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats, local_entries=len(self._local))
+        lookups = stats['local_hits'] + stats['shared_hits'] + stats['misses']
+        stats['hit_ratio'] = round((stats['local_hits'] + stats['shared_hits']) / lookups, 4) if lookups else None
+        return stats
+
+
+cache = TieredCache()
+
+
+def invalidate_on_commit(*tags):
+    transaction.on_commit(lambda: cache.invalidate(*tags))
+
+
+@receiver(post_save, sender=State)
+@receiver(post_delete, sender=State)
+def invalidate_state(sender, **kwargs):
+    invalidate_on_commit('states')
+
+
+@receiver(post_save, sender=City)
+@receiver(post_delete, sender=City)
+def invalidate_city(sender, **kwargs):
+    invalidate_on_commit('cities')
+
+
+@receiver(post_save, sender=Trip)
+@receiver(post_delete, sender=Trip)
+def invalidate_trip(sender, instance, **kwargs):
+    invalidate_on_commit('trips', f'trip:{instance.pk}')
+
+
+@receiver(post_save, sender=CustomUser)
+@receiver(post_delete, sender=CustomUser)
+def invalidate_user(sender, instance, **kwargs):
+    invalidate_on_commit(f'user:{instance.pk}')
+
+
+@receiver(post_save, sender=Vehicle)
+@receiver(post_delete, sender=Vehicle)
+def invalidate_vehicle(sender, instance, **kwargs):
+    invalidate_on_commit(f'vehicle:{instance.pk}')
@@ -0,0 +1,110 @@
+import csv
+import json
+import zlib
+from itertools import islice
+
+from asgiref.sync import sync_to_async
+from django.core.serializers.json import DjangoJSONEncoder
+
+from trip.models import Trip, TripParticipant, TripJoinRequest
+from review.models import Review
+
+
+DEFAULT_CHUNK_SIZE = 2000
+
+EXPORT_FORMATS = ('ndjson', 'csv')
+
+EXPORT_RESOURCES = {
+    'trips': (Trip, ['id', 'origin_city_id', 'destination_city_id', 'departure_date', 'departure_time', 'departure_at', 'pet_allowed', 'smoking_allowed', 'kids_allowed', 'vehicle_id', 'creator_id']),
+    'participants': (TripParticipant, ['id', 'user_id', 'trip_id', 'role']),
+    'join-requests': (TripJoinRequest, ['id', 'user_id', 'trip_id', 'status', 'created_at', 'updated_at']),
+    'reviews': (Review, ['id', 'user_id', 'reviewer_id', 'trip_id', 'rating', 'comment']),
+}
+
+
+class _Echo:
+    """
+    File-like object that returns the written value instead of buffering it,
+    so csv.writer can be used to format rows one at a time.
+    """
+    def write(self, value):
+        return value
+
+
+def _batched(iterable, size):
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+
+def iter_rows(resource, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Yields the rows of the given resource as tuples ordered by primary key.
+
+    The queryset is consumed with iterator(chunk_size=...), which uses a server-side cursor on
+    PostgreSQL and skips the queryset result cache, so memory usage does not depend on the table size.
+    """
+    model, fields = EXPORT_RESOURCES[resource]
+    return model.objects.order_by('id').values_list(*fields).iterator(chunk_size=chunk_size)
+
+
+def render_ndjson(fields, rows, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Yields the rows as newline delimited JSON objects, grouped in chunks of chunk_size lines.
+    """
+    encoder = DjangoJSONEncoder(ensure_ascii=False)
+    for batch in _batched(rows, chunk_size):
+        yield ''.join(encoder.encode(dict(zip(fields, row))) + '\n' for row in batch).encode('utf-8')
+
+
+def render_csv(fields, rows, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Yields the header line followed by the rows as CSV, grouped in chunks of chunk_size lines.
+    """
+    writer = csv.writer(_Echo())
+    yield writer.writerow(fields).encode('utf-8')
+    for batch in _batched(rows, chunk_size):
+        yield ''.join(writer.writerow(row) for row in batch).encode('utf-8')
+
+
+def gzip_stream(chunks):
+    """
+    Compresses a stream of byte chunks on the fly into a single gzip member.
+    """
+    compressor = zlib.compressobj(wbits=16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def stream_export(resource, output_format='ndjson', compress=False, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Returns an iterator of byte chunks with the whole resource rendered in the requested format.
+    Nothing is read from the database until the iterator is consumed.
+    """
+    _, fields = EXPORT_RESOURCES[resource]
+    rows = iter_rows(resource, chunk_size)
+    render = render_csv if output_format == 'csv' else render_ndjson
+    chunks = render(fields, rows, chunk_size)
+    if compress:
+        chunks = gzip_stream(chunks)
+    return chunks
+
+
+async def astream_export(resource, output_format='ndjson', compress=False, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Async counterpart of stream_export for requests served under ASGI.
+
+    Each chunk is produced with sync_to_async in the thread that owns the database connection, so the
+    event loop is free while the rows are read and every chunk is sent as soon as it is ready instead of
+    the whole export being collected first.
+    """
+    chunks = stream_export(resource, output_format, compress, chunk_size)
+    next_chunk = sync_to_async(next)
+    try:
+        while (chunk := await next_chunk(chunks, None)) is not None:
+            yield chunk
+    finally:
+        await sync_to_async(chunks.close)()
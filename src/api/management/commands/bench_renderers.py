@@ -0,0 +1,41 @@
+import gzip
+import time
+
+from django.core.management.base import BaseCommand
+from rest_framework.renderers import JSONRenderer
+
+from api.renderers import ORJSONRenderer, MessagePackRenderer
+from api.serializers import TripListSerializer
+from trip.models import Trip
+
+
+class Command(BaseCommand):
+    help = (
+        'Compares the encode time and size of a large TripListSerializer payload with the default DRF JSON renderer, '
+        'the orjson renderer and the MessagePack renderer.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--trips', type=int, default=5000, help='Number of trips in the payload.')
+        parser.add_argument('--repeat', type=int, default=20)
+
+    def handle(self, *args, **options):
+        trips = (
+            Trip.objects.select_related('origin_city__state', 'destination_city__state', 'vehicle')
+            .prefetch_related('trip_participants__user', 'stops')[:options['trips']]
+        )
+        data = TripListSerializer(trips, many=True).data
+        if not data:
+            self.stderr.write('There are no trips to serialize')
+            return
+        if len(data) < options['trips']: # repeat the rows to reach the requested size
+            data = (data * (options['trips'] // len(data) + 1))[:options['trips']]
+            self.stdout.write(f'Only {len(set(row["id"] for row in data))} trips in the database, rows repeated to reach {len(data)}')
+
+        self.stdout.write(f"{'renderer':<14}{'ms/encode':>12}{'bytes':>12}{'gzip bytes':>12}")
+        for name, renderer in (('drf-json', JSONRenderer()), ('orjson', ORJSONRenderer()), ('msgpack', MessagePackRenderer())):
+            start = time.perf_counter()
+            for _ in range(options['repeat']):
+                body = renderer.render(data, renderer.media_type, {})
+            elapsed = (time.perf_counter() - start) * 1000 / options['repeat']
+            self.stdout.write(f'{name:<14}{elapsed:>12.2f}{len(body):>12}{len(gzip.compress(body)):>12}')
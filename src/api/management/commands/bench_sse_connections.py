@@ -0,0 +1,68 @@
+import asyncio
+import statistics
+import time
+from urllib.parse import urlsplit
+
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = (
+        'Opens many idle Server-Sent Events connections against a running ASGI server and keeps them open, '
+        'reporting how many connected, how long it took and how many events or keep-alives each one received.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', default='http://localhost:8000/api/events/')
+        parser.add_argument('--token', required=True, help='JWT access token used by every connection.')
+        parser.add_argument('--connections', type=int, default=2000)
+        parser.add_argument('--duration', type=float, default=60, help='Seconds to keep the connections open.')
+        parser.add_argument('--ramp', type=int, default=200, help='Connections opened concurrently while ramping up.')
+
+    def handle(self, *args, **options):
+        asyncio.run(self.run(options))
+
+    async def run(self, options):
+        url = urlsplit(options['url'])
+        request = (
+            f"GET {url.path}?token={options['token']} HTTP/1.1\r\n"
+            f"Host: {url.netloc}\r\nAccept: text/event-stream\r\n\r\n"
+        ).encode()
+        stats = {'connect_ms': [], 'failed': 0, 'messages': 0, 'dropped': 0}
+        deadline = time.perf_counter() + options['duration']
+        ramp = asyncio.Semaphore(options['ramp'])
+
+        async def client():
+            start = time.perf_counter()
+            try:
+                async with ramp:
+                    reader, writer = await asyncio.open_connection(url.hostname, url.port or 80)
+                    writer.write(request)
+                    status_line = await reader.readline()
+                if b' 200 ' not in status_line:
+                    stats['failed'] += 1
+                    writer.close()
+                    return
+                stats['connect_ms'].append((time.perf_counter() - start) * 1000)
+                while (remaining := deadline - time.perf_counter()) > 0:
+                    try:
+                        line = await asyncio.wait_for(reader.readline(), timeout=remaining)
+                    except asyncio.TimeoutError:
+                        break
+                    if not line:
+                        stats['dropped'] += 1
+                        break
+                    if line.startswith((b'data:', b': keep-alive')):
+                        stats['messages'] += 1
+                writer.close()
+            except OSError:
+                stats['failed'] += 1
+
+        await asyncio.gather(*(client() for _ in range(options['connections'])))
+
+        connected = stats['connect_ms']
+        self.stdout.write(f"connected: {len(connected)}/{options['connections']} (failed {stats['failed']}, dropped {stats['dropped']})")
+        if len(connected) > 1:
+            percentiles = statistics.quantiles(connected, n=100)
+            self.stdout.write(f'connect time ms: p50 {percentiles[49]:.1f} p99 {percentiles[98]:.1f}')
+        self.stdout.write(f"events and keep-alives received: {stats['messages']}")
@@ -0,0 +1,67 @@
+import os
+import subprocess
+import sys
+import time
+
+from django.core.management.base import BaseCommand
+
+COLD_BOOT = '''
+import os, sys, time
+start = time.perf_counter()
+import django
+django.setup()
+from django.core.wsgi import get_wsgi_application
+from django.test import Client
+get_wsgi_application()
+Client().get(sys.argv[1])
+print((time.perf_counter() - start) * 1000)
+'''
+
+
+class Command(BaseCommand):
+    help = (
+        'Compares the time a worker needs to serve its first request when it boots cold (new interpreter, '
+        'no preloading) and when it is forked from a master that already loaded and warmed up the application.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--path', default='/api/trips/', help='Path of the first request.')
+        parser.add_argument('--runs', type=int, default=5)
+
+    def handle(self, *args, **options):
+        cold = [self.cold_boot(options['path']) for _ in range(options['runs'])]
+
+        from django.core.wsgi import get_wsgi_application
+        from carpool.warmup import warm_up
+        get_wsgi_application()
+        warm_up()
+        warm = [self.warm_boot(options['path']) for _ in range(options['runs'])]
+
+        self.stdout.write(f"{'boot':<8}{'min ms':>10}{'avg ms':>10}{'max ms':>10}")
+        for name, values in (('cold', cold), ('warm', warm)):
+            self.stdout.write(f'{name:<8}{min(values):>10.1f}{sum(values) / len(values):>10.1f}{max(values):>10.1f}')
+
+    def cold_boot(self, path):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, '-c', COLD_BOOT, path], check=True, capture_output=True, env=os.environ.copy())
+        return (time.perf_counter() - start) * 1000
+
+    def warm_boot(self, path):
+        from django.test import Client
+
+        read_fd, write_fd = os.pipe()
+        start = time.perf_counter()
+        pid = os.fork()
+        if pid == 0: # worker: serve the first request and exit
+            os.close(read_fd)
+            try:
+                Client().get(path)
+            finally:
+                os.write(write_fd, b'done')
+                os._exit(0)
+        os.close(write_fd)
+        os.read(read_fd, 4)
+        elapsed = (time.perf_counter() - start) * 1000
+        os.close(read_fd)
+        os.waitpid(pid, 0)
+        return elapsed
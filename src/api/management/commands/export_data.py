@@ -0,0 +1,27 @@
+import sys
+
+from django.core.management.base import BaseCommand
+
+from api.exports import EXPORT_RESOURCES, EXPORT_FORMATS, DEFAULT_CHUNK_SIZE, stream_export
+
+
+class Command(BaseCommand):
+    help = 'Streams every row of a resource as NDJSON or CSV to a file or to stdout, with constant memory usage.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('resource', choices=sorted(EXPORT_RESOURCES))
+        parser.add_argument('--output-format', choices=EXPORT_FORMATS, default='ndjson')
+        parser.add_argument('--gzip', action='store_true', help='Compress the output with gzip.')
+        parser.add_argument('--file', help='Path of the output file. Defaults to stdout.')
+        parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE)
+
+    def handle(self, *args, **options):
+        chunks = stream_export(options['resource'], options['output_format'], options['gzip'], options['chunk_size'])
+        if options['file']:
+            with open(options['file'], 'wb') as output:
+                for chunk in chunks:
+                    output.write(chunk)
+        else:
+            for chunk in chunks:
+                sys.stdout.buffer.write(chunk)
+            sys.stdout.buffer.flush()
@@ -0,0 +1,27 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+from django.utils import timezone
+
+from api.models import ChangeLogEntry
+
+
+class Command(BaseCommand):
+    help = 'Deletes the sync change log entries older than the given number of days. Clients with an older token get a full snapshot.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=30)
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(days=options['days'])
+        # the entries are deleted up to the first one kept, in the (xid, id) order of the sync tokens, so a token
+        # that points past the pruned entries never misses one (see api/sync.py)
+        first_kept = ChangeLogEntry.objects.filter(created_at__gte=cutoff).order_by('xid', 'id').values_list('xid', 'id').first()
+        if first_kept is None:
+            entries = ChangeLogEntry.objects.filter(created_at__lt=cutoff)
+        else:
+            xid, entry_id = first_kept
+            entries = ChangeLogEntry.objects.filter(Q(xid__lt=xid) | Q(xid=xid, id__lt=entry_id))
+        deleted, _ = entries.delete()
+        self.stdout.write(self.style.SUCCESS(f'{deleted} change log entries deleted'))
@@ -0,0 +1,33 @@
+# Generated by Django 5.1.3 on 2026-10-19 06:27
+
+import api.models
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0001_changelogentry'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='changelogentry',
+            name='api_changel_user_id_35bde4_idx',
+        ),
+        migrations.AddField(
+            model_name='changelogentry',
+            name='xid',
+            field=models.BigIntegerField(db_default=api.models.CurrentTransactionId(), editable=False, verbose_name='Transacción'),
+        ),
+        migrations.AddIndex(
+            model_name='changelogentry',
+            index=models.Index(fields=['user', 'xid', 'id'], name='api_changel_user_id_5ec44d_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='changelogentry',
+            index=models.Index(fields=['xid', 'id'], name='api_changel_xid_d4706d_idx'),
+        ),
+    ]
@@ -1,3 +1,57 @@
 from django.db import models
 
-# Create your models here.
+from authentication.models import CustomUser
+
+
+class CurrentTransactionId(models.Func):
+    """
+    The id of the transaction that runs the statement on PostgreSQL, as a 64-bit xid8 cast to bigint.
+    Other databases commit their transactions one at a time in id order, so they store 0.
+    """
+    output_field = models.BigIntegerField()
+
+    def as_sql(self, compiler, connection, **extra_context):
+        return '0', []
+
+    def as_postgresql(self, compiler, connection, **extra_context):
+        return '(pg_current_xact_id()::text::bigint)', []
+
+
+class ChangeLogEntry(models.Model):
+    """
+    ChangeLogEntry model representing a change of a row that is visible to a user, used by the sync endpoint.
+    
+    One entry is written per affected user when a Trip, TripJoinRequest, TripParticipant or Vehicle
+    is saved or deleted (see api/signals.py), so the changes of a user can be read with a single indexed
+    range scan on (user, xid, id).
+    
+    Attributes:
+        - user (ForeignKey): The user that can see the change.
+        - model (CharField): The kind of row that changed.
+        - object_id (BigIntegerField): The primary key of the row that changed.
+        - action (CharField): Whether the row was created/updated or deleted.
+        - created_at (DateTimeField): The date and time of the change.
+        - xid (BigIntegerField): The id of the transaction that wrote the entry, set by the database. Together with
+          the id it orders the entries for the sync watermark (see api/sync.py).
+    
+    Attributes inherits from Model:
+        - id (AutoField): The primary key for the entry.
+    """
+    MODEL_CHOICES = [('trip', 'Trip'), ('join_request', 'Join request'), ('participant', 'Participant'), ('vehicle', 'Vehicle')]
+    ACTION_CHOICES = [('upsert', 'Upsert'), ('delete', 'Delete')]
+
+    user = models.ForeignKey(CustomUser, related_name='+', on_delete=models.CASCADE, verbose_name='Usuario')
+    model = models.CharField(max_length=20, choices=MODEL_CHOICES, verbose_name='Modelo')
+    object_id = models.BigIntegerField(verbose_name='ID del objeto')
+    action = models.CharField(max_length=10, choices=ACTION_CHOICES, verbose_name='Acción')
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True, verbose_name='Fecha de creación')
+    xid = models.BigIntegerField(db_default=CurrentTransactionId(), editable=False, verbose_name='Transacción')
+
+    def __str__(self):
+        return f"{self.action} {self.model} {self.object_id} for user {self.user_id}"
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'xid', 'id']),
+            models.Index(fields=['xid', 'id']),
+        ]
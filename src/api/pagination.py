@@ -0,0 +1,126 @@
+"""
+Project-wide pagination.
+
+Every list endpoint is paginated with a default page size of PAGE_SIZE and a `page_size` query parameter
+capped at PAGINATION_MAX_PAGE_SIZE.
+
+The total count of the page envelope never runs an exact COUNT(*) over a whole big table on every request:
+    - An unfiltered list on PostgreSQL uses the planner estimate of the table (pg_class.reltuples) once it
+      is above PAGINATION_ESTIMATE_THRESHOLD rows.
+    - Other unfiltered lists run the COUNT(*) once and keep it in the cache for PAGINATION_COUNT_CACHE_TIMEOUT
+      seconds, keyed by the SQL of the query.
+    - Filtered lists (the rows of a user, of a trip) are counted exactly, through the index of the filter.
+
+A list is unfiltered when its query has no WHERE clause, or when the view lists its action in
+`unfiltered_count_actions`: the lists whose only filter is the soft delete one (Trip.objects, the active users)
+are whole tables for counting purposes, the few soft-deleted rows are in the estimate and out of the cached count.
+
+An estimated or cached count is only informational: the pages of those lists read one row past the page size to
+know whether there is a next page, so a stale count never hides a page or answers 404 for one that has rows.
+"""
+import hashlib
+from functools import partial
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.paginator import EmptyPage, Page, PageNotAnInteger, Paginator
+from django.db import connections
+from django.utils.functional import cached_property
+from rest_framework.pagination import PageNumberPagination
+
+
+def estimate_table_rows(model, using='default'):
+    """
+    Returns the number of rows of the model table estimated by PostgreSQL, or None if there is no estimate.
+    The estimate is refreshed by VACUUM and ANALYZE (autovacuum runs them on busy tables).
+    """
+    connection = connections[using]
+    if connection.vendor != 'postgresql':
+        return None
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass', [model._meta.db_table])
+        row = cursor.fetchone()
+    if row is None or row[0] < 0: # -1 until the table is analyzed for the first time
+        return None
+    return row[0]
+
+
+class LookaheadPage(Page):
+    """
+    Page read with one row past its end, so it knows whether there is a next page without relying on the count.
+    """
+    def __init__(self, object_list, number, paginator, has_next):
+        super().__init__(object_list, number, paginator)
+        self._has_next = has_next
+
+    def has_next(self):
+        return self._has_next
+
+    def next_page_number(self):
+        return self.number + 1
+
+    def previous_page_number(self):
+        return self.number - 1
+
+    def end_index(self):
+        return self.start_index() + len(self.object_list) - 1
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Paginator whose count is estimated or cached on unfiltered tables, or on the querysets flagged as unfiltered
+    by the view. The pages of those lists are read with LIMIT page size + 1 and OFFSET and never validated against
+    the count, so an estimated count only affects the totals.
+    """
+    def __init__(self, *args, unfiltered=False, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.unfiltered = unfiltered
+
+    @cached_property
+    def estimated(self):
+        queryset = self.object_list
+        return hasattr(queryset, 'query') and (not queryset.query.where or self.unfiltered)
+
+    @cached_property
+    def count(self):
+        if not self.estimated:
+            return super().count
+        queryset = self.object_list
+        estimate = estimate_table_rows(queryset.model, queryset.db)
+        if estimate is not None and estimate >= getattr(settings, 'PAGINATION_ESTIMATE_THRESHOLD', 100000):
+            return estimate
+        key = 'pagination-count:' + hashlib.sha1(str(queryset.query).encode()).hexdigest()
+        count = cache.get(key)
+        if count is None:
+            count = queryset.count()
+            cache.set(key, count, getattr(settings, 'PAGINATION_COUNT_CACHE_TIMEOUT', 60))
+        return count
+
+    def page(self, number):
+        if not self.estimated:
+            return super().page(number)
+        try:
+            number = int(number)
+        except (TypeError, ValueError):
+            raise PageNotAnInteger(self.error_messages['invalid_page'])
+        if number < 1:
+            raise EmptyPage(self.error_messages['min_page'])
+        bottom = (number - 1) * self.per_page
+        rows = list(self.object_list[bottom:bottom + self.per_page + 1])
+        if not rows and number > 1:
+            raise EmptyPage(self.error_messages['no_results'])
+        return LookaheadPage(rows[:self.per_page], number, self, len(rows) > self.per_page)
+
+
+class StandardPagination(PageNumberPagination):
+    django_paginator_class = EstimatedCountPaginator
+    page_size_query_param = 'page_size'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        unfiltered = getattr(view, 'action', None) in getattr(view, 'unfiltered_count_actions', ())
+        self.django_paginator_class = partial(EstimatedCountPaginator, unfiltered=unfiltered)
+        return super().paginate_queryset(queryset, request, view)
+
+    @property
+    def max_page_size(self):
+        return getattr(settings, 'PAGINATION_MAX_PAGE_SIZE', 200)
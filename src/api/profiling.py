@@ -0,0 +1,147 @@
+"""
+On-demand profiling of single requests in production.
+
+A staff user profiles a request by sending the X-Profile header or the `_profile` query flag with one of:
+
+    - `inline`: the response body is replaced by the plain text report (the status of the original response is
+      kept in the X-Profile-Status header).
+    - anything else: the report is saved to PROFILING_DIR together with the raw cProfile stats (readable with
+      pstats or snakeviz), and the original response gets the name of the report in the X-Profile header.
+
+The report has the total time, every SQL query run on any database with its time, and the functions that took the
+most cumulative time. Profiling is limited to the `profiling` rate of DEFAULT_THROTTLE_RATES per user.
+
+The staff user is taken from the session or from the JWT of the request, which is only authenticated when the
+flag is present. Requests without it only pay a dictionary lookup and a substring test, and the middleware is
+removed from the stack when PROFILING_ENABLED is False. The profiler only covers the view; the body of a
+streaming response is produced after it stops.
+"""
+import cProfile
+import io
+import pstats
+import time
+import uuid
+from contextlib import ExitStack
+from pathlib import Path
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.http import HttpResponse
+from django.utils import timezone
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.authentication import JWTAuthentication
+
+from authentication.throttling import SlidingWindowThrottle
+
+PROFILE_HEADER = 'HTTP_X_PROFILE'
+PROFILE_PARAM = '_profile'
+
+
+class ProfilingThrottle(SlidingWindowThrottle):
+    scope = 'profiling'
+
+    def get_cache_key(self, request, view):
+        return self.cache_format % {'scope': self.scope, 'ident': request.profiling_user.pk}
+
+
+class QueryRecorder:
+    """
+    Database execute wrapper that records the SQL and the duration of every query.
+    """
+    def __init__(self, alias):
+        self.alias = alias
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries.append((time.perf_counter() - start, sql))
+
+
+def _get_staff_user(request):
+    user = getattr(request, 'user', None)
+    if user is not None and user.is_authenticated:
+        return user if user.is_staff else None
+    try:
+        authenticated = JWTAuthentication().authenticate(request)
+    except AuthenticationFailed:
+        return None
+    if authenticated is None or not authenticated[0].is_staff:
+        return None
+    return authenticated[0]
+
+
+def build_report(request, response, elapsed, recorders, profiler):
+    queries = [(recorder.alias, duration, sql) for recorder in recorders for duration, sql in recorder.queries]
+    sql_time = sum(duration for _, duration, _ in queries)
+    lines = [
+        f'{request.method} {request.get_full_path()} -> {response.status_code}',
+        f'Total: {elapsed * 1000:.1f} ms, SQL: {len(queries)} queries in {sql_time * 1000:.1f} ms',
+        '',
+        'SQL queries:',
+    ]
+    limit = getattr(settings, 'PROFILING_MAX_QUERIES', 200)
+    lines.extend(f'{index:4}. [{alias}] {duration * 1000:8.2f} ms  {sql}' for index, (alias, duration, sql) in enumerate(queries[:limit], 1))
+    if len(queries) > limit:
+        lines.append(f'... {len(queries) - limit} more')
+    stream = io.StringIO()
+    stats = pstats.Stats(profiler, stream=stream)
+    stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(getattr(settings, 'PROFILING_TOP_FUNCTIONS', 40))
+    lines.extend(['', 'Functions by cumulative time:', stream.getvalue()])
+    return '\n'.join(lines)
+
+
+class ProfilingMiddleware:
+    """
+    Runs the requests flagged by staff users under cProfile, recording their SQL queries.
+    Must be placed after AuthenticationMiddleware.
+    """
+    def __init__(self, get_response):
+        if not getattr(settings, 'PROFILING_ENABLED', True):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if PROFILE_HEADER not in request.META and PROFILE_PARAM not in request.META.get('QUERY_STRING', ''):
+            return self.get_response(request)
+        mode = request.META.get(PROFILE_HEADER) or request.GET.get(PROFILE_PARAM)
+        if not mode:
+            return self.get_response(request)
+        request.profiling_user = _get_staff_user(request)
+        if request.profiling_user is None:
+            return self.get_response(request)
+        if not ProfilingThrottle().allow_request(request, None):
+            response = self.get_response(request)
+            response['X-Profile'] = 'throttled'
+            return response
+        return self.profile(request, mode)
+
+    def profile(self, request, mode):
+        recorders = [QueryRecorder(connection.alias) for connection in connections.all()]
+        profiler = cProfile.Profile()
+        with ExitStack() as stack:
+            for connection, recorder in zip(connections.all(), recorders):
+                stack.enter_context(connection.execute_wrapper(recorder))
+            start = time.perf_counter()
+            profiler.enable()
+            try:
+                response = self.get_response(request)
+            finally:
+                profiler.disable()
+            elapsed = time.perf_counter() - start
+        report = build_report(request, response, elapsed, recorders, profiler)
+
+        if mode == 'inline':
+            inline = HttpResponse(report, content_type='text/plain; charset=utf-8')
+            inline['X-Profile-Status'] = response.status_code
+            return inline
+        directory = Path(getattr(settings, 'PROFILING_DIR', settings.BASE_DIR / 'profiles'))
+        directory.mkdir(parents=True, exist_ok=True)
+        name = f"{timezone.now():%Y%m%d-%H%M%S}-{request.profiling_user.pk}-{uuid.uuid4().hex[:8]}"
+        (directory / f'{name}.txt').write_text(report, encoding='utf-8')
+        profiler.dump_stats(directory / f'{name}.prof')
+        response['X-Profile'] = name
+        return response
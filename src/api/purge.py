@@ -0,0 +1,191 @@
+"""
+Soft deletion and background purge of users and trips.
+
+Deleting a user or a trip through the API only marks it as deleted (and hides it) in a couple of UPDATEs, then
+enqueues a purge job. The job deletes the dependent rows table by table with raw set-based statements of the form
+
+    DELETE FROM table WHERE id IN (SELECT id FROM table WHERE <filter> LIMIT PURGE_BATCH_SIZE)
+
+each one in its own transaction, so no statement holds locks on many rows for long and nothing is loaded into
+memory. After PURGE_BATCHES_PER_JOB batches the job enqueues itself again and returns. Every step only looks at
+the rows that are left, so a purge interrupted at any point resumes where it stopped when its job is retried.
+Once the heavy tables are empty, the user or trip row itself is deleted.
+"""
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from authentication.models import CustomUser
+from jobs.queue import enqueue
+from review.models import Review
+from trip.clusters import remove_trips_from_map
+from trip.models import Trip, TripParticipant, TripJoinRequest, TripStop, Vehicle, Notification
+from trip.rollups import rebuild_pending_requests, remove_trips_from_route_stats
+from trip.stops import release_segment
+from .caching import invalidate_on_commit
+from .models import ChangeLogEntry
+
+
+def _batch_size():
+    return getattr(settings, 'PURGE_BATCH_SIZE', 1000)
+
+
+def _table(model):
+    return connection.ops.quote_name(model._meta.db_table)
+
+
+def _column(model, field_name):
+    return connection.ops.quote_name(model._meta.get_field(field_name).column)
+
+
+def _delete_batch(model, where, params):
+    """
+    Deletes up to PURGE_BATCH_SIZE rows of the model matching the SQL condition and returns how many were deleted.
+    """
+    table, pk = _table(model), _column(model, model._meta.pk.name)
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {table} WHERE {pk} IN (SELECT {pk} FROM {table} WHERE {where} LIMIT %s)', [*params, _batch_size()])
+        return cursor.rowcount
+
+
+def _delete_ids(model, ids):
+    table, pk = _table(model), _column(model, model._meta.pk.name)
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {table} WHERE {pk} IN ({", ".join(["%s"] * len(ids))})', list(ids))
+        return cursor.rowcount
+
+
+def _of_trip(model):
+    return f"{_column(model, 'trip')} = %s"
+
+
+def _of_trips_created_by(model):
+    return f"{_column(model, 'trip')} IN (SELECT {_column(Trip, 'id')} FROM {_table(Trip)} WHERE {_column(Trip, 'creator')} = %s)"
+
+
+def _delete_join_requests_of_user(user_id):
+    """
+    Deletes a batch of the join requests the user sent to other trips, freeing the seats of the accepted ones
+    and fixing the counters and versions of their trips.
+    """
+    requests = list(
+        TripJoinRequest.objects.filter(user_id=user_id).exclude(trip_creator_id=user_id)
+        .values_list('id', 'trip_id', 'status', 'pickup_city_id', 'dropoff_city_id')[:_batch_size()]
+    )
+    if not requests:
+        return 0
+    with transaction.atomic():
+        for _, trip_id, status, pickup_city_id, dropoff_city_id in requests:
+            if status == 'accepted':
+                release_segment(trip_id, pickup_city_id, dropoff_city_id)
+        _delete_ids(TripJoinRequest, [row[0] for row in requests])
+        trip_ids = {row[1] for row in requests}
+        rebuild_pending_requests(trip_ids)
+        Trip.all_objects.filter(pk__in=trip_ids).update(version=F('version') + 1)
+    return len(requests)
+
+
+def _detach_vehicles(user_id):
+    # trips of other users that reference one of the user's vehicles keep existing without it (SET_NULL)
+    return Trip.all_objects.filter(vehicle__owner_id=user_id).exclude(creator_id=user_id).update(vehicle=None)
+
+
+def _delete_user_row(user_id):
+    # the remaining small relations (emails, social accounts, tokens, permissions, route subscriptions) go through the ORM
+    CustomUser.objects.filter(pk=user_id, deleted_at__isnull=False).delete()
+    return 0
+
+
+def trip_purge_steps(trip_id):
+    return [
+        lambda: _delete_batch(Review, _of_trip(Review), [trip_id]),
+        lambda: _delete_batch(Notification, _of_trip(Notification), [trip_id]),
+        lambda: _delete_batch(TripStop, _of_trip(TripStop), [trip_id]),
+        lambda: _delete_batch(TripParticipant, _of_trip(TripParticipant), [trip_id]),
+        lambda: _delete_batch(TripJoinRequest, _of_trip(TripJoinRequest), [trip_id]),
+        lambda: _delete_batch(Trip, f"{_column(Trip, 'id')} = %s AND {_column(Trip, 'deleted_at')} IS NOT NULL", [trip_id]),
+    ]
+
+
+def user_purge_steps(user_id):
+    return [
+        # the trips the user created, with everything that hangs from them
+        lambda: _delete_batch(Review, _of_trips_created_by(Review), [user_id]),
+        lambda: _delete_batch(Notification, _of_trips_created_by(Notification), [user_id]),
+        lambda: _delete_batch(TripStop, _of_trips_created_by(TripStop), [user_id]),
+        lambda: _delete_batch(TripParticipant, _of_trips_created_by(TripParticipant), [user_id]),
+        lambda: _delete_batch(TripJoinRequest, _of_trips_created_by(TripJoinRequest), [user_id]),
+        lambda: _delete_batch(Trip, f"{_column(Trip, 'creator')} = %s", [user_id]),
+        # the rows of the user in the trips of other users
+        lambda: _delete_join_requests_of_user(user_id),
+        lambda: _delete_batch(TripParticipant, f"{_column(TripParticipant, 'user')} = %s", [user_id]),
+        lambda: _delete_batch(Review, f"{_column(Review, 'user')} = %s", [user_id]),
+        lambda: _delete_batch(Review, f"{_column(Review, 'reviewer')} = %s", [user_id]),
+        lambda: _detach_vehicles(user_id),
+        lambda: _delete_batch(Vehicle, f"{_column(Vehicle, 'owner')} = %s", [user_id]),
+        lambda: _delete_batch(ChangeLogEntry, f"{_column(ChangeLogEntry, 'user')} = %s", [user_id]),
+        lambda: _delete_batch(Notification, f"{_column(Notification, 'user')} = %s", [user_id]),
+        lambda: _delete_user_row(user_id),
+    ]
+
+
+def run_purge(steps, max_batches):
+    """
+    Runs the steps in order, each one until it deletes less than a full batch, and stops after max_batches
+    full batches. Returns True when every step is done.
+    """
+    batches = 0
+    for step in steps:
+        while step() >= _batch_size():
+            batches += 1
+            if batches >= max_batches:
+                return False
+    return True
+
+
+def _log_trip_deletes(trips, creator_id):
+    """
+    Records the deletion of the trips in the change log of their participants and requesters, like the api
+    signals do for a single trip, since the trips are hidden with a queryset update.
+    """
+    audience = set(TripParticipant.objects.filter(trip__in=trips).values_list('trip_id', 'user_id'))
+    audience.update(TripJoinRequest.objects.filter(trip__in=trips).values_list('trip_id', 'user_id'))
+    ChangeLogEntry.objects.bulk_create(
+        (ChangeLogEntry(user_id=user_id, model='trip', object_id=trip_id, action='delete') for trip_id, user_id in audience if user_id != creator_id),
+        batch_size=1000,
+    )
+
+
+def soft_delete_trip(trip):
+    """
+    Hides the trip and enqueues its purge. The requests of the trip lose their creator, which takes them out of
+    the inbox of the driver without a join through the trip.
+    """
+    from .tasks import purge_trip
+
+    with transaction.atomic():
+        trip.deleted_at = timezone.now()
+        trip.save(update_fields=['deleted_at'])
+        TripJoinRequest.objects.filter(trip=trip).update(trip_creator=None)
+        enqueue(purge_trip, trip.pk)
+
+
+def soft_delete_user(user):
+    """
+    Deactivates the user, hides the trips it created and enqueues the purge of everything it owns.
+    """
+    from .tasks import purge_user
+
+    now = timezone.now()
+    with transaction.atomic():
+        CustomUser.objects.filter(pk=user.pk).update(is_active=False, deleted_at=now)
+        trips = Trip.objects.filter(creator=user)
+        remove_trips_from_route_stats(trips)
+        remove_trips_from_map(trips)
+        _log_trip_deletes(trips, user.pk)
+        trips.update(deleted_at=now, version=F('version') + 1)
+        TripJoinRequest.objects.filter(trip_creator=user).update(trip_creator=None)
+        invalidate_on_commit(f'user:{user.pk}', 'trips')
+        enqueue(purge_user, user.pk)
+    user.is_active, user.deleted_at = False, now
@@ -0,0 +1,160 @@
+"""
+Pub/sub fan-out of row changes to the users connected to the events endpoint (see api/sse.py).
+
+The broker class is loaded from the PUSH_BROKER setting:
+
+    - InProcessBroker (the default) only reaches the connections held by the current process, so it only works
+      with a single worker process, as in development.
+    - PostgresBroker sends every event through a Postgres NOTIFY channel, and each process LISTENs on it and hands
+      the events to its own connections, so it works with any number of workers (and is the one used in
+      production, see docker-compose.prod.yml).
+
+A broker backed by another shared service (e.g. Redis pub/sub) can be added by implementing the same
+subscribe/unsubscribe/publish methods. Events are best effort with every broker: a client that misses some
+(full queue, listener reconnecting) catches up with the sync endpoint.
+"""
+import asyncio
+import json
+import logging
+import os
+import select
+import threading
+import time
+
+from django.conf import settings
+from django.db import connections, transaction
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger(__name__)
+
+
+class InProcessBroker:
+    """
+    Broker that keeps one bounded asyncio queue per connection in memory.
+
+    publish() can be called from any thread: the events are handed to the event loop of each
+    subscriber with call_soon_threadsafe. When the queue of a slow subscriber is full the event is dropped
+    for that subscriber, which can catch up with the sync endpoint.
+    """
+    def __init__(self, queue_size=100):
+        self.queue_size = queue_size
+        self._subscribers = {}
+        self._lock = threading.Lock()
+
+    def subscribe(self, user_id) -> asyncio.Queue:
+        queue = asyncio.Queue(maxsize=self.queue_size)
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            self._subscribers.setdefault(user_id, {})[queue] = loop
+        return queue
+
+    def unsubscribe(self, user_id, queue):
+        with self._lock:
+            queues = self._subscribers.get(user_id, {})
+            queues.pop(queue, None)
+            if not queues:
+                self._subscribers.pop(user_id, None)
+
+    def publish(self, user_ids, event):
+        with self._lock:
+            targets = [(queue, loop) for user_id in user_ids for queue, loop in self._subscribers.get(user_id, {}).items()]
+        for queue, loop in targets:
+            loop.call_soon_threadsafe(self._put, queue, event)
+
+    def connection_count(self) -> int:
+        with self._lock:
+            return sum(len(queues) for queues in self._subscribers.values())
+
+    @staticmethod
+    def _put(queue, event):
+        try:
+            queue.put_nowait(event)
+        except asyncio.QueueFull:
+            pass
+
+
+class PostgresBroker(InProcessBroker):
+    """
+    Broker that fans the events out to every process through the PUSH_CHANNEL Postgres channel.
+
+    publish() runs pg_notify on the default database connection. Each process starts, on its first subscriber,
+    a thread with its own connection that LISTENs on the channel and delivers the notifications to the local
+    subscribers like InProcessBroker. NOTIFY payloads are limited to 8000 bytes, so the recipients of an event
+    are split over several notifications when needed.
+    """
+    MAX_USERS_PER_NOTIFY = 500
+    POLL_SECONDS = 5
+
+    def __init__(self, queue_size=100):
+        super().__init__(queue_size)
+        self.channel = getattr(settings, 'PUSH_CHANNEL', 'carpool_push')
+        self._listener_pid = None
+
+    def subscribe(self, user_id) -> asyncio.Queue:
+        self._start_listener()
+        return super().subscribe(user_id)
+
+    def publish(self, user_ids, event):
+        user_ids = list(user_ids)
+        with connections['default'].cursor() as cursor:
+            for start in range(0, len(user_ids), self.MAX_USERS_PER_NOTIFY):
+                payload = json.dumps({'users': user_ids[start:start + self.MAX_USERS_PER_NOTIFY], 'event': event})
+                cursor.execute('SELECT pg_notify(%s, %s)', [self.channel, payload])
+
+    def deliver(self, payload):
+        message = json.loads(payload)
+        super().publish(message['users'], message['event'])
+
+    def _start_listener(self):
+        with self._lock:
+            if self._listener_pid == os.getpid(): # a forked worker starts its own
+                return
+            self._listener_pid = os.getpid()
+        threading.Thread(target=self._listen, name='push-listener', daemon=True).start()
+
+    def _listen(self):
+        database = connections['default']
+        while True:
+            listener = None
+            try:
+                listener = database.Database.connect(**database.get_connection_params())
+                listener.autocommit = True
+                with listener.cursor() as cursor:
+                    cursor.execute(f'LISTEN {database.ops.quote_name(self.channel)}')
+                while True:
+                    if select.select([listener], [], [], self.POLL_SECONDS)[0]:
+                        listener.poll()
+                        while listener.notifies:
+                            self.deliver(listener.notifies.pop(0).payload)
+            except Exception:
+                logger.exception('Push listener failed, reconnecting')
+                if listener is not None:
+                    listener.close()
+                time.sleep(1)
+
+
+_broker = None
+_broker_lock = threading.Lock()
+
+
+def get_broker():
+    global _broker
+    if _broker is None:
+        with _broker_lock:
+            if _broker is None:
+                broker_class = import_string(getattr(settings, 'PUSH_BROKER', 'api.push.InProcessBroker'))
+                _broker = broker_class(queue_size=getattr(settings, 'PUSH_QUEUE_SIZE', 100))
+    return _broker
+
+
+def publish_change(model, instance, user_ids, action):
+    """
+    Publishes the change of a row to the given users once the current transaction commits.
+    """
+    event = {'model': model, 'id': instance.pk, 'action': action}
+    if model in ('join_request', 'participant'):
+        event['trip'] = instance.trip_id
+    if model == 'join_request':
+        event['status'] = instance.status
+    user_ids = [user_id for user_id in set(user_ids) if user_id is not None]
+    transaction.on_commit(lambda: get_broker().publish(user_ids, event))
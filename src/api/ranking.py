@@ -0,0 +1,114 @@
+import heapq
+from datetime import timedelta
+
+import numpy as np
+from django.db.models import Avg, Count
+from django.utils import timezone
+
+from review.models import Review
+from trip.geo import bounding_box, haversine_km
+from trip.models import Trip
+
+
+MAX_CANDIDATES = 5000
+
+# Weights of each component of the score. Every component is normalized to [0, 1].
+WEIGHTS = {
+    'distance': 0.45,
+    'time': 0.30,
+    'preferences': 0.15,
+    'rating': 0.10,
+}
+DISTANCE_SCALE_KM = 25.0 # a trip leaving 25 km away from the desired city loses ~63% of the distance score
+TIME_SCALE_HOURS = 6.0
+RATING_PRIOR_MEAN = 3.0 # ratings are shrunk towards this mean until the driver has enough reviews
+RATING_PRIOR_WEIGHT = 5
+
+
+def get_candidates(origin, destination, departure, radius_km, window_days):
+    """
+    Returns the values of the upcoming trips leaving near the origin and arriving near the destination within
+    window_days of the desired departure (a timezone-aware datetime). The query only uses range filters on
+    indexed columns.
+
+    On busy routes only the MAX_CANDIDATES trips closest in time to the desired departure are returned: the trips
+    leaving after it and the ones leaving before it are read with two queries ordered by departure_at away from
+    it, and merged by their distance in time.
+    """
+    min_olat, max_olat, min_olon, max_olon = bounding_box(origin.latitude, origin.longitude, radius_km)
+    min_dlat, max_dlat, min_dlon, max_dlon = bounding_box(destination.latitude, destination.longitude, radius_km)
+    trips = Trip.objects.filter(
+        departure_at__range=(max(timezone.now(), departure - timedelta(days=window_days)), departure + timedelta(days=window_days)),
+        origin_city__latitude__range=(min_olat, max_olat),
+        origin_city__longitude__range=(min_olon, max_olon),
+        destination_city__latitude__range=(min_dlat, max_dlat),
+        destination_city__longitude__range=(min_dlon, max_dlon),
+    ).values_list(
+        'id', 'origin_city__latitude', 'origin_city__longitude', 'destination_city__latitude', 'destination_city__longitude',
+        'departure_at', 'pet_allowed', 'smoking_allowed', 'kids_allowed', 'creator_id',
+    )
+    later = list(trips.filter(departure_at__gte=departure).order_by('departure_at', 'id')[:MAX_CANDIDATES])
+    earlier = list(trips.filter(departure_at__lt=departure).order_by('-departure_at', '-id')[:MAX_CANDIDATES])
+    return heapq.nsmallest(MAX_CANDIDATES, later + earlier, key=lambda candidate: abs(candidate[5] - departure))
+
+
+def get_driver_ratings(driver_ids):
+    """
+    Returns the Bayesian average rating of each driver, normalized to [0, 1].
+    """
+    rows = Review.objects.filter(user_id__in=set(driver_ids), rating__isnull=False).values('user_id').annotate(average=Avg('rating'), count=Count('rating'))
+    ratings = {}
+    for row in rows:
+        average = (row['average'] * row['count'] + RATING_PRIOR_MEAN * RATING_PRIOR_WEIGHT) / (row['count'] + RATING_PRIOR_WEIGHT)
+        ratings[row['user_id']] = (average - 1) / 4
+    return ratings
+
+
+def score_candidates(candidates, origin, destination, departure, preferences, ratings):
+    """
+    Returns the score of each candidate as a NumPy array, computed in a single vectorized pass.
+
+    `preferences` maps 'pet_allowed', 'smoking_allowed' and 'kids_allowed' to the value wanted by the passenger,
+    flags missing from the mapping do not affect the score.
+    """
+    columns = list(zip(*candidates))
+    origin_km = haversine_km(origin.latitude, origin.longitude, columns[1], columns[2])
+    destination_km = haversine_km(destination.latitude, destination.longitude, columns[3], columns[4])
+    distance_score = np.exp(-(origin_km + destination_km) / DISTANCE_SCALE_KM)
+
+    timestamps = np.array([departure_at.timestamp() for departure_at in columns[5]], dtype=np.float64)
+    hours = np.abs(timestamps - departure.timestamp()) / 3600
+    time_score = np.exp(-hours / TIME_SCALE_HOURS)
+
+    flags = np.array(columns[6:9], dtype=bool).T
+    wanted = [(index, value) for index, name in enumerate(('pet_allowed', 'smoking_allowed', 'kids_allowed')) if (value := preferences.get(name)) is not None]
+    if wanted:
+        indexes, values = zip(*wanted)
+        preference_score = (flags[:, list(indexes)] == np.array(values, dtype=bool)).mean(axis=1)
+    else:
+        preference_score = np.ones(len(candidates))
+
+    neutral = (RATING_PRIOR_MEAN - 1) / 4
+    rating_score = np.array([ratings.get(driver_id, neutral) for driver_id in columns[9]], dtype=np.float64)
+
+    return (
+        WEIGHTS['distance'] * distance_score
+        + WEIGHTS['time'] * time_score
+        + WEIGHTS['preferences'] * preference_score
+        + WEIGHTS['rating'] * rating_score
+    )
+
+
+def rank_trips(origin, destination, departure, preferences, radius_km=50, window_days=3, limit=20):
+    """
+    Returns the (trip id, score) pairs of the best candidates for the passenger, best first.
+    """
+    candidates = get_candidates(origin, destination, departure, radius_km, window_days)
+    if not candidates:
+        return []
+    ratings = get_driver_ratings(candidate[9] for candidate in candidates)
+    scores = score_candidates(candidates, origin, destination, departure, preferences, ratings)
+    limit = min(limit, len(candidates))
+    best = np.argpartition(-scores, limit - 1)[:limit]
+    best = best[np.argsort(-scores[best], kind='stable')]
+    return [(candidates[index][0], float(scores[index])) for index in best]
@@ -0,0 +1,34 @@
+"""
+Cached list responses of the cities and states.
+
+Both tables are small, change rarely (only through the admin) and are read on almost every screen, so their
+serialized lists are kept in the two-tier cache (see api/caching.py) for REFERENCE_CACHE_TIMEOUT seconds under
+the `states` and `cities` tags, which the signals of those models invalidate.
+"""
+from django.conf import settings
+
+from trip.models import State, City
+from .caching import cache
+from .serializers import StateSerializer, CitySerializer
+
+
+def _timeout():
+    return getattr(settings, 'REFERENCE_CACHE_TIMEOUT', 600)
+
+
+def get_states():
+    return cache.get_or_set(
+        'reference:states',
+        lambda: list(StateSerializer(State.objects.order_by('id'), many=True).data),
+        tags=['states'],
+        timeout=_timeout(),
+    )
+
+
+def get_cities():
+    return cache.get_or_set(
+        'reference:cities',
+        lambda: list(CitySerializer(City.objects.select_related('state').order_by('id'), many=True).data),
+        tags=['cities', 'states'],
+        timeout=_timeout(),
+    )
@@ -0,0 +1,81 @@
+"""
+Renderers and parsers selected by content negotiation (see REST_FRAMEWORK in carpool/settings.py).
+
+- ORJSONRenderer / ORJSONParser: `application/json` encoded and decoded with orjson, which writes the
+  serializer output straight to bytes without building an intermediate string.
+- MessagePackRenderer / MessagePackParser: `application/msgpack`, a compact binary format selected with
+  `Accept: application/msgpack`.
+"""
+import datetime
+import decimal
+import uuid
+
+import msgpack
+import numpy as np
+import orjson
+from django.utils.functional import Promise
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import BaseParser
+from rest_framework.renderers import BaseRenderer
+
+
+def _default(value):
+    """
+    Encodes the values that orjson or msgpack do not support natively the way orjson and the DRF fields do, so both
+    formats decode to the same data: Decimal, UUID and lazy translation strings as strings, dates and times in ISO
+    8601 and numpy values as numbers and lists. Anything else raises TypeError instead of being silently turned
+    into its str().
+    """
+    if isinstance(value, (decimal.Decimal, uuid.UUID, Promise)):
+        return str(value)
+    if isinstance(value, (datetime.datetime, datetime.date, datetime.time)):
+        return value.isoformat()
+    if isinstance(value, (np.generic, np.ndarray)):
+        return value.tolist()
+    raise TypeError(f'Object of type {type(value).__name__} is not serializable')
+
+
+class ORJSONRenderer(BaseRenderer):
+    media_type = 'application/json'
+    format = 'json'
+    charset = None
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        options = orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+        if accepted_media_type and 'indent=' in accepted_media_type:
+            options |= orjson.OPT_INDENT_2
+        return orjson.dumps(data, default=_default, option=options)
+
+
+class ORJSONParser(BaseParser):
+    media_type = 'application/json'
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        try:
+            return orjson.loads(stream.read())
+        except orjson.JSONDecodeError as error:
+            raise ParseError(f'JSON parse error - {error}')
+
+
+class MessagePackRenderer(BaseRenderer):
+    media_type = 'application/msgpack'
+    format = 'msgpack'
+    charset = None
+    render_style = 'binary'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        return msgpack.packb(data, default=_default, use_bin_type=True)
+
+
+class MessagePackParser(BaseParser):
+    media_type = 'application/msgpack'
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        try:
+            return msgpack.unpackb(stream.read(), raw=False)
+        except (msgpack.UnpackException, ValueError) as error:
+            raise ParseError(f'MessagePack parse error - {error}')
@@ -1,12 +1,21 @@
 import re
-from datetime import datetime, timedelta
+from datetime import timedelta
 
+from django.db.models import Max
+from django.utils import timezone
 from rest_framework import serializers
 
 from phonenumber_field.serializerfields import PhoneNumberField
 
 from authentication.models import CustomUser
-from trip.models import State, City, Vehicle, Trip, TripParticipant, TripJoinRequest
+from review.models import Review
+from trip.models import State, City, Vehicle, Trip, TripParticipant, TripJoinRequest, TripStop, RouteDailyStat, RouteSubscription
+from trip.clusters import add_trips_to_map
+from trip.digests import notify_route_subscribers
+from trip.rollups import add_trips_to_route_stats
+from trip.stops import SegmentError, set_trip_stops, get_segment_orders
+from .batch import BATCH_MAX_REQUESTS
+from .bulk import BulkCreateSerializerMixin, BulkListSerializer, BulkPrimaryKeyRelatedField
 
 
 class CustomUserCreateSerializer(serializers.ModelSerializer):
@@ -98,18 +107,20 @@ class CitySerializer(serializers.ModelSerializer):
         read_only_fields = ['id', 'name', 'latitude', 'longitude', 'state']
 
 
-class VehicleDetailSerializer(serializers.ModelSerializer):
+class VehicleDetailSerializer(BulkCreateSerializerMixin, serializers.ModelSerializer):
     """
     Serializer class for creating and updating Vehicle instances.
 
     This serializer handles the serialization and deserialization of Vehicle instances
     for the create, retrieve and update actions, ensuring that all necessary fields are included.
+    It also creates lists of vehicles in the bulk mode (see api/bulk.py).
     Excluded fields: 'owner'.
     """
     class Meta:
         model = Vehicle
         fields = ['id', 'license_plate', 'brand', 'model']
         read_only_fields = ['id']
+        list_serializer_class = BulkListSerializer
 
     def validate_license_plate(self, value):
         if not re.match(r'^(?:[A-Z]{3}\d{3}|[A-Z]{2}\d{3}[A-Z]{2})$', value):
@@ -120,7 +131,8 @@ class VehicleDetailSerializer(serializers.ModelSerializer):
         license_plate = data.get('license_plate')
         owner = self.context['request'].user
 
-        if Vehicle.objects.filter(owner=owner, license_plate=license_plate).exists():
+        # in the bulk mode the unique license plate is already checked for the whole list
+        if not self.in_bulk and Vehicle.objects.filter(owner=owner, license_plate=license_plate).exists():
             raise serializers.ValidationError('El usuario ya cuenta con un vehículo registrado con esa patente') # check if the user already has a vehicle with the same license plate before save
         return data
         
@@ -179,38 +191,103 @@ class TripParticipantListSerializer(serializers.ModelSerializer):
         read_only_fields = ['id', 'user', 'role', 'trip']
         
 
-class TripDetailSerializer(serializers.ModelSerializer):
+class TripStopSerializer(serializers.ModelSerializer):
+    """
+    Serializer class for listing the stops of a trip.
+    """
+    class Meta:
+        model = TripStop
+        fields = ['order', 'city', 'seats_taken']
+        read_only_fields = ['order', 'city', 'seats_taken']
+
+
+class TripDetailSerializer(BulkCreateSerializerMixin, serializers.ModelSerializer):
     """
     Serializer class for creating and updating Trip instances.
 
     This serializer handles the serialization and deserialization of Trip instances
-    for the create, retrieve and update actions.
+    for the create, retrieve and update actions. It also creates lists of trips in the bulk mode (see api/bulk.py).
+    The `stops` field receives the ordered ids of the intermediate cities of the trip.
     """
-    origin_city = serializers.PrimaryKeyRelatedField(queryset=City.objects.all())
-    destination_city = serializers.PrimaryKeyRelatedField(queryset=City.objects.all())
-    vehicle = serializers.PrimaryKeyRelatedField(queryset=Vehicle.objects.all())
+    origin_city = BulkPrimaryKeyRelatedField(queryset=City.objects.all())
+    destination_city = BulkPrimaryKeyRelatedField(queryset=City.objects.all())
+    vehicle = BulkPrimaryKeyRelatedField(queryset=Vehicle.objects.all())
+    stops = BulkPrimaryKeyRelatedField(queryset=City.objects.all(), many=True, required=False, write_only=True)
 
     class Meta:
         model = Trip
-        fields = ['id', 'origin_city', 'destination_city', 'departure_time', 'pet_allowed', 'smoking_allowed', 'kids_allowed', 'vehicle']
+        fields = ['id', 'origin_city', 'destination_city', 'departure_date', 'departure_time', 'pet_allowed', 'smoking_allowed', 'kids_allowed', 'seats', 'vehicle', 'stops']
         read_only_fields = ['id']
+        list_serializer_class = BulkListSerializer
+
+    def validate_stops(self, value):
+        if len(set(value)) != len(value):
+            raise serializers.ValidationError('Las paradas no pueden repetirse')
+        return value
 
     def validate_departure_date(self, value):
-        one_year_from_now = datetime.now().date() + timedelta(days=365)
+        one_year_from_now = timezone.localdate() + timedelta(days=365)
         if value > one_year_from_now:
             raise serializers.ValidationError('La fecha de salida no puede ser superior a un año desde la fecha actual')
         return value
 
     def validate(self, data):
-        departure_date = data.get('departure_date')
-        departure_time = data.get('departure_time')
+        # partial updates are validated against the current values of the trip
+        origin_city = data.get('origin_city', getattr(self.instance, 'origin_city', None))
+        destination_city = data.get('destination_city', getattr(self.instance, 'destination_city', None))
+        departure_date = data.get('departure_date', getattr(self.instance, 'departure_date', None))
+        departure_time = data.get('departure_time', getattr(self.instance, 'departure_time', None))
 
-        if data.get('origin_city') == data.get('destination_city'):
+        if origin_city == destination_city:
             raise serializers.ValidationError('La ciudad de origen y de destino no puede ser la misma ciudad') 
-        if datetime.combine(departure_date, departure_time) < datetime.now():
+        if ('departure_date' in data or 'departure_time' in data) and Trip.combine_departure(departure_date, departure_time) < timezone.now():
             raise serializers.ValidationError('La fecha de salida no puede ser anterior a la fecha actual')
+        if {origin_city, destination_city} & set(data.get('stops', [])):
+            raise serializers.ValidationError('Las paradas no pueden incluir la ciudad de origen ni la de destino')
+        if self.instance is not None and 'seats' in data:
+            booked = TripStop.objects.filter(trip=self.instance).aggregate(booked=Max('seats_taken'))['booked'] or 0
+            if data['seats'] < booked:
+                raise serializers.ValidationError(f'El viaje ya tiene {booked} asientos reservados en uno de sus tramos')
         return data
 
+    def create(self, validated_data):
+        stops = validated_data.pop('stops', [])
+        trip = super().create(validated_data)
+        if stops:
+            set_trip_stops(trip, [city.id for city in stops])
+        return trip
+
+    def update(self, instance, validated_data):
+        stops = validated_data.pop('stops', None)
+        trip = super().update(instance, validated_data)
+        if stops is not None:
+            try:
+                set_trip_stops(trip, [city.id for city in stops])
+            except SegmentError as error:
+                raise serializers.ValidationError(str(error))
+        return trip
+
+    def bulk_create(self, validated_data):
+        """
+        Inserts the trips and their stops, adds them to the route stats and the trip map and notifies the subscribers
+        of their routes, which the Trip signals do for a single trip.
+        """
+        stops = [attrs.pop('stops', []) for attrs in validated_data]
+        trips = [Trip(**attrs) for attrs in validated_data]
+        for trip in trips:
+            trip.departure_at = Trip.combine_departure(trip.departure_date, trip.departure_time) # set by save() for a single trip
+        trips = Trip.objects.bulk_create(trips)
+        TripStop.objects.bulk_create(
+            TripStop(trip=trip, city_id=city_id, order=order)
+            for trip, trip_stops in zip(trips, stops)
+            for order, city_id in enumerate([trip.origin_city_id, *(city.id for city in trip_stops), trip.destination_city_id])
+        )
+        created = Trip.objects.filter(pk__in=[trip.pk for trip in trips])
+        add_trips_to_route_stats(created)
+        add_trips_to_map(created)
+        notify_route_subscribers(trips)
+        return trips
+
 
 class TripListSerializer(serializers.ModelSerializer):
     """
@@ -222,38 +299,199 @@ class TripListSerializer(serializers.ModelSerializer):
     origin_city = serializers.StringRelatedField()
     destination_city = serializers.StringRelatedField()
     vehicle = VehicleListSerializer()
-    participants = TripParticipantListSerializer(many=True)
+    participants = TripParticipantListSerializer(source='trip_participants', many=True)
+    stops = TripStopSerializer(many=True)
 
     class Meta:
         model = Trip
-        fields = ['id', 'origin_city', 'destination_city', 'departure_date', 'departure_time', 'pet_allowed', 'smoking_allowed', 'kids_allowed', 'vehicle', 'participants']
-        read_only_fields = ['id', 'origin_city', 'detination_city', 'departure_date', 'departure_time', 'pet_allowed', 'smoking_allowed', 'kids_allowed', 'vehicle', 'participants']
+        fields = ['id', 'origin_city', 'destination_city', 'departure_date', 'departure_time', 'departure_at', 'pet_allowed', 'smoking_allowed', 'kids_allowed', 'seats', 'vehicle', 'participants', 'stops', 'version']
+        read_only_fields = ['id', 'origin_city', 'detination_city', 'departure_date', 'departure_time', 'departure_at', 'pet_allowed', 'smoking_allowed', 'kids_allowed', 'seats', 'vehicle', 'participants', 'stops', 'version']
+
+
+class DashboardTripSerializer(TripListSerializer):
+    """
+    Serializer class for listing the trips created by the authenticated user in the dashboard,
+    including the pending join request counter of each trip.
+    """
+    pending_requests = serializers.IntegerField(read_only=True)
+
+    class Meta(TripListSerializer.Meta):
+        fields = TripListSerializer.Meta.fields + ['pending_requests']
+        read_only_fields = TripListSerializer.Meta.read_only_fields + ['pending_requests']
+
+
+class ParticipationSerializer(serializers.ModelSerializer):
+    """
+    Serializer class for listing the participations of the authenticated user in the dashboard.
+    """
+    trip = TripListSerializer()
+
+    class Meta:
+        model = TripParticipant
+        fields = ['id', 'role', 'trip']
+        read_only_fields = ['id', 'role', 'trip']
 
 
 class TripJoinRequestSerializer(serializers.ModelSerializer):
     """
     Seriliazer class for creating and updating TripJoinRequest instances.
+    The optional `pickup_city` and `dropoff_city` fields request a segment of the trip between two of its stops.
+    A request is always created as pending: it only takes its seats when the creator of the trip accepts it.
     """
     user = serializers.PrimaryKeyRelatedField(queryset=CustomUser.objects.all())
     trip = serializers.PrimaryKeyRelatedField(queryset=Trip.objects.all())
+    pickup_city = serializers.PrimaryKeyRelatedField(queryset=City.objects.all(), required=False, allow_null=True)
+    dropoff_city = serializers.PrimaryKeyRelatedField(queryset=City.objects.all(), required=False, allow_null=True)
     
     class Meta:
         model = TripJoinRequest
-        fields = ['id', 'user', 'trip', 'status']
+        fields = ['id', 'user', 'trip', 'status', 'pickup_city', 'dropoff_city']
         read_only_fields = ['id']
         
     def validate_status(self, value):
         if value not in ('pending', 'accepted', 'rejected'):
             raise serializers.ValidationError('El estado especificado es invalido')
+        if self.instance is None and value != 'pending':
+            raise serializers.ValidationError('Una solicitud de unión se crea en estado pendiente')
         return value
     
     def validate(self, data):
-        user = data.get('user')
-        trip = data.get('trip')
+        user = data.get('user', getattr(self.instance, 'user', None))
+        trip = data.get('trip', getattr(self.instance, 'trip', None))
         
-        if TripJoinRequest.objects.filter(user=user, trip=trip).exists():
+        existing = TripJoinRequest.objects.filter(user=user, trip=trip)
+        if self.instance is not None:
+            existing = existing.exclude(pk=self.instance.pk)
+        if existing.exists():
             raise serializers.ValidationError('Ya existe una solicitud de unión para dicho viaje')
-        if trip.creator == user:
+        if trip.creator_id == getattr(user, 'id', None):
             raise serializers.ValidationError('El creador del viaje no puede solicitar unirse a su propio viaje')
+        if 'pickup_city' in data or 'dropoff_city' in data:
+            pickup_city = data.get('pickup_city', getattr(self.instance, 'pickup_city', None))
+            dropoff_city = data.get('dropoff_city', getattr(self.instance, 'dropoff_city', None))
+            try:
+                get_segment_orders(list(trip.stops.order_by('order')), getattr(pickup_city, 'id', None), getattr(dropoff_city, 'id', None))
+            except SegmentError as error:
+                raise serializers.ValidationError(str(error))
+        return data
+
+
+class ReviewSerializer(BulkCreateSerializerMixin, serializers.ModelSerializer):
+    """
+    Serializer class for creating Review instances.
+
+    The authenticated user is the reviewer, and both the reviewer and the reviewed `user` must have participated in the trip.
+    It also creates lists of reviews in the bulk mode (see api/bulk.py), loading the participants and previous reviews
+    of every trip of the list at once.
+    """
+    class Meta:
+        model = Review
+        fields = ['id', 'user', 'trip', 'rating', 'comment']
+        read_only_fields = ['id']
+        list_serializer_class = BulkListSerializer
+
+    def validate_rating(self, value):
+        if value is not None and not 1 <= value <= 5:
+            raise serializers.ValidationError('La calificación debe estar entre 1 y 5')
+        return value
+
+    def get_trip_lookups(self, trip_ids):
+        """
+        Returns the (trip, user) pairs of the participants of the trips and of the reviews already made by the reviewer.
+        """
+        reviewer = self.context['request'].user
+        return {
+            'participants': set(TripParticipant.objects.filter(trip__in=trip_ids).values_list('trip_id', 'user_id')),
+            'reviewed': set(Review.objects.filter(reviewer=reviewer, trip__in=trip_ids).values_list('trip_id', 'user_id')),
+        }
+
+    def get_bulk_lookups(self, items):
+        return self.get_trip_lookups(list(self.get_related_objects(Trip)))
+
+    def validate(self, data):
+        reviewer, user, trip = self.context['request'].user, data['user'], data['trip']
+        lookups = self.bulk_lookups if self.in_bulk else self.get_trip_lookups([trip.pk])
+
+        if user.pk == reviewer.pk:
+            raise serializers.ValidationError('El usuario no puede calificarse a sí mismo')
+        if (trip.pk, reviewer.pk) not in lookups['participants']:
+            raise serializers.ValidationError('El usuario no puede realizar la calificación, debido a que no participó en el viaje.')
+        if (trip.pk, user.pk) not in lookups['participants']:
+            raise serializers.ValidationError('El usuario calificado no participó en el viaje')
+        if (trip.pk, user.pk) in lookups['reviewed']:
+            raise serializers.ValidationError('Ya existe una calificación para dicho usuario en el viaje')
+        lookups['reviewed'].add((trip.pk, user.pk)) # rejects repeated items in the bulk mode
         return data
-    
\ No newline at end of file
+
+
+class RouteSubscriptionSerializer(serializers.ModelSerializer):
+    """
+    Serializer class for the route subscriptions of the authenticated user, who gets the new trips of the
+    route in the daily digest email.
+    """
+    class Meta:
+        model = RouteSubscription
+        fields = ['id', 'origin_city', 'destination_city', 'created_at']
+        read_only_fields = ['id', 'created_at']
+
+    def validate(self, data):
+        if data['origin_city'] == data['destination_city']:
+            raise serializers.ValidationError('La ciudad de origen y destino no pueden ser la misma')
+        user = self.context['request'].user
+        if RouteSubscription.objects.filter(user=user, origin_city=data['origin_city'], destination_city=data['destination_city']).exists():
+            raise serializers.ValidationError('Ya estás suscripto a esta ruta')
+        return data
+
+
+class RouteTrendSerializer(serializers.Serializer):
+    """
+    Serializer class for listing the most popular routes.
+
+    This serializer handles the rows aggregated from the RouteDailyStat table for the trending action.
+    """
+    origin_city = serializers.IntegerField(source='origin_city_id')
+    origin_city_name = serializers.CharField(source='origin_city__name')
+    destination_city = serializers.IntegerField(source='destination_city_id')
+    destination_city_name = serializers.CharField(source='destination_city__name')
+    trip_count = serializers.IntegerField(source='total_trips')
+    seat_count = serializers.IntegerField(source='total_seats')
+
+
+class RouteDailyStatSerializer(serializers.ModelSerializer):
+    """
+    Serializer class for listing the daily trip and seat counts of a route.
+    """
+    class Meta:
+        model = RouteDailyStat
+        fields = ['departure_date', 'trip_count', 'seat_count']
+        read_only_fields = ['departure_date', 'trip_count', 'seat_count']
+
+
+class BatchSerializer(serializers.Serializer):
+    """
+    Serializer class for validating the sub-requests of a batch request.
+    Each sub-request is the path (with query string) of a GET request to the API.
+    """
+    requests = serializers.ListField(child=serializers.CharField(max_length=2000), min_length=1, max_length=BATCH_MAX_REQUESTS)
+    parallel = serializers.BooleanField(default=False)
+
+
+class DashboardSerializer(serializers.ModelSerializer):
+    """
+    Serializer class for the home screen of the authenticated user.
+
+    Expects a CustomUser instance with the rating annotations and the prefetched relations
+    built by DashboardView.get_queryset(), so it does not run any query by itself.
+    """
+    rating_average = serializers.FloatField(read_only=True)
+    rating_count = serializers.IntegerField(read_only=True)
+    vehicles = VehicleDetailSerializer(many=True, read_only=True)
+    created_trips = DashboardTripSerializer(many=True, read_only=True)
+    participations = ParticipationSerializer(source='user_trips', many=True, read_only=True)
+    join_requests_sent = TripJoinRequestSerializer(source='pending_join_requests', many=True, read_only=True)
+    join_requests_received = TripJoinRequestSerializer(source='received_join_requests', many=True, read_only=True)
+
+    class Meta:
+        model = CustomUser
+        fields = ['id', 'email', 'first_name', 'last_name', 'rating_average', 'rating_count', 'vehicles', 'created_trips', 'participations', 'join_requests_sent', 'join_requests_received']
+        read_only_fields = fields
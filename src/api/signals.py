@@ -0,0 +1,77 @@
+from django.db.models.signals import post_save, pre_delete
+from django.dispatch import receiver
+
+from trip.models import Trip, TripParticipant, TripJoinRequest, Vehicle
+from .models import ChangeLogEntry
+from .push import publish_change
+
+
+def record_change(model, object_id, user_ids, action):
+    ChangeLogEntry.objects.bulk_create(
+        ChangeLogEntry(user_id=user_id, model=model, object_id=object_id, action=action)
+        for user_id in set(user_ids) if user_id is not None
+    )
+
+
+def record_bulk_create(model, instances, get_user_ids):
+    """
+    Records and publishes the creation or update of rows written with bulk_create() or a queryset update(), which
+    don't send post_save. get_user_ids(instance) must return the audience of each row without querying.
+    """
+    audiences = [(instance, {user_id for user_id in get_user_ids(instance) if user_id is not None}) for instance in instances]
+    ChangeLogEntry.objects.bulk_create(
+        ChangeLogEntry(user_id=user_id, model=model, object_id=instance.pk, action='upsert')
+        for instance, user_ids in audiences for user_id in user_ids
+    )
+    for instance, user_ids in audiences:
+        publish_change(model, instance, user_ids, 'upsert')
+
+
+def _trip_audience(trip_id, creator_id):
+    user_ids = {creator_id}
+    user_ids.update(TripParticipant.objects.filter(trip_id=trip_id).values_list('user_id', flat=True))
+    user_ids.update(TripJoinRequest.objects.filter(trip_id=trip_id).values_list('user_id', flat=True))
+    return user_ids
+
+
+def _trip_creator(trip_id):
+    return Trip.all_objects.filter(pk=trip_id).values_list('creator_id', flat=True).first()
+
+
+def _audience(instance):
+    if isinstance(instance, Trip):
+        return 'trip', _trip_audience(instance.pk, instance.creator_id)
+    if isinstance(instance, TripJoinRequest):
+        return 'join_request', {instance.user_id, instance.trip_creator_id}
+    if isinstance(instance, TripParticipant):
+        return 'participant', {instance.user_id, _trip_creator(instance.trip_id)}
+    return 'vehicle', {instance.owner_id}
+
+
+@receiver(post_save, sender=Trip)
+@receiver(post_save, sender=TripJoinRequest)
+@receiver(post_save, sender=TripParticipant)
+@receiver(post_save, sender=Vehicle)
+def log_upsert(sender, instance, created=False, raw=False, **kwargs):
+    if raw:
+        return
+    model, user_ids = _audience(instance)
+    record_change(model, instance.pk, user_ids, 'upsert')
+    publish_change(model, instance, user_ids, 'upsert')
+    if created and model in ('join_request', 'participant'):
+        record_change('trip', instance.trip_id, [instance.user_id], 'upsert') # the trip becomes visible to the user
+
+
+@receiver(pre_delete, sender=Trip)
+@receiver(pre_delete, sender=TripJoinRequest)
+@receiver(pre_delete, sender=TripParticipant)
+@receiver(pre_delete, sender=Vehicle)
+def log_delete(sender, instance, **kwargs):
+    # pre_delete runs inside the delete transaction, before any cascaded row is removed, so the
+    # audience can still be read and the entry is rolled back together with a failed delete.
+    model, user_ids = _audience(instance)
+    record_change(model, instance.pk, user_ids, 'delete')
+    publish_change(model, instance, user_ids, 'delete')
+    if model in ('join_request', 'participant') and not isinstance(kwargs.get('origin'), Trip):
+        # the sync endpoint turns this into a tombstone if the trip is no longer visible to the user
+        record_change('trip', instance.trip_id, [instance.user_id], 'upsert')
@@ -0,0 +1,100 @@
+"""
+ASGI application serving Server-Sent Events at /api/events/ (mounted in carpool/asgi.py).
+
+The connection is authenticated with a JWT access token, given in the Authorization header or in the
+`token` query parameter since EventSource can not set headers. The user is checked with a single query when
+the connection opens, so an idle connection only costs a queue and a waiting task.
+"""
+import asyncio
+import json
+from urllib.parse import parse_qs
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import AccessToken
+
+from authentication.models import CustomUser
+from .push import get_broker
+
+
+def _get_token(scope):
+    for name, value in scope.get('headers', []):
+        if name == b'authorization':
+            parts = value.decode('latin-1').split()
+            if len(parts) == 2 and parts[0] in api_settings.AUTH_HEADER_TYPES:
+                return parts[1]
+    tokens = parse_qs(scope.get('query_string', b'').decode('latin-1')).get('token')
+    return tokens[0] if tokens else None
+
+
+def _get_user_id(scope):
+    token = _get_token(scope)
+    if not token:
+        return None
+    try:
+        return AccessToken(token)[api_settings.USER_ID_CLAIM]
+    except (TokenError, KeyError):
+        return None
+
+
+@sync_to_async
+def _is_active_user(user_id):
+    """
+    Whether the user of the token can still sign in: it is active and did not delete the account.
+    The connections are cleaned up around the query like the request handler does, since this runs outside of it.
+    """
+    close_old_connections()
+    try:
+        return CustomUser.objects.filter(pk=user_id, is_active=True, deleted_at__isnull=True).exists()
+    finally:
+        close_old_connections()
+
+
+async def _send_error(send, status, message):
+    await send({'type': 'http.response.start', 'status': status, 'headers': [(b'content-type', b'application/json')]})
+    await send({'type': 'http.response.body', 'body': json.dumps({'detail': message}).encode()})
+
+
+async def _wait_for_disconnect(receive):
+    while (await receive())['type'] != 'http.disconnect':
+        pass
+
+
+async def events_application(scope, receive, send):
+    if scope['method'] != 'GET':
+        return await _send_error(send, 405, 'Método no permitido')
+    user_id = _get_user_id(scope)
+    if user_id is None or not await _is_active_user(user_id):
+        return await _send_error(send, 401, 'Las credenciales de autenticación no se proveyeron o son inválidas')
+
+    keepalive = getattr(settings, 'PUSH_KEEPALIVE_SECONDS', 25)
+    broker = get_broker()
+    queue = broker.subscribe(user_id)
+    disconnect = asyncio.ensure_future(_wait_for_disconnect(receive))
+    try:
+        await send({
+            'type': 'http.response.start',
+            'status': 200,
+            'headers': [(b'content-type', b'text/event-stream'), (b'cache-control', b'no-cache'), (b'x-accel-buffering', b'no')],
+        })
+        await send({'type': 'http.response.body', 'body': b'retry: 5000\n\n', 'more_body': True})
+        while True:
+            event = asyncio.ensure_future(queue.get())
+            done, _ = await asyncio.wait({event, disconnect}, timeout=keepalive, return_when=asyncio.FIRST_COMPLETED)
+            if event in done:
+                data = event.result()
+                body = f"event: {data['model']}\ndata: {json.dumps(data)}\n\n".encode()
+            else:
+                event.cancel()
+                if disconnect in done:
+                    break
+                body = b': keep-alive\n\n'
+            await send({'type': 'http.response.body', 'body': body, 'more_body': True})
+    except OSError: # the client went away while writing
+        pass
+    finally:
+        disconnect.cancel()
+        broker.unsubscribe(user_id, queue)
@@ -0,0 +1,144 @@
+import base64
+
+from django.db import connection
+from django.db.models import Q
+
+from trip.models import Trip, TripParticipant, TripJoinRequest, Vehicle
+from .models import ChangeLogEntry
+from .serializers import TripListSerializer, TripJoinRequestSerializer, TripParticipantListSerializer, VehicleDetailSerializer
+
+
+SYNC_PAGE_SIZE = 500
+
+SYNC_MODELS = {
+    'trip': ('trips', TripListSerializer),
+    'join_request': ('join_requests', TripJoinRequestSerializer),
+    'participant': ('participants', TripParticipantListSerializer),
+    'vehicle': ('vehicles', VehicleDetailSerializer),
+}
+
+
+def encode_token(key):
+    return base64.urlsafe_b64encode('v2:{}:{}'.format(*key).encode()).decode().rstrip('=')
+
+
+def decode_token(token):
+    """
+    Returns the (xid, id) change log key stored in the token, or None if the token is invalid.
+    """
+    try:
+        version, xid, last_id = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)).decode().split(':')
+        return (int(xid), int(last_id)) if version == 'v2' else None
+    except (ValueError, UnicodeDecodeError):
+        return None
+
+
+def get_committed_xid():
+    """
+    Returns the oldest transaction still in progress on PostgreSQL. Every entry with a lower xid was written by a
+    transaction that has already committed or rolled back, so no entry can appear below it anymore.
+
+    Entries are ordered by (xid, id) and only the ones below this bound are returned: ids are assigned at insert
+    time, but transactions commit in any order, so a long transaction could still commit an entry below an id
+    that was already returned. Returns None on the other databases, which commit one transaction at a time.
+    """
+    if connection.vendor != 'postgresql':
+        return None
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT pg_snapshot_xmin(pg_current_snapshot())::text::bigint')
+        return cursor.fetchone()[0]
+
+
+def get_querysets(user):
+    """
+    Returns the querysets of every row visible to the user, keyed by change log model name.
+    The join requests and participants of soft-deleted trips are hidden along with their trips.
+    """
+    return {
+        'trip': Trip.objects.filter(Q(creator=user) | Q(trip_participants__user=user) | Q(join_requests__user=user)).distinct()
+            .select_related('origin_city__state', 'destination_city__state', 'vehicle')
+            .prefetch_related('trip_participants__user', 'stops'),
+        'join_request': TripJoinRequest.objects.filter(Q(user=user) | Q(trip_creator=user), trip__deleted_at__isnull=True),
+        'participant': TripParticipant.objects.filter(Q(user=user) | Q(trip__creator=user), trip__deleted_at__isnull=True).select_related('user'),
+        'vehicle': Vehicle.objects.filter(owner=user),
+    }
+
+
+def _serialize(querysets, context):
+    return {
+        key: serializer_class(querysets[model], many=True, context=context).data
+        for model, (key, serializer_class) in SYNC_MODELS.items()
+    }
+
+
+def build_snapshot(user, context):
+    """
+    Returns every row visible to the user, used for the first sync or when the token can no longer be served.
+
+    The token is read before the rows: the entries of the transactions still in progress are above it, so they are
+    replayed by the next delta instead of being skipped (the rows they point to may already be in the snapshot,
+    which is harmless since the client upserts them).
+    """
+    committed_xid = get_committed_xid()
+    if committed_xid is not None:
+        watermark = (committed_xid, 0)
+    else:
+        watermark = ChangeLogEntry.objects.order_by('-xid', '-id').values_list('xid', 'id').first() or (0, 0)
+    return {
+        'token': encode_token(watermark),
+        'reset': True,
+        'has_more': False,
+        'changes': _serialize(get_querysets(user), context),
+        'deleted': {key: [] for key, _ in SYNC_MODELS.values()},
+    }
+
+
+def build_delta(user, since, context):
+    """
+    Returns the rows visible to the user whose change log entries come after the `since` (xid, id) key, or None if
+    the change log was pruned past that key and a full snapshot is needed.
+    """
+    since_xid, since_id = since
+    oldest = ChangeLogEntry.objects.order_by('xid', 'id').values_list('xid', 'id').first()
+    if oldest is not None and oldest > (since_xid, since_id + 1):
+        return None
+
+    committed_xid = get_committed_xid()
+    entries = ChangeLogEntry.objects.filter(Q(xid__gt=since_xid) | Q(xid=since_xid, id__gt=since_id), user=user)
+    if committed_xid is not None:
+        entries = entries.filter(xid__lt=committed_xid)
+    entries = list(entries.order_by('xid', 'id').values_list('xid', 'id', 'model', 'object_id', 'action')[:SYNC_PAGE_SIZE + 1])
+    has_more = len(entries) > SYNC_PAGE_SIZE
+    entries = entries[:SYNC_PAGE_SIZE]
+
+    if has_more or committed_xid is None:
+        watermark = entries[-1][:2] if entries else since
+    else: # every entry below the bound was returned
+        watermark = max(since, (committed_xid, 0))
+
+    latest_action = {} # the last action of each row wins
+    for _, _, model, object_id, action in entries:
+        latest_action[(model, object_id)] = action
+
+    querysets = get_querysets(user)
+    changed = {model: [] for model in SYNC_MODELS}
+    deleted = {key: [] for key, _ in SYNC_MODELS.values()}
+    for (model, object_id), action in latest_action.items():
+        if action == 'delete':
+            deleted[SYNC_MODELS[model][0]].append(object_id)
+        else:
+            changed[model].append(object_id)
+
+    for model, ids in changed.items():
+        rows = list(querysets[model].filter(pk__in=ids)) if ids else []
+        visible_ids = {row.pk for row in rows}
+        deleted[SYNC_MODELS[model][0]].extend(pk for pk in ids if pk not in visible_ids) # no longer visible to the user
+        querysets[model] = rows
+
+    return {
+        'token': encode_token(watermark),
+        'reset': False,
+        'has_more': has_more,
+        'changes': _serialize(querysets, context),
+        'deleted': deleted,
+    }
@@ -0,0 +1,21 @@
+from django.conf import settings
+
+from jobs.queue import enqueue
+from jobs.registry import task
+from .purge import run_purge, trip_purge_steps, user_purge_steps
+
+
+def _max_batches():
+    return getattr(settings, 'PURGE_BATCHES_PER_JOB', 50)
+
+
+@task
+def purge_trip(trip_id):
+    if not run_purge(trip_purge_steps(trip_id), _max_batches()):
+        enqueue(purge_trip, trip_id)
+
+
+@task
+def purge_user(user_id):
+    if not run_purge(user_purge_steps(user_id), _max_batches()):
+        enqueue(purge_user, user_id)
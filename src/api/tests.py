@@ -1,3 +1,943 @@
-from django.test import TestCase
+import asyncio
+import csv
+import gzip
+import io
+import json
+import tempfile
+import threading
+import uuid
+from datetime import date, time, timedelta
+from decimal import Decimal
+from pathlib import Path
+from unittest import mock, skipUnless
 
-# Create your tests here.
+import msgpack
+import numpy as np
+import orjson
+from asgiref.sync import sync_to_async
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.db.models import Sum
+from django.db.models.signals import post_save
+from django.test import AsyncClient, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from django.utils.translation import gettext_lazy
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from authentication.models import CustomUser
+from carpool.testing import TripTestData, query_budget, check_requests
+from review.models import Review
+from jobs.queue import run_pending
+from trip.models import State, City, Vehicle, Trip, TripParticipant, TripJoinRequest, RouteDailyStat
+from .caching import TieredCache
+from .models import ChangeLogEntry
+from .renderers import ORJSONRenderer, MessagePackRenderer
+from .push import InProcessBroker, PostgresBroker
+from .sse import events_application
+from .ranking import get_candidates, rank_trips
+from . import batch, ranking
+from .exports import stream_export
+from .sync import decode_token
+
+
+def add_rows(user, other, origin, destination, count):
+    """
+    Creates, for each of count days, a trip of user with a vehicle and a pending join request of other, and a trip
+    of other that user joined and requested to join, with a review of user.
+    """
+    offset = Vehicle.objects.count()
+    for index in range(offset, offset + count):
+        vehicle = Vehicle.objects.create(owner=user, license_plate=f'AB{index:03d}CD', brand='Fiat', model='Uno')
+        created = Trip.objects.create(
+            origin_city=origin, destination_city=destination, departure_date=date.today() + timedelta(days=index + 1),
+            departure_time=time(10), creator=user, vehicle=vehicle,
+        )
+        TripParticipant.objects.create(trip=created, user=user, role='driver')
+        TripJoinRequest.objects.create(trip=created, user=other)
+        joined = Trip.objects.create(
+            origin_city=destination, destination_city=origin, departure_date=date.today() + timedelta(days=index + 1),
+            departure_time=time(18), creator=other,
+        )
+        TripParticipant.objects.create(trip=joined, user=other, role='driver')
+        TripParticipant.objects.create(trip=joined, user=user, role='passenger')
+        TripJoinRequest.objects.create(trip=joined, user=user)
+        Review.objects.create(user=user, reviewer=other, trip=joined, rating=4)
+
+
+class DashboardViewTests(TripTestData, TestCase):
+    """
+    The dashboard must run the same number of queries no matter how many trips, participations,
+    join requests and vehicles the user has.
+    """
+    DASHBOARD_QUERIES = 10
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.other = CustomUser.objects.create_user('passenger@carpool.com', 'password', first_name='passenger', last_name='user')
+        add_rows(cls.driver, cls.other, cls.origin, cls.destination, 1)
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.driver)
+
+    def test_dashboard_content(self):
+        response = self.client.get('/api/me/dashboard/')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['vehicles']), 1)
+        self.assertEqual(len(response.data['created_trips']), 1)
+        self.assertEqual(response.data['created_trips'][0]['pending_requests'], 1)
+        self.assertEqual(len(response.data['participations']), 1)
+        self.assertEqual(len(response.data['join_requests_sent']), 1)
+        self.assertEqual(len(response.data['join_requests_received']), 1)
+        self.assertEqual(response.data['rating_count'], 1)
+
+    def test_dashboard_query_count_is_fixed(self):
+        with self.assertNumQueries(self.DASHBOARD_QUERIES):
+            self.client.get('/api/me/dashboard/')
+
+        add_rows(self.driver, self.other, self.origin, self.destination, 5)
+
+        with self.assertNumQueries(self.DASHBOARD_QUERIES):
+            response = self.client.get('/api/me/dashboard/')
+        self.assertEqual(len(response.data['created_trips']), 6)
+        self.assertEqual(len(response.data['participations']), 6)
+
+
+@override_settings(PAGINATION_MAX_PAGE_SIZE=2)
+class PaginationTests(TestCase):
+    """
+    The list endpoints are paginated with a capped page size and only list the rows of the authenticated user.
+    """
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create_user('driver@carpool.com', 'password', first_name='driver', last_name='user')
+        cls.other = CustomUser.objects.create_user('passenger@carpool.com', 'password', first_name='passenger', last_name='user')
+        for index in range(3):
+            Vehicle.objects.create(owner=cls.user, license_plate=f'AB{index:03d}CD', brand='Fiat', model='Uno')
+        cls.other_vehicle = Vehicle.objects.create(owner=cls.other, license_plate='ZZ999ZZ', brand='Fiat', model='Uno')
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_page_size_is_capped(self):
+        response = self.client.get('/api/vehicles/', {'page_size': 100})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['count'], 3)
+        self.assertEqual(len(response.data['results']), 2)
+        self.assertIsNotNone(response.data['next'])
+
+    def test_vehicles_of_other_users_are_not_listed(self):
+        response = self.client.get('/api/vehicles/')
+
+        self.assertNotIn(self.other_vehicle.id, [vehicle['id'] for vehicle in response.data['results']])
+
+    def count_queries(self, path):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(path)
+        return response.data['count'], sum('COUNT(' in query['sql'] for query in queries)
+
+    def test_lists_of_live_rows_are_not_counted(self):
+        cache.clear()
+        with mock.patch('api.pagination.estimate_table_rows', return_value=150000):
+            for path in ('/api/trips/', '/api/users/'):
+                self.assertEqual(self.count_queries(path), (150000, 0))
+
+        # below the estimate threshold the count is cached, filtered lists are always counted
+        self.assertEqual(self.count_queries('/api/users/'), (2, 1))
+        self.assertEqual(self.count_queries('/api/users/'), (2, 0))
+        self.assertEqual(self.count_queries('/api/vehicles/'), (3, 1))
+        self.assertEqual(self.count_queries('/api/vehicles/'), (3, 1))
+
+    def test_stale_counts_do_not_change_the_pages(self):
+        with mock.patch('api.pagination.estimate_table_rows', return_value=150000):
+            first, last = (self.client.get('/api/users/', {'page_size': 1, 'page': page}).data for page in (1, 2))
+            self.assertEqual((first['count'], last['count']), (150000, 150000)) # informational only
+            self.assertIsNotNone(first['next'])
+            self.assertIsNone(last['next'])
+            self.assertEqual(self.client.get('/api/users/', {'page_size': 1, 'page': 3}).status_code, 404)
+
+        self.assertEqual(self.client.get('/api/users/', {'page_size': 1}).data['count'], 2) # cached
+        CustomUser.objects.create_user('other@carpool.com', 'password', first_name='other', last_name='user')
+        response = self.client.get('/api/users/', {'page_size': 1, 'page': 3})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((response.data['count'], response.data['next']), (2, None))
+        self.assertIsNotNone(self.client.get('/api/users/', {'page_size': 1, 'page': 2}).data['next'])
+
+
+@override_settings(CACHE_LOCAL_MAX_ENTRIES=2)
+class TieredCacheTests(TestCase):
+    """
+    Values must be served from the local tier, then from the shared tier, until one of their tags is invalidated.
+    """
+    def setUp(self):
+        self.cache = TieredCache()
+        self.cache.shared.clear()
+        self.loads = 0
+
+    def load(self):
+        self.loads += 1
+        return self.loads
+
+    def test_tiers_and_invalidation(self):
+        self.assertEqual(self.cache.get_or_set('key', self.load, tags=['a']), 1)
+        self.assertEqual(self.cache.get_or_set('key', self.load, tags=['a']), 1)
+        self.cache.clear_local()
+        self.assertEqual(self.cache.get_or_set('key', self.load, tags=['a']), 1)
+
+        TieredCache().invalidate('a') # another process
+        self.cache.clear_local()
+        self.assertEqual(self.cache.get_or_set('key', self.load, tags=['a']), 2)
+
+        stats = self.cache.stats()
+        self.assertEqual((stats['local_hits'], stats['shared_hits'], stats['misses']), (1, 1, 2))
+
+    def test_local_tier_is_bounded(self):
+        for key in ('a', 'b', 'c'):
+            self.cache.get_or_set(key, self.load)
+        self.assertEqual(self.cache.stats()['local_entries'], 2)
+
+    def test_model_signals_invalidate_tags(self):
+        self.cache.get_or_set('cities', self.load, tags=['cities'])
+        state = State.objects.create(name='Buenos Aires', abbreviation='BA', country='Argentina')
+        with self.captureOnCommitCallbacks(execute=True):
+            City.objects.create(name='La Plata', latitude=-34.92, longitude=-57.95, state=state)
+        self.cache.clear_local() # as if the local entry expired
+        self.assertEqual(self.cache.get_or_set('cities', self.load, tags=['cities']), 2)
+
+        owner = CustomUser.objects.create_user('driver@carpool.com', 'password', first_name='driver', last_name='user')
+        vehicle = Vehicle.objects.create(owner=owner, license_plate='AB123CD', brand='Fiat', model='Cronos')
+        self.cache.get_or_set('vehicle', self.load, tags=[f'vehicle:{vehicle.pk}'])
+        vehicle.model = 'Argo'
+        with self.captureOnCommitCallbacks(execute=True):
+            vehicle.save()
+        self.cache.clear_local()
+        self.assertEqual(self.cache.get_or_set('vehicle', self.load, tags=[f'vehicle:{vehicle.pk}']), 4)
+
+
+@override_settings(PURGE_BATCH_SIZE=2, PURGE_BATCHES_PER_JOB=3)
+class PurgeTests(TripTestData, TestCase):
+    """
+    Deleting a user hides it and its trips right away, and the purge jobs then delete every row it owns in
+    small batches, enqueuing themselves again until they are done.
+    """
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.other = CustomUser.objects.create_user('passenger@carpool.com', 'password', first_name='passenger', last_name='user')
+        add_rows(cls.driver, cls.other, cls.origin, cls.destination, 3)
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.driver)
+
+    def run_jobs(self):
+        runs = 0
+        while run_pending():
+            runs += 1
+        return runs
+
+    def test_user_purge(self):
+        other_trip = Trip.objects.filter(creator=self.other).first()
+        self.assertEqual(other_trip.pending_requests, 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.delete(f'/api/users/{self.driver.id}/')
+        self.assertEqual(response.status_code, 204)
+        self.driver.refresh_from_db()
+        self.assertFalse(self.driver.is_active)
+        self.assertFalse(Trip.objects.filter(creator=self.driver).exists())
+        self.assertEqual(RouteDailyStat.objects.filter(origin_city=self.origin).aggregate(total=Sum('trip_count'))['total'], 0)
+
+        self.assertGreater(self.run_jobs(), 1)
+        self.assertFalse(CustomUser.objects.filter(pk=self.driver.pk).exists())
+        self.assertFalse(Trip.all_objects.filter(creator=self.driver).exists())
+        self.assertFalse(Vehicle.objects.filter(owner=self.driver).exists())
+        self.assertFalse(TripParticipant.objects.filter(user=self.driver).exists())
+        self.assertFalse(Review.objects.filter(user=self.driver).exists())
+        other_trip.refresh_from_db()
+        self.assertEqual(other_trip.pending_requests, 0)
+        self.assertEqual(Trip.objects.filter(creator=self.other).count(), 3)
+
+    def test_trip_purge(self):
+        trip = Trip.objects.filter(creator=self.driver).first()
+
+        response = self.client.delete(f'/api/trips/{trip.id}/')
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(self.client.get(f'/api/trips/{trip.id}/').status_code, 404)
+
+        self.run_jobs()
+        self.assertFalse(Trip.all_objects.filter(pk=trip.pk).exists())
+        self.assertFalse(TripJoinRequest.objects.filter(trip_id=trip.pk).exists())
+
+
+class BulkCreateTests(TripTestData, TestCase):
+    """
+    A list posted to a create endpoint must be validated and created with the same number of queries
+    no matter how many objects it has.
+    """
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.stop = City.objects.create(name='Dolores', latitude=-36.31, longitude=-57.68, state=cls.state)
+        cls.vehicle = Vehicle.objects.create(owner=cls.driver, license_plate='AB123CD', brand='Fiat', model='Uno')
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.driver)
+
+    def trips(self, count):
+        departure_date = (date.today() + timedelta(days=7)).isoformat()
+        return [
+            {'origin_city': self.origin.id, 'destination_city': self.destination.id, 'departure_date': departure_date,
+             'departure_time': '08:00', 'vehicle': self.vehicle.id, 'stops': [self.stop.id] if index % 2 else []}
+            for index in range(count)
+        ]
+
+    def test_vehicles_queries_do_not_grow(self):
+        with self.assertNumQueries(5):
+            response = self.client.post('/api/vehicles/', [{'license_plate': f'CD{index:03d}EF', 'brand': 'Ford', 'model': 'Ka'} for index in range(2)], format='json')
+        self.assertEqual(response.status_code, 201)
+        with self.assertNumQueries(5):
+            response = self.client.post('/api/vehicles/', [{'license_plate': f'GH{index:03d}IJ', 'brand': 'Ford', 'model': 'Ka'} for index in range(20)], format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(Vehicle.objects.filter(owner=self.driver).count(), 23)
+
+    def test_invalid_item_rejects_the_list(self):
+        response = self.client.post('/api/vehicles/', [
+            {'license_plate': 'KL123MN', 'brand': 'Ford', 'model': 'Ka'},
+            {'license_plate': 'KL123MN', 'brand': 'Ford', 'model': 'Ka'},
+            {'license_plate': 'AB123CD', 'brand': 'Ford', 'model': 'Ka'},
+        ], format='json')
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data[0], {})
+        self.assertIn('license_plate', response.data[1])
+        self.assertIn('license_plate', response.data[2])
+        self.assertEqual(Vehicle.objects.count(), 1)
+
+    def test_trips_keep_stops_and_route_stats(self):
+        self.client.post('/api/trips/', self.trips(1), format='json') # creates the route stat row
+        with self.assertNumQueries(18):
+            self.client.post('/api/trips/', self.trips(2), format='json')
+        with self.assertNumQueries(18):
+            response = self.client.post('/api/trips/', self.trips(10), format='json')
+
+        self.assertEqual(response.status_code, 201)
+        trips = Trip.objects.filter(creator=self.driver)
+        self.assertEqual(trips.count(), 13)
+        self.assertEqual(TripParticipant.objects.filter(user=self.driver, role='driver').count(), 13)
+        self.assertEqual(RouteDailyStat.objects.get(origin_city=self.origin).trip_count, 13)
+        self.assertEqual([stop.city_id for stop in trips.last().stops.order_by('order')], [self.origin.id, self.stop.id, self.destination.id])
+
+
+class ProfilingMiddlewareTests(TestCase):
+    """
+    Only the flagged requests of staff users must be profiled, inline or to a report on disk.
+    """
+    @classmethod
+    def setUpTestData(cls):
+        cls.staff = CustomUser.objects.create_user('staff@carpool.com', 'password', first_name='staff', last_name='user', is_staff=True)
+        cls.user = CustomUser.objects.create_user('driver@carpool.com', 'password', first_name='driver', last_name='user')
+
+    def get(self, user, **extra):
+        token = RefreshToken.for_user(user).access_token
+        return self.client.get('/api/vehicles/', HTTP_AUTHORIZATION=f'Bearer {token}', **extra)
+
+    def test_inline_report(self):
+        response = self.get(self.staff, HTTP_X_PROFILE='inline')
+
+        self.assertEqual(response['Content-Type'], 'text/plain; charset=utf-8')
+        self.assertEqual(response['X-Profile-Status'], '200')
+        self.assertIn('SQL queries:', response.content.decode())
+        self.assertIn('Functions by cumulative time:', response.content.decode())
+
+    def test_saved_report(self):
+        with tempfile.TemporaryDirectory() as directory, override_settings(PROFILING_DIR=directory):
+            self.client.force_login(self.staff)
+            response = self.client.get('/api/states/?_profile=1')
+
+            self.assertEqual(response.status_code, 401) # the session profiles the request, the API still wants a JWT
+            self.assertTrue((Path(directory) / f"{response['X-Profile']}.txt").exists())
+            self.assertTrue((Path(directory) / f"{response['X-Profile']}.prof").exists())
+
+    def test_other_users_are_not_profiled(self):
+        response = self.get(self.user, HTTP_X_PROFILE='inline')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'application/json')
+        self.assertNotIn('X-Profile', response)
+
+
+@query_budget({
+    'GET trip-list': 5, 'GET tripparticipant-list': 2, 'GET tripjoinrequest-list': 2, 'GET review-list': 2, 'GET trip-segments': 7,
+    'GET trip-map': 2, 'GET customuser-list': 2, 'GET vehicle-list': 2, 'GET state-list': 1, 'GET city-list': 1,
+    'GET tripjoinrequest-pending-count': 1, 'GET trip-ranked': 8,
+})
+class QueryBudgetTests(TripTestData, TestCase):
+    """
+    The read endpoints must run a fixed number of queries, whatever the number of rows they return
+    (checked by the test runner, see carpool/testing.py).
+    """
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.other = CustomUser.objects.create_user('passenger@carpool.com', 'password', first_name='passenger', last_name='user')
+        add_rows(cls.driver, cls.other, cls.origin, cls.destination, 4)
+        for index in range(3):
+            CustomUser.objects.create_user(f'user{index}@carpool.com', 'password', first_name='other', last_name='user')
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.driver)
+
+    def test_lists(self):
+        for path in ('/api/trips/', '/api/participants/', '/api/join-requests/', '/api/reviews/'):
+            self.assertEqual(self.client.get(path).status_code, 200)
+
+    def test_user_lists(self):
+        for path in ('/api/users/', '/api/vehicles/', '/api/states/', '/api/cities/', '/api/join-requests/pending-count/'):
+            self.assertEqual(self.client.get(path).status_code, 200)
+        self.assertEqual(self.client.get('/api/join-requests/pending-count/').data, {'pending': 4})
+
+    @query_budget(DashboardViewTests.DASHBOARD_QUERIES)
+    def test_dashboard(self):
+        response = self.client.get('/api/me/dashboard/')
+
+        self.assertEqual(len(response.data['created_trips']), 4)
+        self.assertEqual(len(response.data['participations']), 4)
+
+    def test_ranked(self):
+        response = self.client.get('/api/trips/ranked/', {'origin': self.origin.id, 'destination': self.destination.id, 'date': (date.today() + timedelta(days=2)).isoformat()})
+
+        self.assertEqual(len(response.data), 4)
+
+    def test_segments(self):
+        response = self.client.get('/api/trips/segments/', {'origin': self.origin.id, 'destination': self.destination.id})
+
+        self.assertEqual(len(response.data), 4)
+
+    def test_map(self):
+        response = self.client.get('/api/trips/map/', {'bbox': '-60,-39,-56,-34', 'zoom': 6})
+
+        self.assertEqual(sum(cluster['count'] for cluster in response.data['clusters']), 8)
+        self.assertEqual(self.client.get('/api/trips/map/', {'bbox': '-60,-39', 'zoom': 6}).status_code, 400)
+
+    def test_repeated_queries_are_reported(self):
+        statements = ['SELECT * FROM "trip_city" WHERE "trip_city"."id" = %s LIMIT 21'] * 3 + ['SELECT * FROM "trip_trip" WHERE "id" IN (%s, %s)']
+        problems = check_requests([('GET', '/api/trips/', 'trip-list', statements)], {'GET trip-list': 3})
+
+        self.assertEqual(len(problems), 2)
+        self.assertIn('over its budget of 3', problems[0])
+        self.assertIn('same query 3 times', problems[1])
+
+    def test_in_lists_of_any_length_are_the_same_query(self):
+        statements = [f'SELECT * FROM "trip_city" WHERE "trip_city"."id" IN ({", ".join(["%s"] * size)})' for size in (1, 2, 5)]
+        self.assertEqual(len(check_requests([('GET', '/api/trips/', 'trip-list', statements)])), 1)
+
+
+class ExportTests(TripTestData, TestCase):
+    """
+    The exports must stream every row in chunks of chunk_size lines, in every format, with and without gzip.
+    """
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.staff = CustomUser.objects.create_superuser('admin@carpool.com', 'password', first_name='admin', last_name='user')
+        others = [CustomUser.objects.create_user(f'user{index}@carpool.com', 'password', first_name='user', last_name='user') for index in range(4)]
+        trip = Trip.objects.create(origin_city=cls.origin, destination_city=cls.destination, departure_date=date.today() + timedelta(days=1), departure_time=time(10), creator=cls.staff)
+        cls.participants = [TripParticipant.objects.create(trip=trip, user=user, role='passenger') for user in [cls.staff, *others]]
+
+    def expected(self):
+        return [{'id': participant.id, 'user_id': participant.user_id, 'trip_id': participant.trip_id, 'role': 'passenger'} for participant in self.participants]
+
+    def test_formats_and_chunks(self):
+        chunks = list(stream_export('participants', 'ndjson', chunk_size=2))
+        self.assertEqual(len(chunks), 3)
+        self.assertEqual([json.loads(line) for chunk in chunks for line in chunk.decode().splitlines()], self.expected())
+
+        chunks = list(stream_export('participants', 'csv', chunk_size=2))
+        self.assertEqual(len(chunks), 4) # header and three chunks of rows
+        rows = list(csv.DictReader(io.StringIO(b''.join(chunks).decode())))
+        self.assertEqual([{**row, 'id': int(row['id']), 'user_id': int(row['user_id']), 'trip_id': int(row['trip_id'])} for row in rows], self.expected())
+
+        for output_format in ('ndjson', 'csv'):
+            plain = b''.join(stream_export('participants', output_format, chunk_size=2))
+            self.assertEqual(gzip.decompress(b''.join(stream_export('participants', output_format, compress=True, chunk_size=2))), plain)
+
+    def test_view_and_command(self):
+        client = APIClient()
+        client.force_authenticate(self.staff)
+        response = client.get('/api/export/participants/', {'output': 'csv', 'gzip': 'true'})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'application/gzip')
+        self.assertEqual(gzip.decompress(b''.join(response.streaming_content)), b''.join(stream_export('participants', 'csv')))
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = Path(directory) / 'participants.ndjson'
+            call_command('export_data', 'participants', '--file', str(path), '--chunk-size', '2')
+            self.assertEqual([json.loads(line) for line in path.read_text().splitlines()], self.expected())
+
+    async def test_view_under_asgi(self):
+        token = await sync_to_async(lambda: str(RefreshToken.for_user(self.staff).access_token))()
+        response = await AsyncClient().get('/api/export/participants/', {'output': 'csv'}, headers={'Authorization': f'Bearer {token}'})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.is_async)
+        chunks = [chunk async for chunk in response.streaming_content]
+        expected = await sync_to_async(lambda: b''.join(stream_export('participants', 'csv')))()
+        self.assertEqual(b''.join(chunks), expected)
+
+
+class ConditionalRequestTests(TripTestData, TestCase):
+    """
+    The trip endpoints must answer 304 while the version of the trips and the negotiated format are unchanged.
+    """
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.trip = Trip.objects.create(origin_city=cls.origin, destination_city=cls.destination, departure_date=date.today() + timedelta(days=1), departure_time=time(10), creator=cls.driver)
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.driver)
+
+    def test_version_bumps_before_post_save(self):
+        seen = []
+        receiver = lambda sender, instance, **kwargs: seen.append(instance.version)
+        post_save.connect(receiver, sender=Trip)
+        try:
+            trip = Trip.objects.get(pk=self.trip.pk)
+            trip.seats = 2
+            trip.save()
+            trip.save(update_fields=['seats'])
+        finally:
+            post_save.disconnect(receiver, sender=Trip)
+        self.assertEqual(seen, [self.trip.version + 1, self.trip.version + 2])
+        TripParticipant.objects.create(trip=trip, user=self.driver, role='driver')
+        self.assertEqual(Trip.objects.get(pk=trip.pk).version, self.trip.version + 3)
+
+    def test_not_modified(self):
+        for path in (f'/api/trips/{self.trip.pk}/', '/api/trips/'):
+            response = self.client.get(path)
+            etag = response['ETag']
+            self.assertIn('Accept', response['Vary'])
+            not_modified = self.client.get(path, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(not_modified.status_code, 304)
+            self.assertIn('Accept', not_modified['Vary'])
+
+            # the same data in another format is another representation
+            packed = self.client.get(path, HTTP_ACCEPT='application/msgpack', HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(packed.status_code, 200)
+            self.assertNotEqual(packed['ETag'], etag)
+
+        etags = [self.client.get(path)['ETag'] for path in (f'/api/trips/{self.trip.pk}/', '/api/trips/')]
+        TripParticipant.objects.create(trip=self.trip, user=self.driver, role='driver')
+        for path, etag in zip((f'/api/trips/{self.trip.pk}/', '/api/trips/'), etags):
+            self.assertEqual(self.client.get(path, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_related_rows_change_the_etag(self):
+        TripParticipant.objects.create(trip=self.trip, user=self.driver, role='driver')
+        vehicle = Vehicle.objects.create(owner=self.driver, license_plate='AB123CD', brand='Fiat', model='Uno')
+        Trip.objects.filter(pk=self.trip.pk).update(vehicle=vehicle)
+        path = f'/api/trips/{self.trip.pk}/'
+
+        self.driver.last_login = timezone.now()
+        etag = self.client.get(path)['ETag']
+        self.driver.save(update_fields=['last_login'])
+        vehicle.save() # nothing changed
+        self.assertEqual(self.client.get(path, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        city = self.trip.destination_city
+        for instance, field, value in [(self.driver, 'first_name', 'other'), (vehicle, 'model', 'Palio'), (city, 'name', 'Miramar'), (city.state, 'name', 'Provincia de Buenos Aires')]:
+            setattr(instance, field, value)
+            instance.save()
+            response = self.client.get(path, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 200, field)
+            etag = response['ETag']
+        self.assertEqual(response.data['participants'][0]['user'], 'Other')
+        self.assertEqual(response.data['vehicle']['model'], 'Palio')
+        self.assertEqual(response.data['destination_city'], 'Miramar, Provincia de Buenos Aires, Argentina')
+
+
+class RendererTests(TripTestData, TestCase):
+    """
+    The JSON and MessagePack renderings of the same data must decode to the same values.
+    """
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.trip = Trip.objects.create(origin_city=cls.origin, destination_city=cls.destination, departure_date=date.today() + timedelta(days=1), departure_time=time(10), creator=cls.driver)
+
+    def test_json_and_msgpack_match(self):
+        client = APIClient()
+        client.force_authenticate(self.driver)
+        for path in (f'/api/trips/{self.trip.pk}/', '/api/trips/', f'/api/trips/{self.trip.pk}/cost/'):
+            data = orjson.loads(client.get(path, HTTP_ACCEPT='application/json').content)
+            packed = msgpack.unpackb(client.get(path, HTTP_ACCEPT='application/msgpack').content, raw=False)
+            self.assertEqual(packed, data)
+
+        values = {
+            'decimal': Decimal('1500.50'), 'uuid': uuid.UUID(int=1), 'at': timezone.now(), 'date': date.today(),
+            'time': time(10, 30), 'label': gettext_lazy('Estado'), 'count': np.int64(3), 'sums': np.array([1.5, 2.5]),
+        }
+        data = orjson.loads(ORJSONRenderer().render(values))
+        self.assertEqual(msgpack.unpackb(MessagePackRenderer().render(values), raw=False), data)
+        self.assertEqual(data['decimal'], '1500.50')
+        self.assertEqual(data['sums'], [1.5, 2.5])
+
+        for renderer in (ORJSONRenderer(), MessagePackRenderer()):
+            with self.assertRaises(TypeError):
+                renderer.render({'user': object()})
+
+
+class BatchTests(TripTestData, TestCase):
+    """
+    The sub-requests of a batch must run with its authentication, but not with its body or conditional headers.
+    """
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.trip = Trip.objects.create(origin_city=cls.origin, destination_city=cls.destination, departure_date=date.today() + timedelta(days=1), departure_time=time(10), creator=cls.driver)
+
+    def test_responses(self):
+        client = APIClient()
+        paths = [f'/api/trips/{self.trip.pk}/', '/api/trips/?page_size=1', '/api/batch/', '/api/missing/']
+
+        responses = client.post('/api/batch/', {'requests': paths}, format='json').data['responses']
+        self.assertEqual([response['status'] for response in responses], [401, 200, 400, 404])
+
+        client.force_authenticate(self.driver)
+        responses = client.post('/api/batch/', {'requests': paths[:2]}, format='json').data['responses']
+        self.assertEqual([response['status'] for response in responses], [200, 200])
+        self.assertEqual(responses[0]['body']['id'], self.trip.pk)
+        self.assertEqual(responses[0]['etag'], client.get(paths[0])['ETag'])
+
+    def test_conditional_headers_are_not_forwarded(self):
+        client = APIClient()
+        client.force_authenticate(self.driver)
+        etag = client.get(f'/api/trips/{self.trip.pk}/')['ETag']
+
+        response = client.post(
+            '/api/batch/', {'requests': [f'/api/trips/{self.trip.pk}/']}, format='json',
+            HTTP_IF_NONE_MATCH=etag, HTTP_IF_MODIFIED_SINCE='Mon, 01 Jan 2024 00:00:00 GMT',
+        )
+        self.assertEqual(response.data['responses'][0]['status'], 200)
+        self.assertEqual(response.data['responses'][0]['body']['id'], self.trip.pk)
+
+
+class ParallelBatchTests(TripTestData, TransactionTestCase):
+    """
+    The parallel sub-requests must run on the worker threads, with their own connections, and keep the order of the paths.
+    """
+    def setUp(self):
+        self.create_trip_data()
+        self.trip = Trip.objects.create(origin_city=self.origin, destination_city=self.destination, departure_date=date.today() + timedelta(days=1), departure_time=time(10), creator=self.driver)
+        self.client = APIClient()
+        self.client.force_authenticate(self.driver)
+
+    def test_parallel_matches_sequential(self):
+        paths = [f'/api/trips/{self.trip.pk}/', '/api/trips/?page_size=1', f'/api/users/{self.driver.pk}/', '/api/missing/']
+        threads = []
+        run_request = batch.run_request
+
+        def record_thread(request, path):
+            threads.append(threading.current_thread().name)
+            return run_request(request, path)
+
+        with mock.patch('api.batch.run_request', side_effect=record_thread):
+            parallel = self.client.post('/api/batch/', {'requests': paths, 'parallel': True}, format='json').data['responses']
+        sequential = self.client.post('/api/batch/', {'requests': paths}, format='json').data['responses']
+
+        self.assertEqual(len(threads), len(paths))
+        self.assertTrue(all(name.startswith('batch') for name in threads))
+        self.assertEqual([response['status'] for response in parallel], [200, 200, 200, 404])
+        self.assertEqual(parallel, sequential)
+
+
+class SyncTests(TripTestData, TestCase):
+    """
+    A client that starts from a snapshot and follows the deltas must see every change, including the ones
+    logged while the snapshot was taken.
+    """
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.driver)
+
+    def test_snapshot_and_deltas(self):
+        trip = Trip.objects.create(origin_city=self.origin, destination_city=self.destination, departure_date=date.today() + timedelta(days=1), departure_time=time(10), creator=self.driver)
+
+        snapshot = self.client.get('/api/sync/').data
+        self.assertTrue(snapshot['reset'])
+        self.assertEqual([row['id'] for row in snapshot['changes']['trips']], [trip.id])
+        self.assertEqual(decode_token(snapshot['token']), ChangeLogEntry.objects.order_by('xid', 'id').values_list('xid', 'id').last())
+
+        delta = self.client.get('/api/sync/', {'since': snapshot['token']}).data
+        self.assertEqual(delta['changes']['trips'], [])
+        self.assertEqual(delta['token'], snapshot['token'])
+
+        vehicle = Vehicle.objects.create(owner=self.driver, license_plate='AB123CD', brand='Fiat', model='Uno')
+        delta = self.client.get('/api/sync/', {'since': delta['token']}).data
+        self.assertFalse(delta['reset'])
+        self.assertEqual([row['id'] for row in delta['changes']['vehicles']], [vehicle.id])
+
+        vehicle_id = vehicle.id
+        vehicle.delete()
+        delta = self.client.get('/api/sync/', {'since': delta['token']}).data
+        self.assertEqual(delta['deleted']['vehicles'], [vehicle_id])
+        self.assertEqual(self.client.get('/api/sync/', {'since': delta['token']}).data['changes']['vehicles'], [])
+
+    def test_pruned_token_gets_snapshot(self):
+        Vehicle.objects.create(owner=self.driver, license_plate='AB123CD', brand='Fiat', model='Uno')
+        token = self.client.get('/api/sync/').data['token']
+        Vehicle.objects.create(owner=self.driver, license_plate='AB123CE', brand='Fiat', model='Uno')
+        Vehicle.objects.create(owner=self.driver, license_plate='AB123CF', brand='Fiat', model='Uno')
+        ids = list(ChangeLogEntry.objects.order_by('id').values_list('id', flat=True))
+
+        ChangeLogEntry.objects.filter(id=ids[1]).update(created_at=timezone.now() - timedelta(days=31))
+        call_command('prune_change_log', stdout=io.StringIO())
+        self.assertEqual(ChangeLogEntry.objects.count(), 3) # only a prefix of the log is pruned
+        self.assertFalse(self.client.get('/api/sync/', {'since': token}).data['reset'])
+
+        ChangeLogEntry.objects.filter(id__in=ids[:2]).update(created_at=timezone.now() - timedelta(days=31))
+        call_command('prune_change_log', stdout=io.StringIO())
+        self.assertEqual(list(ChangeLogEntry.objects.values_list('id', flat=True)), ids[2:])
+        self.assertTrue(self.client.get('/api/sync/', {'since': token}).data['reset'])
+
+
+@skipUnless(connection.vendor == 'postgresql', 'transaction ids need PostgreSQL')
+class SyncWatermarkTests(TransactionTestCase):
+    """
+    An entry committed after a newer one must not be skipped by a token handed out in between.
+    """
+    def test_long_transaction_is_not_skipped(self):
+        user = CustomUser.objects.create_user('driver@carpool.com', 'password', first_name='driver', last_name='user')
+        client = APIClient()
+        client.force_authenticate(user)
+        token = client.get('/api/sync/').data['token']
+        written, release = threading.Event(), threading.Event()
+
+        def long_transaction():
+            try:
+                with transaction.atomic():
+                    Vehicle.objects.create(owner=user, license_plate='AB123CD', brand='Fiat', model='Uno')
+                    written.set()
+                    release.wait(5)
+            finally:
+                connection.close()
+
+        thread = threading.Thread(target=long_transaction)
+        thread.start()
+        written.wait(5)
+        second = Vehicle.objects.create(owner=user, license_plate='AB123CE', brand='Fiat', model='Uno')
+
+        delta = client.get('/api/sync/', {'since': token}).data
+        self.assertEqual(delta['changes']['vehicles'], []) # held back until the older transaction ends
+        release.set()
+        thread.join()
+        delta = client.get('/api/sync/', {'since': delta['token']}).data
+        self.assertEqual(sorted(row['license_plate'] for row in delta['changes']['vehicles']), ['AB123CD', second.license_plate])
+
+
+async def _subscribe(broker, user_id):
+    return broker.subscribe(user_id)
+
+
+async def _next_event(queue, timeout=5):
+    return await asyncio.wait_for(queue.get(), timeout)
+
+
+class DeletedTripTests(TripTestData, TestCase):
+    """
+    The join requests and participations of a deleted trip must leave the inbox, the participants, the dashboard
+    and the sync snapshot along with the trip, before the trip is purged.
+    """
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.passenger = CustomUser.objects.create_user('passenger@carpool.com', 'password', first_name='passenger', last_name='user')
+        cls.trip = Trip.objects.create(origin_city=cls.origin, destination_city=cls.destination, departure_date=date.today() + timedelta(days=1), departure_time=time(10), creator=cls.driver)
+        TripParticipant.objects.create(trip=cls.trip, user=cls.driver, role='driver')
+        TripParticipant.objects.create(trip=cls.trip, user=cls.passenger, role='passenger')
+        cls.join_request = TripJoinRequest.objects.create(trip=cls.trip, user=cls.passenger)
+
+    def setUp(self):
+        self.driver_client = APIClient()
+        self.driver_client.force_authenticate(self.driver)
+        self.passenger_client = APIClient()
+        self.passenger_client.force_authenticate(self.passenger)
+
+    def test_deleted_trip_rows_are_hidden(self):
+        self.assertEqual(len(self.driver_client.get('/api/join-requests/').data['results']), 1)
+        self.assertEqual(self.driver_client.delete(f'/api/trips/{self.trip.pk}/').status_code, 204)
+
+        self.assertEqual(self.driver_client.get('/api/join-requests/').data['results'], [])
+        self.assertEqual(self.driver_client.get('/api/join-requests/pending-count/').data, {'pending': 0})
+        response = self.driver_client.patch(f'/api/join-requests/{self.join_request.pk}/', {'status': 'accepted'}, format='json')
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(TripJoinRequest.objects.get(pk=self.join_request.pk).status, 'pending')
+        self.assertIsNone(TripJoinRequest.objects.get(pk=self.join_request.pk).trip_creator_id)
+
+        for client in (self.driver_client, self.passenger_client):
+            self.assertEqual(client.get('/api/participants/').data['results'], [])
+        participant = TripParticipant.objects.get(trip=self.trip, user=self.passenger)
+        self.assertEqual(self.passenger_client.get(f'/api/participants/{participant.pk}/').status_code, 404)
+
+        self.assertEqual(self.driver_client.get('/api/me/dashboard/').data['join_requests_received'], [])
+        dashboard = self.passenger_client.get('/api/me/dashboard/').data
+        self.assertEqual((dashboard['participations'], dashboard['join_requests_sent']), ([], []))
+
+        for client in (self.driver_client, self.passenger_client):
+            changes = client.get('/api/sync/').data['changes']
+            self.assertEqual((changes['trips'], changes['join_requests'], changes['participants']), ([], [], []))
+
+
+class PushTests(TripTestData, TestCase):
+    """
+    The subscribers of the events endpoint must receive the changes of their trips and join requests
+    once the transaction commits.
+    """
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.passenger = CustomUser.objects.create_user('passenger@carpool.com', 'password', first_name='passenger', last_name='user')
+        cls.trip = Trip.objects.create(origin_city=cls.origin, destination_city=cls.destination, departure_date=date.today() + timedelta(days=1), departure_time=time(10), creator=cls.driver)
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.addCleanup(self.loop.close)
+
+    def test_trip_and_join_request_events(self):
+        broker = InProcessBroker()
+        driver = self.loop.run_until_complete(_subscribe(broker, self.driver.pk))
+        passenger = self.loop.run_until_complete(_subscribe(broker, self.passenger.pk))
+
+        with mock.patch('api.push._broker', broker):
+            with self.captureOnCommitCallbacks(execute=True):
+                request = TripJoinRequest.objects.create(trip=self.trip, user=self.passenger)
+            event = self.loop.run_until_complete(_next_event(driver))
+            self.assertEqual(event, {'model': 'join_request', 'id': request.pk, 'action': 'upsert', 'trip': self.trip.pk, 'status': 'pending'})
+            self.assertEqual(self.loop.run_until_complete(_next_event(passenger))['model'], 'join_request')
+
+            with self.captureOnCommitCallbacks(execute=True):
+                self.trip.seats = 2
+                self.trip.save()
+            self.assertEqual(self.loop.run_until_complete(_next_event(passenger)), {'model': 'trip', 'id': self.trip.pk, 'action': 'upsert'})
+
+        broker.unsubscribe(self.driver.pk, driver)
+        broker.publish([self.driver.pk], {'model': 'trip'})
+        self.assertEqual(broker.connection_count(), 1)
+
+    async def test_events_need_an_active_user(self):
+        token = await sync_to_async(lambda: str(RefreshToken.for_user(self.passenger).access_token))()
+
+        async def open_stream():
+            sent = []
+            async def receive():
+                return {'type': 'http.disconnect'}
+            async def send(message):
+                sent.append(message)
+            scope = {'type': 'http', 'method': 'GET', 'path': '/api/events/', 'headers': [(b'authorization', f'Bearer {token}'.encode())]}
+            with mock.patch('api.sse.close_old_connections'): # would close the connection of the test transaction
+                await events_application(scope, receive, send)
+            return sent[0]['status']
+
+        self.assertEqual(await open_stream(), 200)
+        await CustomUser.objects.filter(pk=self.passenger.pk).aupdate(deleted_at=timezone.now())
+        self.assertEqual(await open_stream(), 401)
+        await CustomUser.objects.filter(pk=self.passenger.pk).aupdate(deleted_at=None, is_active=False)
+        self.assertEqual(await open_stream(), 401)
+
+    def test_postgres_notifications_reach_local_subscribers(self):
+        broker = PostgresBroker()
+        with mock.patch.object(PostgresBroker, '_start_listener'):
+            queue = self.loop.run_until_complete(_subscribe(broker, self.driver.pk))
+        broker.deliver(json.dumps({'users': [self.passenger.pk, self.driver.pk], 'event': {'model': 'trip', 'id': 1, 'action': 'delete'}}))
+        self.assertEqual(self.loop.run_until_complete(_next_event(queue)), {'model': 'trip', 'id': 1, 'action': 'delete'})
+
+
+@skipUnless(connection.vendor == 'postgresql', 'LISTEN/NOTIFY needs PostgreSQL')
+class PostgresBrokerTests(TransactionTestCase):
+    """
+    An event published through Postgres must reach the subscribers of any process.
+    """
+    def test_publish_reaches_listener(self):
+        loop = asyncio.new_event_loop()
+        self.addCleanup(loop.close)
+        broker, publisher = PostgresBroker(), PostgresBroker() # the publisher stands for another process
+        queue = loop.run_until_complete(_subscribe(broker, 1))
+        for _ in range(50): # the listener thread connects in the background
+            publisher.publish([1], {'model': 'trip', 'id': 1, 'action': 'upsert'})
+            try:
+                event = loop.run_until_complete(_next_event(queue, timeout=0.1))
+                break
+            except asyncio.TimeoutError:
+                continue
+        else:
+            self.fail('The event was not delivered')
+        self.assertEqual(event, {'model': 'trip', 'id': 1, 'action': 'upsert'})
+
+
+class RankingTests(TripTestData, TestCase):
+    """
+    The ranked search must prefer the trips closest in place, time, preferences and driver rating, and keep
+    the candidates closest in time on busy routes.
+    """
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.other = CustomUser.objects.create_user('other@carpool.com', 'password', first_name='other', last_name='user')
+        cls.ensenada = City.objects.create(name='Ensenada', latitude=-34.86, longitude=-57.91, state=cls.state)
+        cls.day = date.today() + timedelta(days=3)
+        cls.departure = Trip.combine_departure(cls.day, time(12))
+
+    def create_trip(self, origin=None, hour=12, creator=None, **flags):
+        return Trip.objects.create(
+            origin_city=origin or self.origin, destination_city=self.destination, departure_date=self.day,
+            departure_time=time(hour), creator=creator or self.driver, **flags,
+        )
+
+    def rank(self, **preferences):
+        return [trip_id for trip_id, _ in rank_trips(self.origin, self.destination, self.departure, preferences)]
+
+    def test_scores(self):
+        best = self.create_trip()
+        later = self.create_trip(hour=20)
+        farther = self.create_trip(origin=self.ensenada)
+        self.assertEqual(self.rank(), [best.id, farther.id, later.id])
+
+        pets = self.create_trip(pet_allowed=True)
+        self.assertEqual(self.rank(pet_allowed=True)[0], pets.id)
+
+        rated = self.create_trip(creator=self.other)
+        for index in range(5):
+            reviewer = CustomUser.objects.create_user(f'reviewer{index}@carpool.com', 'password', first_name='reviewer', last_name='user')
+            Review.objects.create(user=self.other, reviewer=reviewer, trip=rated, rating=5)
+        self.assertEqual(self.rank()[0], rated.id)
+
+    def test_candidates_closest_in_time(self):
+        trips = {hour: self.create_trip(hour=hour) for hour in (3, 10, 13, 22)}
+        with mock.patch.object(ranking, 'MAX_CANDIDATES', 2):
+            candidates = get_candidates(self.origin, self.destination, self.departure, 50, 3)
+        self.assertEqual([candidate[0] for candidate in candidates], [trips[13].id, trips[10].id])
+
+    def test_endpoint(self):
+        trip = self.create_trip(origin=self.ensenada)
+        client = APIClient()
+        client.force_authenticate(self.other)
+        response = client.get('/api/trips/ranked/', {'origin': self.origin.id, 'destination': self.destination.id, 'date': self.day.isoformat()})
+
+        self.assertEqual([row['id'] for row in response.data], [trip.id])
+        self.assertGreater(response.data[0]['score'], 0.5)
+        self.assertEqual(client.get('/api/trips/ranked/').status_code, 400)
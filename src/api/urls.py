@@ -9,6 +9,14 @@ from .views import (
     TripParticipantViewSet,
     TripViewSet,
     TripJoinRequestViewSet,
+    ReviewViewSet,
+    RouteSubscriptionViewSet,
+    RouteViewSet,
+    ExportView,
+    SyncView,
+    BatchView,
+    DashboardView,
+    CacheStatsView,
 )
 
 
@@ -20,8 +28,16 @@ router.register(r"vehicles", VehicleViewSet)
 router.register(r"participants", TripParticipantViewSet)
 router.register(r"trips", TripViewSet)
 router.register(r"join-requests", TripJoinRequestViewSet)
+router.register(r"reviews", ReviewViewSet)
+router.register(r"route-subscriptions", RouteSubscriptionViewSet)
+router.register(r"routes", RouteViewSet)
 
 urlpatterns = [
     path("", include(router.urls)),
     path("trips/<int:trip_pk>/join-requests/", TripJoinRequestViewSet.as_view({"get": "list"})),
+    path("export/<str:resource>/", ExportView.as_view()),
+    path("sync/", SyncView.as_view()),
+    path("batch/", BatchView.as_view()),
+    path("me/dashboard/", DashboardView.as_view()),
+    path("cache/stats/", CacheStatsView.as_view()),
 ]
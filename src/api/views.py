@@ -1,9 +1,29 @@
-from rest_framework import viewsets
-from rest_framework.exceptions import PermissionDenied
-from rest_framework.permissions import IsAuthenticated, AllowAny
+import hashlib
+from datetime import date, time, timedelta
+
+from django.core.handlers.asgi import ASGIRequest
+from django.db import transaction
+from django.db.models import Avg, Count, Prefetch, Q, Sum
+from django.http import StreamingHttpResponse
+from django.utils import timezone
+from django.utils.cache import patch_vary_headers
+from django.utils.http import parse_etags, quote_etag
+from rest_framework import mixins, status, viewsets
+from rest_framework.decorators import action
+from rest_framework.response import Response
+from rest_framework.exceptions import PermissionDenied, NotFound, ValidationError
+from rest_framework.permissions import IsAuthenticated, AllowAny, IsAdminUser
+from rest_framework.views import APIView
 
 from authentication.models import CustomUser
-from trip.models import State, City, Trip, TripParticipant, Vehicle, TripJoinRequest
+from authentication.throttling import SignupIPThrottle
+from review.models import Review
+from trip.models import State, City, Trip, TripParticipant, Vehicle, TripJoinRequest, RouteDailyStat, RouteSubscription
+from trip.stops import SegmentError, book_segment, release_segment, find_segments
+from trip.tasks import send_trip_created_email
+from trip.clusters import get_clusters, schedule_rebuild
+from trip.distances import suggest_seat_cost
+from jobs.queue import enqueue, enqueue_many
 from .serializers import (
     CustomUserCreateSerializer,
     CustomUserDetailSerializer,
@@ -16,8 +36,23 @@ from .serializers import (
     TripParticipantListSerializer,
     TripDetailSerializer,
     TripListSerializer,
-    TripJoinRequestSerializer
+    TripJoinRequestSerializer,
+    ReviewSerializer,
+    RouteSubscriptionSerializer,
+    RouteTrendSerializer,
+    RouteDailyStatSerializer,
+    BatchSerializer,
+    DashboardSerializer,
 )
+from . import reference
+from .bulk import BulkCreateMixin
+from .caching import cache, invalidate_on_commit
+from .purge import soft_delete_trip, soft_delete_user
+from .batch import run_batch
+from .exports import EXPORT_RESOURCES, EXPORT_FORMATS, astream_export, stream_export
+from .ranking import rank_trips
+from .signals import record_bulk_create
+from .sync import build_delta, build_snapshot, decode_token
 
 
 class CustomUserViewSet(viewsets.ModelViewSet):
@@ -28,12 +63,17 @@ class CustomUserViewSet(viewsets.ModelViewSet):
     Methods:
         get_permissions():
             Allows unauthenticated users to access the `create` action, while all other actions require authentication.
+        get_throttles():
+            Applies the per-IP signup throttle to the `create` action.
         get_queryset():
             Returns the queryset of CustomUser instances for the currently authenticated user based on the action.
+        perform_destroy(instance):
+            Deactivates the user and purges its data in the background (see api/purge.py).
         get_serializer_class():
             Returns the appropriate serializer class based on the action to does not expose sensitive data to other users.
     """
-    queryset = CustomUser.objects.all()
+    queryset = CustomUser.objects.order_by('id')
+    unfiltered_count_actions = ('list',) # only the soft-deleted users are left out (see api/pagination.py)
 
     def get_permissions(self):
         if self.action == "create":
@@ -42,10 +82,18 @@ class CustomUserViewSet(viewsets.ModelViewSet):
         #    self.permission_classes = [IsAuthenticated]
         return super().get_permissions()
 
+    def get_throttles(self):
+        if self.action == "create":
+            self.throttle_classes = [SignupIPThrottle]
+        return super().get_throttles()
+
     def get_queryset(self):
         if self.action in ["retrieve", "update", "partial_update", "destroy"]:
             return CustomUser.objects.filter(id=self.request.user.id)
-        return super().get_queryset()
+        return super().get_queryset().filter(deleted_at__isnull=True)
+
+    def perform_destroy(self, instance):
+        soft_delete_user(instance)
 
     def get_serializer_class(self):
         if self.action in ("create", "update", "partial_update"):
@@ -60,39 +108,46 @@ class StateViewSet(viewsets.ReadOnlyModelViewSet):
     This viewset provides `list` and `retrieve` actions.
     All actions require authentication
     The states can only be created by an admin users outside the API.
+    The `list` action is served from the reference cache (see api/reference.py).
     """
 
     queryset = State.objects.all()
     serializer_class = StateSerializer
     permission_classes = [IsAuthenticated]
 
+    def list(self, request, *args, **kwargs):
+        return Response(reference.get_states())
+
 
 class CityViewSet(viewsets.ReadOnlyModelViewSet):
     """
     This viewset provides `list` and `retrieve` actions.
     All actions require authentication
     The cities can only be created by an admin users outside the API.
+    The `list` action is served from the reference cache (see api/reference.py).
     """
 
     queryset = City.objects.all()
     serializer_class = CitySerializer
     permission_classes = [IsAuthenticated]
 
+    def list(self, request, *args, **kwargs):
+        return Response(reference.get_cities())
+
 
-class VehicleViewSet(viewsets.ModelViewSet):
+class VehicleViewSet(BulkCreateMixin, viewsets.ModelViewSet):
     """
     A viewset for viewing and editing Vehicle instances.
 
     This viewset provides `create`, `retrieve`, `update`, `partial_update`, `destroy`, and `list` actions.
-    The `create` action assigns the authenticated user as the owner of the vehicle.
+    The `create` action assigns the authenticated user as the owner of the vehicle, and accepts a list of vehicles (see api/bulk.py).
+    Every action only sees the vehicles of the authenticated user.
     """
-    queryset = Vehicle.objects.all()
+    queryset = Vehicle.objects.order_by('id')
     permission_classes = [IsAuthenticated]
 
     def get_queryset(self):
-        if self.action in ("retrieve", "update", "partial_update", "destroy"):
-            return Vehicle.objects.filter(owner=self.request.user)
-        return super().get_queryset()
+        return super().get_queryset().filter(owner=self.request.user)
 
     def get_serializer_class(self):
         if self.action in ("create", "update", "partial_update", "retrieve"):
@@ -102,6 +157,10 @@ class VehicleViewSet(viewsets.ModelViewSet):
     def perform_create(self, serializer):
         serializer.save(owner=self.request.user)
 
+    def perform_bulk_create(self, serializer):
+        vehicles = serializer.save(owner=self.request.user)
+        record_bulk_create('vehicle', vehicles, lambda vehicle: [vehicle.owner_id])
+
 
 class TripParticipantViewSet(viewsets.ModelViewSet):
     """
@@ -109,13 +168,17 @@ class TripParticipantViewSet(viewsets.ModelViewSet):
 
     This viewset provides `create`, `retrieve`, `update`, `partial_update`, `destroy`, and `list` actions.
     The `create` action ensures that a user can only participate in a trip once.
+    The `list` action returns the participations of the authenticated user and the participants of the trips they created.
     """
-    queryset = TripParticipant.objects.all()
+    queryset = TripParticipant.objects.order_by('id')
     permission_classes = [IsAuthenticated]
 
     def get_queryset(self):
         if self.action in ("retrieve", "update", "partial_update", "destroy"):
-            return TripParticipant.objects.filter(user=self.request.user)
+            return TripParticipant.objects.filter(user=self.request.user, trip__deleted_at__isnull=True)
+        if self.action == "list":
+            user = self.request.user
+            return super().get_queryset().filter(Q(user=user) | Q(trip__creator=user), trip__deleted_at__isnull=True).select_related('user', 'trip')
         return super().get_queryset()
 
     def get_serializer_class(self):
@@ -141,17 +204,90 @@ class TripParticipantViewSet(viewsets.ModelViewSet):
         raise PermissionDenied("No puedes actualizar un participante, solo puedes crear o eliminar.")
 
 
-class TripViewSet(viewsets.ModelViewSet):   
+def _int_param(request, name, default, maximum):
+    try:
+        value = int(request.query_params.get(name, default))
+    except ValueError:
+        raise ValidationError(f'El parámetro {name} debe ser un número entero')
+    return max(1, min(value, maximum))
+
+
+def _date_param(request, name, default):
+    value = request.query_params.get(name)
+    if value is None:
+        return default
+    try:
+        return date.fromisoformat(value)
+    except ValueError:
+        raise ValidationError(f'El parámetro {name} debe ser una fecha con formato AAAA-MM-DD')
+
+
+def _bbox_param(request, name):
+    """
+    Parses a bounding box given as min_longitude,min_latitude,max_longitude,max_latitude in degrees.
+    """
+    try:
+        min_longitude, min_latitude, max_longitude, max_latitude = (float(value) for value in request.query_params.get(name, '').split(','))
+    except ValueError:
+        raise ValidationError(f'El parámetro {name} debe tener el formato lon_min,lat_min,lon_max,lat_max')
+    if not (-180 <= min_longitude <= 180 and -180 <= max_longitude <= 180 and -90 <= min_latitude <= max_latitude <= 90):
+        raise ValidationError(f'El parámetro {name} tiene coordenadas fuera de rango')
+    return min_longitude, min_latitude, max_longitude, max_latitude
+
+
+def _bool_param(request, name):
+    value = request.query_params.get(name)
+    if value is None:
+        return None
+    return value.lower() in ('1', 'true')
+
+
+def _representation_etag(request, tag):
+    """
+    Returns the strong ETag of the representation of tag in the negotiated format, since the same data rendered
+    in different formats are different bytes. The responses that carry it must vary on Accept.
+    """
+    return quote_etag(f'{tag}-{request.accepted_renderer.format}')
+
+
+def _not_modified(etag):
+    response = Response(status=status.HTTP_304_NOT_MODIFIED, headers={'ETag': etag})
+    patch_vary_headers(response, ['Accept'])
+    return response
+
+
+def _etag_matches(request, etag):
+    if_none_match = request.headers.get('If-None-Match')
+    if not if_none_match:
+        return False
+    etags = parse_etags(if_none_match)
+    return '*' in etags or etag in etags
+
+
+class TripViewSet(BulkCreateMixin, viewsets.ModelViewSet):   
     """
     A viewset for viewing and editing Trip instances.
 
     This viewset provides `create`, `retrieve`, `update`, `partial_update`, `destroy`, and `list` actions.
     The `create` action assigns the authenticated user as the creator of the trip and adds them as a participant with the role of 'driver'.
+    It also accepts a list of trips, created with a constant number of queries (see api/bulk.py).
+    The `destroy` action hides the trip and purges it in the background (see api/purge.py).
+    The `retrieve` and `list` actions return a strong ETag built from the trip versions (of the requested page for
+    `list`) and the negotiated format, and answer 304 Not Modified when it matches the If-None-Match header, without serializing the trips.
+    The `retrieve` action serves the serialized trip from the two-tier cache, keyed by its version and tagged with
+    the trip and its participants.
+    The `ranked` action returns the upcoming trips that best match a passenger search, scored by `api.ranking`.
+    The `segments` action returns the upcoming trips that stop at `origin` and later at `destination` with a seat
+    left on that segment, the earliest departures first and at most `limit` (20 by default, up to 100) of them.
+    The `cost` action suggests the cost per seat of a trip from the precomputed distances of its route.
+    The `map` action returns the upcoming trips inside a bounding box grouped in clusters for the given zoom,
+    read from the cells precomputed by `trip.clusters`.
     """
-    queryset = Trip.objects.all() 
+    queryset = Trip.objects.order_by('id')
+    unfiltered_count_actions = ('list',) # only the soft-deleted trips are left out (see api/pagination.py)
 
     def get_permissions(self):
-        if self.action == "list":
+        if self.action in ("list", "map"):
             self.permission_classes = [AllowAny]
         else:
             self.permission_classes = [IsAuthenticated]
@@ -160,6 +296,9 @@ class TripViewSet(viewsets.ModelViewSet):
     def get_queryset(self):
         if self.action in ('update', 'partial_update', 'destroy'):
             return Trip.objects.filter(creator=self.request.user)
+        if self.action in ('list', 'retrieve', 'ranked', 'segments'):
+            # everything TripListSerializer reads, so it doesn't query per trip
+            return super().get_queryset().select_related('origin_city__state', 'destination_city__state', 'vehicle').prefetch_related('trip_participants__user', 'stops')
         return super().get_queryset()
 
     def get_serializer_class(self):
@@ -170,17 +309,388 @@ class TripViewSet(viewsets.ModelViewSet):
     def perform_create(self, serializer):
         trip = serializer.save(creator=self.request.user)
         TripParticipant.objects.create(trip=trip, user=self.request.user, role='driver')
+        enqueue(send_trip_created_email, trip.id)
+
+    def perform_bulk_create(self, serializer):
+        trips = serializer.save(creator=self.request.user)
+        participants = TripParticipant.objects.bulk_create(TripParticipant(trip=trip, user=self.request.user, role='driver') for trip in trips)
+        record_bulk_create('trip', trips, lambda trip: [trip.creator_id])
+        record_bulk_create('participant', participants, lambda participant: [participant.user_id])
+        invalidate_on_commit('trips')
+        enqueue_many(send_trip_created_email, [(trip.id,) for trip in trips])
+
+    def perform_destroy(self, instance):
+        soft_delete_trip(instance)
+
+    def retrieve(self, request, *args, **kwargs):
+        row = self.filter_queryset(self.get_queryset()).filter(pk=kwargs['pk']).values_list('version', 'vehicle_id').first()
+        if row is None:
+            return super().retrieve(request, *args, **kwargs) # 404
+        version, vehicle_id = row
+        etag = _representation_etag(request, f"trip-{kwargs['pk']}-v{version}")
+        if _etag_matches(request, etag):
+            return _not_modified(etag)
+        participant_ids = TripParticipant.objects.filter(trip=kwargs['pk']).values_list('user_id', flat=True)
+        data = cache.get_or_set(
+            f"trip:{kwargs['pk']}:v{version}",
+            lambda: dict(self.get_serializer(self.get_object()).data),
+            tags=[
+                f"trip:{kwargs['pk']}", 'cities', 'states', *(f'user:{user_id}' for user_id in participant_ids),
+                *([f'vehicle:{vehicle_id}'] if vehicle_id else []),
+            ],
+        )
+        response = Response(data, headers={'ETag': etag})
+        patch_vary_headers(response, ['Accept'])
+        return response
+
+    def list(self, request, *args, **kwargs):
+        page = self.paginate_queryset(self.filter_queryset(self.get_queryset()))
+        digest = hashlib.sha1(f'{self.paginator.page.paginator.count};'.encode())
+        for trip in page:
+            digest.update(f'{trip.pk}:{trip.version};'.encode())
+        etag = _representation_etag(request, f'trips-{digest.hexdigest()}')
+        if _etag_matches(request, etag):
+            return _not_modified(etag)
+        response = self.get_paginated_response(self.get_serializer(page, many=True).data)
+        response['ETag'] = etag
+        patch_vary_headers(response, ['Accept'])
+        return response
+
+    @action(detail=False)
+    def ranked(self, request):
+        origin_id = request.query_params.get('origin', '')
+        destination_id = request.query_params.get('destination', '')
+        if not (origin_id.isdigit() and destination_id.isdigit()):
+            raise ValidationError('Los parámetros origin y destination son obligatorios')
+        cities = City.objects.in_bulk([int(origin_id), int(destination_id)])
+        if int(origin_id) not in cities or int(destination_id) not in cities:
+            raise NotFound('La ciudad especificada no existe')
+        departure_date = _date_param(request, 'date', timezone.localdate())
+        try:
+            departure_time = time.fromisoformat(request.query_params.get('time', '12:00'))
+        except ValueError:
+            raise ValidationError('El parámetro time debe ser una hora con formato HH:MM')
+        preferences = {name: _bool_param(request, name) for name in ('pet_allowed', 'smoking_allowed', 'kids_allowed')}
+
+        ranking = rank_trips(
+            cities[int(origin_id)],
+            cities[int(destination_id)],
+            Trip.combine_departure(departure_date, departure_time),
+            preferences,
+            radius_km=_int_param(request, 'radius_km', 50, 300),
+            window_days=_int_param(request, 'window_days', 3, 14),
+            limit=_int_param(request, 'limit', 20, 100),
+        )
+        trips = self.get_queryset().in_bulk([trip_id for trip_id, _ in ranking])
+        results = []
+        for trip_id, score in ranking:
+            data = TripListSerializer(trips[trip_id], context=self.get_serializer_context()).data
+            data['score'] = round(score, 4)
+            results.append(data)
+        return Response(results)
+
+    @action(detail=False)
+    def segments(self, request):
+        origin_id = request.query_params.get('origin', '')
+        destination_id = request.query_params.get('destination', '')
+        if not (origin_id.isdigit() and destination_id.isdigit()):
+            raise ValidationError('Los parámetros origin y destination son obligatorios')
+        trips = Trip.objects.filter(departure_at__gte=timezone.now())
+        if 'date' in request.query_params:
+            start = Trip.combine_departure(_date_param(request, 'date', None), time.min)
+            trips = Trip.objects.filter(departure_at__gte=start, departure_at__lt=start + timedelta(days=1))
+        segments = find_segments(int(origin_id), int(destination_id), trips, limit=_int_param(request, 'limit', 20, 100))
+        trips = self.get_queryset().in_bulk([trip_id for trip_id, _, _, _ in segments])
+        results = []
+        for trip_id, _, _, seats in segments:
+            data = TripListSerializer(trips[trip_id], context=self.get_serializer_context()).data
+            data['available_seats'] = seats
+            results.append(data)
+        return Response(results)
+
+    @action(detail=True)
+    def cost(self, request, pk=None):
+        return Response(suggest_seat_cost(self.get_object()))
+
+    @action(detail=False, url_path='map')
+    def map(self, request):
+        bbox = _bbox_param(request, 'bbox')
+        try:
+            zoom = int(request.query_params.get('zoom', ''))
+        except ValueError:
+            raise ValidationError('El parámetro zoom debe ser un número entero')
+        if zoom < 0:
+            raise ValidationError('El parámetro zoom no puede ser negativo')
+        schedule_rebuild() # drops the trips that departed since the last rebuild
+        return Response({'zoom': zoom, 'clusters': get_clusters(*bbox, zoom)})
 
 
 class TripJoinRequestViewSet(viewsets.ModelViewSet):
+    """
+    A viewset for viewing and editing the join requests of the trips created by the authenticated user.
+
+    Accepting a request takes a seat on every leg of the requested segment of the trip, and leaving the
+    accepted status (or deleting an accepted request) frees it.
+
+    The list can be filtered by `status`. The requests are looked up through the creator copied onto the
+    request, so the inbox of a driver is a single (trip_creator, status) index scan. Deleting a trip clears the
+    creator of its requests (see api/purge.py), so they leave the inbox and can no longer be changed.
+
+    Methods:
+        pending_count(request):
+            Returns the number of pending join requests received by the authenticated user.
+    """
     queryset = TripJoinRequest.objects.all()
     serializer_class = TripJoinRequestSerializer
     permission_classes = [IsAuthenticated]
     
     def get_queryset(self):
-        user = self.request.user
+        queryset = TripJoinRequest.objects.filter(trip_creator=self.request.user)
         trip_id = self.kwargs.get('trip_pk')
         if trip_id:
-            return TripJoinRequest.objects.filter(trip__creator=user, trip=trip_id)
-        return TripJoinRequest.objects.filter(trip__creator=user)  
-     
\ No newline at end of file
+            queryset = queryset.filter(trip=trip_id)
+        request_status = self.request.query_params.get('status')
+        if request_status:
+            queryset = queryset.filter(status=request_status)
+        return queryset.order_by('-created_at')
+
+    @action(detail=False, url_path='pending-count')
+    def pending_count(self, request):
+        count = TripJoinRequest.objects.filter(trip_creator=request.user, status='pending').count()
+        return Response({'pending': count})
+
+    @transaction.atomic
+    def perform_update(self, serializer):
+        previous = TripJoinRequest.objects.select_related('trip').select_for_update(of=('self',)).get(pk=serializer.instance.pk)
+        if previous.trip.deleted_at is not None:
+            raise ValidationError('No se puede modificar una solicitud de un viaje eliminado')
+        join_request = serializer.save()
+        try:
+            if previous.status == 'accepted':
+                release_segment(previous.trip, previous.pickup_city_id, previous.dropoff_city_id)
+            if join_request.status == 'accepted':
+                book_segment(join_request.trip, join_request.pickup_city_id, join_request.dropoff_city_id)
+        except SegmentError as error:
+            raise ValidationError(str(error))
+
+    @transaction.atomic
+    def perform_destroy(self, instance):
+        if instance.status == 'accepted':
+            release_segment(instance.trip, instance.pickup_city_id, instance.dropoff_city_id)
+        instance.delete()
+
+
+class ReviewViewSet(BulkCreateMixin, mixins.CreateModelMixin, mixins.RetrieveModelMixin, mixins.ListModelMixin, viewsets.GenericViewSet):
+    """
+    A viewset for creating and viewing Review instances.
+
+    This viewset provides `create`, `retrieve`, and `list` actions over the reviews made by the authenticated user.
+    The `create` action assigns the authenticated user as the reviewer, and accepts a list of reviews (see api/bulk.py).
+    """
+    queryset = Review.objects.order_by('id')
+    serializer_class = ReviewSerializer
+    permission_classes = [IsAuthenticated]
+
+    def get_queryset(self):
+        return super().get_queryset().filter(reviewer=self.request.user)
+
+    def perform_create(self, serializer):
+        serializer.save(reviewer=self.request.user)
+
+    def perform_bulk_create(self, serializer):
+        serializer.save(reviewer=self.request.user)
+
+
+class RouteSubscriptionViewSet(mixins.CreateModelMixin, mixins.ListModelMixin, mixins.DestroyModelMixin, viewsets.GenericViewSet):
+    """
+    A viewset for the route subscriptions of the authenticated user.
+
+    This viewset provides `create`, `list` and `destroy` actions. The new trips of the subscribed routes are
+    sent to the user in the daily digest email (see trip/digests.py).
+    """
+    queryset = RouteSubscription.objects.order_by('id')
+    serializer_class = RouteSubscriptionSerializer
+    permission_classes = [IsAuthenticated]
+
+    def get_queryset(self):
+        return super().get_queryset().filter(user=self.request.user)
+
+    def perform_create(self, serializer):
+        serializer.save(user=self.request.user)
+
+
+class RouteViewSet(viewsets.GenericViewSet):
+    """
+    A viewset for reading the route popularity rollups.
+
+    This viewset provides the `trending` and `calendar` actions, both served from the RouteDailyStat table
+    instead of aggregating the Trip table.
+
+    Methods:
+        trending(request):
+            Returns the routes with more trips in the next `days` days (default 30), limited to `limit` routes (default 10).
+            Cached for 5 minutes, and invalidated when a trip or a city changes.
+        calendar(request):
+            Returns the trip and seat counts per day of the route given by `origin` and `destination`,
+            between `start` and `end` (default: the next 90 days).
+    """
+    queryset = RouteDailyStat.objects.all()
+    permission_classes = [AllowAny]
+
+    @action(detail=False)
+    def trending(self, request):
+        days = _int_param(request, 'days', 30, 365)
+        limit = _int_param(request, 'limit', 10, 100)
+        today = timezone.localdate()
+
+        def load():
+            routes = (
+                RouteDailyStat.objects.filter(departure_date__range=(today, today + timedelta(days=days)), trip_count__gt=0)
+                .values('origin_city_id', 'origin_city__name', 'destination_city_id', 'destination_city__name')
+                .annotate(total_trips=Sum('trip_count'), total_seats=Sum('seat_count'))
+                .order_by('-total_trips', '-total_seats')[:limit]
+            )
+            return list(RouteTrendSerializer(routes, many=True).data)
+
+        return Response(cache.get_or_set(f'routes:trending:{today}:{days}:{limit}', load, tags=['trips', 'cities'], timeout=300))
+
+    @action(detail=False)
+    def calendar(self, request):
+        origin = request.query_params.get('origin')
+        destination = request.query_params.get('destination')
+        if not (origin and origin.isdigit() and destination and destination.isdigit()):
+            raise ValidationError('Los parámetros origin y destination son obligatorios')
+        start = _date_param(request, 'start', timezone.localdate())
+        end = _date_param(request, 'end', start + timedelta(days=90))
+        if end < start or (end - start).days > 366:
+            raise ValidationError('El rango de fechas es invalido')
+        stats = RouteDailyStat.objects.filter(
+            origin_city_id=origin,
+            destination_city_id=destination,
+            departure_date__range=(start, end),
+            trip_count__gt=0,
+        ).order_by('departure_date')
+        return Response(RouteDailyStatSerializer(stats, many=True).data)
+
+
+class ExportView(APIView):
+    """
+    A view for exporting whole tables to staff users.
+
+    The rows are streamed as NDJSON (default) or CSV using `?output=csv`, and can be compressed
+    on the fly with `?gzip=true`. The response is built from a queryset iterator, so the memory usage
+    does not depend on the size of the exported table. Under ASGI the chunks are served from an async
+    iterator, since Django would otherwise read a sync iterator into a list before sending it.
+    """
+    permission_classes = [IsAdminUser]
+
+    def get(self, request, resource):
+        if resource not in EXPORT_RESOURCES:
+            raise NotFound('El recurso especificado no existe')
+        output_format = request.query_params.get('output', 'ndjson')
+        if output_format not in EXPORT_FORMATS:
+            raise ValidationError('El formato especificado es invalido')
+        compress = request.query_params.get('gzip', '').lower() in ('1', 'true')
+
+        filename = f'{resource}.{output_format}'
+        content_type = 'text/csv' if output_format == 'csv' else 'application/x-ndjson'
+        if compress:
+            filename += '.gz'
+            content_type = 'application/gzip'
+
+        export = astream_export if isinstance(request._request, ASGIRequest) else stream_export
+        response = StreamingHttpResponse(export(resource, output_format, compress), content_type=content_type)
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
+        return response
+
+
+class SyncView(APIView):
+    """
+    A view for syncing the rows of the authenticated user to a client.
+
+    Returns the trips, join requests, participations and vehicles visible to the user that were created,
+    updated or deleted after the `since` token, plus a new token to use in the next call. Deleted rows,
+    or rows that are no longer visible to the user, are returned as ids in `deleted`.
+    Without a token, or with a token that can no longer be served, every row is returned and `reset` is true.
+    When `has_more` is true the client should call again with the new token right away.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        context = self.get_renderer_context()
+        since = request.query_params.get('since')
+        since_key = decode_token(since) if since else None
+        payload = build_delta(request.user, since_key, context) if since_key is not None else None
+        if payload is None:
+            payload = build_snapshot(request.user, context)
+        return Response(payload)
+
+
+class BatchView(APIView):
+    """
+    A view for running several API reads in one round trip.
+
+    Receives `{"requests": ["/api/users/1/", "/api/trips/?page=2", ...], "parallel": false}` and returns
+    `{"responses": [{"status": 200, "body": ...}, ...]}` in the same order. Each path runs as a GET request
+    through the API URLs with the authentication of the batch request, so permissions apply as usual.
+    """
+    permission_classes = [AllowAny]
+
+    def post(self, request):
+        serializer = BatchSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        responses = run_batch(request, serializer.validated_data['requests'], serializer.validated_data['parallel'])
+        return Response({'responses': responses})
+
+
+class DashboardView(APIView):
+    """
+    A view for the home screen of the authenticated user.
+
+    Returns the user's rating, vehicles, created trips (with their pending join request count), participations,
+    and the pending join requests sent and received, with a fixed number of queries no matter how many rows
+    the user has.
+
+    Methods:
+        get_queryset():
+            Returns the queryset of the authenticated user annotated with the rating and with every relation prefetched.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def get_queryset(self):
+        user = self.request.user
+        trips = Trip.objects.select_related('origin_city__state', 'destination_city__state', 'vehicle')
+        return CustomUser.objects.filter(pk=user.pk).annotate(
+            rating_average=Avg('reviews__rating'),
+            rating_count=Count('reviews__rating'),
+        ).prefetch_related(
+            'vehicles',
+            Prefetch(
+                'created_trips',
+                queryset=trips.order_by('departure_at'),
+            ),
+            Prefetch('created_trips__trip_participants', queryset=TripParticipant.objects.select_related('user')),
+            'created_trips__stops',
+            Prefetch(
+                'user_trips',
+                queryset=TripParticipant.objects.exclude(trip__creator=user).filter(trip__deleted_at__isnull=True).select_related('trip__origin_city__state', 'trip__destination_city__state', 'trip__vehicle'),
+            ),
+            Prefetch('user_trips__trip__trip_participants', queryset=TripParticipant.objects.select_related('user')),
+            'user_trips__trip__stops',
+            Prefetch('join_requests', queryset=TripJoinRequest.objects.filter(status='pending', trip__deleted_at__isnull=True), to_attr='pending_join_requests'),
+        )
+
+    def get(self, request):
+        user = self.get_queryset().get()
+        user.received_join_requests = TripJoinRequest.objects.filter(trip_creator=user, status='pending').order_by('created_at')
+        return Response(DashboardSerializer(user, context={'request': request}).data)
+
+
+class CacheStatsView(APIView):
+    """
+    A view for the admins to read the hit and miss counters of the two-tier cache of the process that answers.
+    """
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        return Response(cache.stats())
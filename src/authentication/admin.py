@@ -1,3 +1,56 @@
 from django.contrib import admin
+from django.contrib.admin.models import CHANGE, LogEntry
+from django.db import transaction
 
-# Register your models here.
+from api.caching import invalidate_on_commit
+from api.purge import soft_delete_user
+from .models import CustomUser
+
+
+@admin.register(CustomUser)
+class CustomUserAdmin(admin.ModelAdmin):
+    """
+    Users sign up through the API, so the admin only lists, searches and edits them. The password is never shown.
+    Deleting users deactivates them and purges their data in the background, like the API does.
+    The rare values of its filters, the inactive and the staff users, are read through partial indexes.
+    """
+    list_display = ('id', 'email', 'first_name', 'last_name', 'is_active', 'is_staff', 'date_joined')
+    list_filter = ('is_active', 'is_staff')
+    search_fields = ('^email', '=document_number')
+    fields = ('email', 'first_name', 'last_name', 'document_number', 'phone_number', 'birth_date', 'about_me', 'profile_picture', 'is_active', 'is_staff', 'is_superuser', 'last_login', 'date_joined')
+    readonly_fields = ('last_login', 'date_joined')
+    ordering = ('-id',)
+    actions = ('deactivate', 'activate')
+    show_full_result_count = False
+
+    def has_add_permission(self, request):
+        return False
+
+    def delete_model(self, request, obj):
+        soft_delete_user(obj)
+
+    def delete_queryset(self, request, queryset):
+        for user in queryset:
+            soft_delete_user(user)
+
+    def set_active(self, request, queryset, is_active):
+        """
+        Updates the users whose state changes with one UPDATE, then invalidates their cached rows and logs the change
+        in the admin history, since a queryset update doesn't send the model signals.
+        """
+        with transaction.atomic():
+            users = list(queryset.exclude(is_active=is_active).select_for_update().only('id', 'email'))
+            CustomUser.objects.filter(pk__in=[user.pk for user in users]).update(is_active=is_active)
+            invalidate_on_commit(*(f'user:{user.pk}' for user in users))
+            LogEntry.objects.log_actions(request.user.pk, users, CHANGE, [{'changed': {'fields': ['is_active']}}])
+        return len(users)
+
+    @admin.action(description='Desactivar los usuarios seleccionados')
+    def deactivate(self, request, queryset):
+        updated = self.set_active(request, queryset.exclude(pk=request.user.pk), False)
+        self.message_user(request, f'{updated} usuarios desactivados')
+
+    @admin.action(description='Activar los usuarios seleccionados')
+    def activate(self, request, queryset):
+        updated = self.set_active(request, queryset, True)
+        self.message_user(request, f'{updated} usuarios activados')
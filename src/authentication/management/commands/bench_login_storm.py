@@ -0,0 +1,74 @@
+import statistics
+import threading
+import time
+
+import requests
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = (
+        'Measures the latency of a cheap read endpoint on a running server, first alone and then '
+        'during a storm of concurrent logins, to check that password hashing does not starve the reads.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--base-url', default='http://localhost:8000')
+        parser.add_argument('--email', required=True, help='Email of an existing user used for the logins.')
+        parser.add_argument('--password', required=True)
+        parser.add_argument('--read-path', default='/api/trips/')
+        parser.add_argument('--duration', type=float, default=10, help='Seconds of each phase.')
+        parser.add_argument('--login-concurrency', type=int, default=16)
+        parser.add_argument('--read-concurrency', type=int, default=4)
+
+    def handle(self, *args, **options):
+        self.options = options
+        baseline = self.run_phase(login_threads=0)
+        storm = self.run_phase(login_threads=options['login_concurrency'])
+
+        self.stdout.write(f"{'phase':<10}{'reads':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'logins':>8}{'429s':>8}")
+        for name, result in (('baseline', baseline), ('storm', storm)):
+            reads = result['reads']
+            self.stdout.write(
+                f"{name:<10}{len(reads):>8}{self.percentile(reads, 50):>10.1f}{self.percentile(reads, 95):>10.1f}"
+                f"{self.percentile(reads, 99):>10.1f}{result['logins']:>8}{result['throttled']:>8}"
+            )
+
+    def run_phase(self, login_threads):
+        result = {'reads': [], 'logins': 0, 'throttled': 0}
+        lock = threading.Lock()
+        deadline = time.perf_counter() + self.options['duration']
+        read_url = self.options['base_url'] + self.options['read_path']
+        login_url = self.options['base_url'] + '/api/token/'
+        credentials = {'email': self.options['email'], 'password': self.options['password']}
+
+        def read_loop():
+            session = requests.Session()
+            while time.perf_counter() < deadline:
+                start = time.perf_counter()
+                session.get(read_url)
+                elapsed = (time.perf_counter() - start) * 1000
+                with lock:
+                    result['reads'].append(elapsed)
+
+        def login_loop():
+            session = requests.Session()
+            while time.perf_counter() < deadline:
+                response = session.post(login_url, json=credentials)
+                with lock:
+                    result['logins'] += 1
+                    result['throttled'] += response.status_code == 429
+
+        threads = [threading.Thread(target=read_loop) for _ in range(self.options['read_concurrency'])]
+        threads += [threading.Thread(target=login_loop) for _ in range(login_threads)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return result
+
+    @staticmethod
+    def percentile(values, percent):
+        if len(values) < 2:
+            return values[0] if values else 0.0
+        return statistics.quantiles(values, n=100)[percent - 1]
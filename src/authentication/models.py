@@ -20,6 +20,8 @@ class CustomUser(AbstractUser):
         - document_number (CharField): The document number of the user.
         - phone_number (PhoneNumberField): The phone number of the user.
         - profile_picture (ImageField): The profile picture of the user.
+        - deleted_at (DateTimeField): When the user deleted the account. The user is deactivated right away and its
+          rows are purged in the background (see api/purge.py).
     
     Attributes inherits from AbstractUser:
         - username (CharField): The username of the user.
@@ -39,6 +41,9 @@ class CustomUser(AbstractUser):
         - __str__: Returns a string representation of the user.
         - clean: Validates the document number and birth date of the user.
         - save: Overrides the save method to set the username as 'first_name last_name' when saving the user.
+    
+    Meta:
+        - indexes: partial indexes on the inactive and on the staff users, the rare values of the admin filters.
     """
     email = models.EmailField(verbose_name='Email', unique=True)
     birth_date = models.DateField(verbose_name='Fecha de nacimiento', blank=True, null=True)
@@ -47,6 +52,7 @@ class CustomUser(AbstractUser):
     phone_number = PhoneNumberField(region='AR', verbose_name='Número de teléfono')
     username = models.CharField(max_length=150, unique=False, blank=True, null=True)
     profile_picture = models.ImageField(upload_to='profile_pictures/', blank=True, null=True)
+    deleted_at = models.DateTimeField(null=True, blank=True, editable=False, verbose_name='Fecha de baja')
     
     USERNAME_FIELD = 'email'
     REQUIRED_FIELDS = ['first_name', 'last_name']
@@ -80,4 +86,10 @@ class CustomUser(AbstractUser):
         reviews = self.review.all()
         if len(reviews) > 20:
             return round(sum([review.rating for review in reviews]) / len(reviews), 1)
-        return 'Este usuario no tiene suficientes calificaciones'
\ No newline at end of file
+        return 'Este usuario no tiene suficientes calificaciones'
+
+    class Meta(AbstractUser.Meta):
+        indexes = [
+            models.Index(fields=['id'], condition=models.Q(is_active=False), name='customuser_inactive_idx'),
+            models.Index(fields=['id'], condition=models.Q(is_staff=True), name='customuser_staff_idx'),
+        ]
@@ -1,3 +1,99 @@
-from django.test import TestCase
+import threading
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.admin.models import CHANGE, LogEntry
+from django.core.cache import cache
+from django.test import Client, TestCase
+from rest_framework.test import APIClient, APIRequestFactory
+from rest_framework.throttling import SimpleRateThrottle
+
+from .models import CustomUser
+from .throttling import SlidingWindowThrottle
+
+
+class WindowThrottle(SlidingWindowThrottle):
+    scope = 'test'
+    rate = '5/min'
+
+    def get_cache_key(self, request, view):
+        return 'throttle_test_client'
+
+
+class SlidingWindowThrottleTests(TestCase):
+    """
+    The window must allow bursts up to the rate, weight the previous window and never be overdrawn by
+    concurrent requests.
+    """
+    def setUp(self):
+        cache.clear()
+        self.request = APIRequestFactory().get('/')
+
+    def test_burst_and_sliding_window(self):
+        now = [1200.0] # start of a window
+        with mock.patch.object(WindowThrottle, 'timer', lambda throttle: now[0]):
+            throttle = WindowThrottle()
+            self.assertEqual([throttle.allow_request(self.request, None) for _ in range(6)], [True] * 5 + [False])
+            self.assertAlmostEqual(throttle.wait(), 60)
+
+            now[0] += 84 # 40% into the next window, the previous one still weighs 5 * 0.6 = 3 requests
+            self.assertEqual([throttle.allow_request(self.request, None) for _ in range(3)], [True, True, False])
+            self.assertAlmostEqual(throttle.wait(), 12)
+
+            now[0] += 12
+            self.assertTrue(throttle.allow_request(self.request, None))
+
+    def test_concurrent_requests_do_not_overdraw(self):
+        results = []
+        barrier = threading.Barrier(20)
+
+        def request():
+            barrier.wait()
+            results.append(WindowThrottle().allow_request(self.request, None))
+
+        threads = [threading.Thread(target=request) for _ in range(20)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results.count(True), 5)
+
+
+@mock.patch.dict(SimpleRateThrottle.THROTTLE_RATES, {'login_ip': None, 'login_account': None})
+class LoginViewTests(TestCase):
+    """
+    The token endpoint must authenticate active users with their password.
+    """
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create_user('driver@carpool.com', 'password', first_name='driver', last_name='user')
+
+    def test_login_endpoint(self):
+        client = APIClient()
+        self.assertIn('access', client.post('/api/token/', {'email': 'driver@carpool.com', 'password': 'password'}, format='json').data)
+        self.assertEqual(client.post('/api/token/', {'email': 'driver@carpool.com', 'password': 'wrong'}, format='json').status_code, 401)
+
+        CustomUser.objects.filter(pk=self.user.pk).update(is_active=False)
+        self.assertEqual(client.post('/api/token/', {'email': 'driver@carpool.com', 'password': 'password'}, format='json').status_code, 401)
+
+
+class UserAdminTests(TestCase):
+    """
+    The admin actions update the users in bulk, so they must invalidate their cached rows and log the change themselves.
+    """
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = CustomUser.objects.create_superuser('admin@carpool.com', 'password', first_name='admin', last_name='user')
+        cls.users = [CustomUser.objects.create_user(f'user{i}@carpool.com', 'password', first_name='user', last_name=str(i)) for i in range(3)]
+
+    def test_deactivate_action(self):
+        client = Client()
+        client.force_login(self.admin)
+        with mock.patch('authentication.admin.invalidate_on_commit') as invalidate:
+            response = client.post('/admin/authentication/customuser/', {
+                'action': 'deactivate', '_selected_action': [self.admin.pk, self.users[0].pk, self.users[1].pk],
+            })
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(set(CustomUser.objects.filter(is_active=False).values_list('id', flat=True)), {self.users[0].pk, self.users[1].pk})
+        self.assertEqual(set(invalidate.call_args.args), {f'user:{self.users[0].pk}', f'user:{self.users[1].pk}'})
+        entries = LogEntry.objects.filter(action_flag=CHANGE, user=self.admin)
+        self.assertEqual(sorted(int(entry.object_id) for entry in entries), [self.users[0].pk, self.users[1].pk])
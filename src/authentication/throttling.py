@@ -0,0 +1,70 @@
+from django.contrib.auth import get_user_model
+from rest_framework.throttling import SimpleRateThrottle
+
+
+class SlidingWindowThrottle(SimpleRateThrottle):
+    """
+    Throttle based on a sliding window counter stored in the cache.
+
+    The rate of the scope (e.g. '10/min' in DEFAULT_THROTTLE_RATES) is counted in fixed windows of its
+    duration, and the count of the previous window is weighted by the part of it that still overlaps the
+    sliding window, so a client can't double its rate at the edge of a window.
+
+    Every request takes its place with cache.add() and cache.incr(), which are atomic on the local memory
+    and Redis backends, so concurrent requests of the same client can never go over the rate and never wait
+    for each other. A rejected request gives its place back, so it does not count against the client.
+    """
+    def allow_request(self, request, view):
+        if self.rate is None:
+            return True
+        self.key = self.get_cache_key(request, view)
+        if self.key is None:
+            return True
+
+        now = self.timer()
+        window, offset = divmod(now, self.duration)
+        elapsed = offset / self.duration # part of the current window that has passed
+        current_key = f'{self.key}:{int(window)}'
+        self.cache.add(current_key, 0, self.duration * 2)
+        try:
+            count = self.cache.incr(current_key)
+        except ValueError: # expired between add() and incr()
+            self.cache.add(current_key, 1, self.duration * 2)
+            count = 1
+        previous = self.cache.get(f'{self.key}:{int(window) - 1}', 0)
+
+        if previous * (1 - elapsed) + count <= self.num_requests:
+            return True
+        self.cache.decr(current_key)
+        if count > self.num_requests:
+            self.wait_time = (1 - elapsed) * self.duration
+        else: # until the weight of the previous window leaves room for the request
+            self.wait_time = (1 - (self.num_requests - count) / previous - elapsed) * self.duration
+        return False
+
+    def wait(self):
+        return getattr(self, 'wait_time', None)
+
+
+class LoginIPThrottle(SlidingWindowThrottle):
+    scope = 'login_ip'
+
+    def get_cache_key(self, request, view):
+        return self.cache_format % {'scope': self.scope, 'ident': self.get_ident(request)}
+
+
+class LoginAccountThrottle(SlidingWindowThrottle):
+    scope = 'login_account'
+
+    def get_cache_key(self, request, view):
+        username = request.data.get(get_user_model().USERNAME_FIELD)
+        if not isinstance(username, str) or not username:
+            return None
+        return self.cache_format % {'scope': self.scope, 'ident': username.strip().lower()}
+
+
+class SignupIPThrottle(SlidingWindowThrottle):
+    scope = 'signup_ip'
+
+    def get_cache_key(self, request, view):
+        return self.cache_format % {'scope': self.scope, 'ident': self.get_ident(request)}
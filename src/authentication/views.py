@@ -1,3 +1,10 @@
-from django.shortcuts import render
+from rest_framework_simplejwt.views import TokenObtainPairView
 
-# Create your views here.
+from .throttling import LoginIPThrottle, LoginAccountThrottle
+
+
+class LoginView(TokenObtainPairView):
+    """
+    TokenObtainPairView with per-IP and per-account sliding window throttling.
+    """
+    throttle_classes = [LoginIPThrottle, LoginAccountThrottle]
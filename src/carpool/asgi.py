@@ -3,6 +3,9 @@ ASGI config for carpool project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
 
+Requests to /api/events/ are served by the Server-Sent Events application in api/sse.py,
+every other request is handled by Django.
+
 For more information on this file, see
 https://docs.djangoproject.com/en/5.1/howto/deployment/asgi/
 """
@@ -13,4 +16,12 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'carpool.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+from api.sse import events_application  # noqa: E402 (needs the apps to be loaded)
+
+
+async def application(scope, receive, send):
+    if scope['type'] == 'http' and scope['path'] == '/api/events/':
+        return await events_application(scope, receive, send)
+    return await django_application(scope, receive, send)
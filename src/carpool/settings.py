@@ -48,6 +48,7 @@ LOCAL_APPS = [
     'review.apps.ReviewConfig',
     'authentication.apps.AuthenticationConfig',
     'api.apps.ApiConfig',
+    'jobs.apps.JobsConfig',
 ]
 
 THIRD_PARTY_APPS = [
@@ -68,6 +69,7 @@ MIDDLEWARE = [
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'api.profiling.ProfilingMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
     "allauth.account.middleware.AccountMiddleware",
@@ -75,6 +77,9 @@ MIDDLEWARE = [
 
 ROOT_URLCONF = 'carpool.urls'
 
+# Fails the tests whose requests repeat a query per row or go over their query budget (see carpool/testing.py)
+TEST_RUNNER = 'carpool.testing.QueryCheckRunner'
+
 TEMPLATES = [
     {
         'BACKEND': 'django.template.backends.django.DjangoTemplates',
@@ -94,6 +99,13 @@ TEMPLATES = [
 
 WSGI_APPLICATION = 'carpool.wsgi.application'
 
+# Server-Sent Events served from carpool/asgi.py (see api/push.py and api/sse.py). The default broker only
+# reaches the clients of the same process, set PUSH_BROKER=api.push.PostgresBroker with several workers.
+PUSH_BROKER = env.str('PUSH_BROKER', default='api.push.InProcessBroker')
+PUSH_CHANNEL = 'carpool_push'
+PUSH_QUEUE_SIZE = 100
+PUSH_KEEPALIVE_SECONDS = 25
+
 
 # Database
 # https://docs.djangoproject.com/en/5.1/ref/settings/#databases
@@ -153,10 +165,70 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 AUTH_USER_MODEL = 'authentication.CustomUser'
 
+# Shared cache, local memory by default. Set CACHE_URL to use a file or network cache across processes,
+# e.g. filecache:///var/tmp/carpool or rediscache://redis:6379/1
+CACHES = {
+    'default': env.cache('CACHE_URL', default='locmemcache://'),
+}
+
+# Size and timeout of the per-process tier of the two-tier cache (see api/caching.py)
+CACHE_LOCAL_MAX_ENTRIES = 1000
+CACHE_LOCAL_TIMEOUT = 30
+
+# Seconds the serialized cities and states are cached (see api/reference.py)
+REFERENCE_CACHE_TIMEOUT = 600
+
+# Maximum number of threads used to run the sub-requests of a parallel /api/batch/ call
+BATCH_MAX_WORKERS = env.int('BATCH_MAX_WORKERS', default=4)
+
+# Page size limit and total count strategy of the list endpoints (see api/pagination.py)
+PAGINATION_MAX_PAGE_SIZE = 200
+PAGINATION_ESTIMATE_THRESHOLD = 100000
+PAGINATION_COUNT_CACHE_TIMEOUT = 60
+
+# Maximum number of objects of a bulk create request (see api/bulk.py)
+BULK_CREATE_MAX_ITEMS = 500
+
+# On-demand profiling of the requests of staff users (see api/profiling.py)
+PROFILING_ENABLED = env.bool('PROFILING_ENABLED', default=True)
+PROFILING_DIR = env.str('PROFILING_DIR', default=str(BASE_DIR / 'profiles'))
+PROFILING_MAX_QUERIES = 200 # queries listed in a report
+PROFILING_TOP_FUNCTIONS = 40 # functions listed in a report
+
+# Precomputed city distances and seat cost suggestions (see trip/distances.py)
+CITY_DISTANCE_MAX_KM = 2000 # pairs further apart are not stored, their distance is computed on demand
+TRIP_ROAD_FACTOR = 1.25 # road distance over great-circle distance
+TRIP_COST_PER_KM = env.float('TRIP_COST_PER_KM', default=100)
+
+# Clusters of the trip map endpoint (see trip/clusters.py)
+TRIP_MAP_MAX_ZOOM = 12 # deeper zooms read the cells of this one
+TRIP_MAP_CELL_ZOOM_OFFSET = 3 # a cell is a tile of zoom + offset, 8x8 cells per map tile
+TRIP_MAP_REBUILD_INTERVAL = 300 # seconds between rebuilds that drop the trips that already departed
+TRIP_MAP_MAX_CLUSTERS = 2000
+
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
         'rest_framework_simplejwt.authentication.JWTAuthentication',
     ),
+    'DEFAULT_RENDERER_CLASSES': (
+        'api.renderers.ORJSONRenderer',
+        'api.renderers.MessagePackRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ),
+    'DEFAULT_PARSER_CLASSES': (
+        'api.renderers.ORJSONParser',
+        'api.renderers.MessagePackParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
+    ),
+    'DEFAULT_THROTTLE_RATES': {
+        'login_ip': env.str('LOGIN_IP_RATE', default='30/min'),
+        'login_account': env.str('LOGIN_ACCOUNT_RATE', default='5/min'),
+        'signup_ip': env.str('SIGNUP_IP_RATE', default='10/hour'),
+        'profiling': env.str('PROFILING_RATE', default='10/hour'),
+    },
+    'DEFAULT_PAGINATION_CLASS': 'api.pagination.StandardPagination',
+    'PAGE_SIZE': 50,
 }
 
 AUTHENTICATION_BACKENDS = [
@@ -182,7 +254,19 @@ ACCOUNT_EMAIL_REQUIRED = True
 ACCOUNT_USERNAME_REQUIRED = False
 ACCOUNT_CHANGE_EMAIL = True
 
-EMAIL_BACKEND = 'django.core.mail.backends.console.EmailBackend'
+EMAIL_BACKEND = env.str('EMAIL_BACKEND', default='django.core.mail.backends.console.EmailBackend')
+
+# Daily digest emails of the notifications (see trip/digests.py)
+DIGEST_BATCH_SIZE = 100 # users whose digests are sent through one mail connection
+DIGEST_MAX_ITEMS = 20 # trips and requests listed in a digest, the rest are counted
+
+# Background jobs (see jobs/queue.py)
+JOBS_RETRY_BACKOFF = 30 # seconds before the first retry, doubled on every attempt
+JOBS_LOCK_TIMEOUT = 600 # seconds after which a running job is considered abandoned
+
+# Background purge of deleted users and trips (see api/purge.py)
+PURGE_BATCH_SIZE = 1000 # rows deleted per statement
+PURGE_BATCHES_PER_JOB = 50 # statements run before the job enqueues itself again
 
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
\ No newline at end of file
@@ -0,0 +1,178 @@
+"""
+Test runner that records the SQL run by every request of the tests and fails the tests that go over budget.
+
+Every test method is wrapped so that, while it runs, each query sent through any database connection is logged
+under the request being served by the test client. When the test passes, the log is checked for:
+
+    - N+1 patterns: the same SQL statement (ignoring its parameters and the length of IN lists) run
+      --n-plus-one-threshold times or more while serving one request, typically one query per row of a list.
+    - Query budgets declared with @query_budget on the test method or on its TestCase class, either a maximum
+      for every request of the test or a maximum per endpoint ('GET trip-list', by URL name).
+
+Queries run by the test itself (setUp, fixtures, direct ORM calls) are not checked. The caches are cleared
+before every test, so a response cached by a previous test can't hide the queries of an endpoint.
+
+Enabled by TEST_RUNNER; --no-query-checks turns the checks off.
+
+TripTestData holds the fixture shared by the tests of the trips: a driver and the route from La Plata to Mar del Plata.
+"""
+import functools
+import re
+from asyncio import iscoroutinefunction
+from collections import Counter
+from contextlib import ExitStack
+
+from asgiref.sync import async_to_sync
+from django.core.cache import caches
+from django.core.signals import request_started, request_finished
+from django.db import connections
+from django.test.runner import DiscoverRunner
+from django.test.utils import iter_test_cases
+from django.urls import Resolver404, resolve
+
+IN_LIST = re.compile(r'\((?:%s, )*%s\)')
+IGNORED = ('SAVEPOINT', 'RELEASE SAVEPOINT', 'ROLLBACK TO SAVEPOINT')
+
+
+def query_budget(budget, *, allow_repeated=False):
+    """
+    Declares the maximum number of queries of the requests of a test method or of every test of a TestCase.
+    `budget` is either a number for every request or a dict of numbers keyed by 'METHOD url-name'
+    (e.g. {'GET trip-list': 6}). With allow_repeated, the N+1 check is skipped.
+    """
+    def decorator(test):
+        test.query_budget = budget
+        test.allow_repeated_queries = allow_repeated
+        return test
+    return decorator
+
+
+def normalize(sql):
+    return IN_LIST.sub('(%s...)', sql)
+
+
+def find_repeated_queries(statements, threshold):
+    """
+    Returns the (statement, count) pairs of the statements run at least threshold times, ignoring the parameters.
+    """
+    counts = Counter(normalize(sql) for sql in statements if not sql.startswith(IGNORED))
+    return [(sql, count) for sql, count in counts.most_common() if count >= threshold]
+
+
+class RequestQueryLog:
+    """
+    Database execute wrapper that groups the queries by the request being served.
+    """
+    def __init__(self):
+        self.requests = [] # (method, path, endpoint, statements)
+        self.current = None
+
+    def request_started(self, sender, environ=None, scope=None, **kwargs):
+        if scope is not None: # AsyncClient
+            environ = {'PATH_INFO': scope['path'], 'REQUEST_METHOD': scope['method']}
+        path = environ.get('PATH_INFO', '')
+        try:
+            match = resolve(path)
+            endpoint = match.view_name
+        except Resolver404:
+            endpoint = None
+        self.current = []
+        self.requests.append((environ.get('REQUEST_METHOD', ''), path, endpoint, self.current))
+
+    def request_finished(self, sender, **kwargs):
+        self.current = None
+
+    def __call__(self, execute, sql, params, many, context):
+        if self.current is not None:
+            self.current.append(sql)
+        return execute(sql, params, many, context)
+
+
+def check_requests(requests, budget=None, allow_repeated=False, threshold=3):
+    """
+    Returns the descriptions of the budget overruns and N+1 patterns of the logged requests.
+    """
+    problems = []
+    for method, path, endpoint, statements in requests:
+        name = f'{method} {path} ({endpoint})'
+        limit = budget.get(f'{method} {endpoint}') if isinstance(budget, dict) else budget
+        count = sum(not sql.startswith(IGNORED) for sql in statements)
+        if limit is not None and count > limit:
+            problems.append(f'{name} ran {count} queries, over its budget of {limit}')
+        if not allow_repeated:
+            problems.extend(f'{name} ran the same query {repeats} times: {sql}' for sql, repeats in find_repeated_queries(statements, threshold))
+    return problems
+
+
+class QueryCheckRunner(DiscoverRunner):
+    def __init__(self, *args, query_checks=True, n_plus_one_threshold=3, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.query_checks = query_checks
+        self.n_plus_one_threshold = n_plus_one_threshold
+
+    @classmethod
+    def add_arguments(cls, parser):
+        super().add_arguments(parser)
+        parser.add_argument('--no-query-checks', action='store_false', dest='query_checks', help='Do not check the queries of the requests.')
+        parser.add_argument('--n-plus-one-threshold', type=int, default=3, help='Times a query can be repeated in a request before failing (default 3).')
+
+    def build_suite(self, *args, **kwargs):
+        suite = super().build_suite(*args, **kwargs)
+        if self.query_checks:
+            for test in iter_test_cases(suite):
+                method = getattr(test, test._testMethodName, None)
+                if method is not None:
+                    setattr(test, test._testMethodName, self.wrap(test, method))
+        return suite
+
+    def wrap(self, test, method):
+        budget = getattr(method, 'query_budget', getattr(test, 'query_budget', None))
+        allow_repeated = getattr(method, 'allow_repeated_queries', getattr(test, 'allow_repeated_queries', False))
+        threshold = self.n_plus_one_threshold
+        if iscoroutinefunction(method):
+            # Django only runs async tests that are coroutine functions, so the wrapper runs them itself.
+            method = async_to_sync(method)
+
+        @functools.wraps(method)
+        def wrapper(*args, **kwargs):
+            from api.caching import cache
+            for alias in caches:
+                caches[alias].clear()
+            cache.clear_local()
+
+            log = RequestQueryLog()
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(log))
+                request_started.connect(log.request_started)
+                request_finished.connect(log.request_finished)
+                stack.callback(request_started.disconnect, log.request_started)
+                stack.callback(request_finished.disconnect, log.request_finished)
+                result = method(*args, **kwargs)
+            problems = check_requests(log.requests, budget, allow_repeated, threshold)
+            if problems:
+                raise AssertionError('Query checks failed:\n' + '\n'.join(problems))
+            return result
+        return wrapper
+
+
+class TripTestData:
+    """
+    TestCase mixin that creates, in setUpTestData, the driver (driver@carpool.com), the state of Buenos Aires and
+    its cities La Plata (origin) and Mar del Plata (destination). A TransactionTestCase calls create_trip_data()
+    from setUp instead.
+    """
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.create_trip_data()
+
+    @classmethod
+    def create_trip_data(cls):
+        from authentication.models import CustomUser
+        from trip.models import State, City
+
+        cls.driver = CustomUser.objects.create_user('driver@carpool.com', 'password', first_name='driver', last_name='user')
+        cls.state = State.objects.create(name='Buenos Aires', abbreviation='BA', country='Argentina')
+        cls.origin = City.objects.create(name='La Plata', latitude=-34.92, longitude=-57.95, state=cls.state)
+        cls.destination = City.objects.create(name='Mar del Plata', latitude=-38.0, longitude=-57.55, state=cls.state)
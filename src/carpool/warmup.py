@@ -0,0 +1,22 @@
+"""
+Warm-up run once by the production server (see gunicorn.conf.py) after the application is loaded and
+before the workers are forked, so every worker starts with the work below already done.
+"""
+from django.db import connections
+from django.urls import get_resolver, reverse
+
+
+def warm_up():
+    # build the URL resolvers and their reverse lookup tables
+    resolver = get_resolver()
+    resolver.url_patterns
+    resolver.reverse_dict
+    reverse('token_obtain_pair')
+
+    # load the reference data read on almost every screen
+    from api import reference
+    reference.get_states()
+    reference.get_cities()
+
+    # the forked workers must not share the sockets opened by the master
+    connections.close_all()
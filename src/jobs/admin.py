@@ -0,0 +1,20 @@
+from django.contrib import admin
+from django.utils import timezone
+
+from .models import Job
+
+
+@admin.register(Job)
+class JobAdmin(admin.ModelAdmin):
+    list_display = ('id', 'task', 'status', 'attempts', 'run_at', 'finished_at')
+    list_filter = ('status',)
+    search_fields = ('=task',)
+    readonly_fields = ('attempts', 'locked_at', 'last_error', 'created_at', 'finished_at')
+    ordering = ('-id',)
+    actions = ('retry',)
+    show_full_result_count = False
+
+    @admin.action(description='Reintentar los trabajos fallidos seleccionados')
+    def retry(self, request, queryset):
+        updated = queryset.filter(status='failed').update(status='pending', attempts=0, run_at=timezone.now(), finished_at=None)
+        self.message_user(request, f'{updated} trabajos reencolados')
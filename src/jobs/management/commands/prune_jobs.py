@@ -0,0 +1,25 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from jobs.models import Job
+
+
+class Command(BaseCommand):
+    help = 'Deletes the jobs that finished before the given number of days. Failed jobs are kept longer so their errors can be looked at.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=7, help='Days to keep the done jobs.')
+        parser.add_argument('--failed-days', type=int, default=30, help='Days to keep the failed jobs.')
+
+    def handle(self, *args, **options):
+        now = timezone.now()
+        deleted = 0
+        for status, days in (('done', options['days']), ('failed', options['failed_days'])):
+            finished = Job.objects.filter(status=status, finished_at__lt=now - timedelta(days=days))
+            # in batches, so a large backlog does not hold its locks in one long statement
+            while ids := list(finished.values_list('pk', flat=True)[:settings.PURGE_BATCH_SIZE]):
+                deleted += Job.objects.filter(pk__in=ids).delete()[0]
+        self.stdout.write(self.style.SUCCESS(f'{deleted} jobs deleted'))
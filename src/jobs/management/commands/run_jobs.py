@@ -0,0 +1,34 @@
+import signal
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from jobs.queue import requeue_stale_jobs, run_pending
+
+
+class Command(BaseCommand):
+    help = 'Runs the queued jobs. Several workers can run at the same time, each one claims its own batches.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=10)
+        parser.add_argument('--sleep', type=float, default=1.0, help='Seconds to wait when the queue is empty.')
+        parser.add_argument('--once', action='store_true', help='Run the due jobs and exit.')
+
+    def handle(self, *args, **options):
+        self.running = True
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+
+        while self.running:
+            close_old_connections()
+            requeue_stale_jobs()
+            claimed = run_pending(options['batch_size'])
+            if options['once'] and not claimed:
+                break
+            if not claimed:
+                time.sleep(options['sleep'])
+
+    def stop(self, signum, frame):
+        self.stdout.write('Stopping after the current batch')
+        self.running = False
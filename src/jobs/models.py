@@ -0,0 +1,52 @@
+from django.db import models
+
+
+class Job(models.Model):
+    """
+    Job model representing a call to a registered task that runs outside the request, in the run_jobs worker.
+    
+    Attributes:
+        - task (CharField): The name of the registered task.
+        - args (JSONField): The positional arguments of the call.
+        - kwargs (JSONField): The keyword arguments of the call.
+        - status (CharField): The status of the job.
+        - attempts (PositiveIntegerField): The number of times the job was claimed by a worker.
+        - max_attempts (PositiveIntegerField): The number of attempts before the job is marked as failed.
+        - run_at (DateTimeField): The date and time from which the job can be claimed.
+        - locked_at (DateTimeField): The date and time the job was claimed by a worker.
+        - last_error (TextField): The traceback of the last failed attempt.
+        - created_at (DateTimeField): The creation date of the job.
+        - finished_at (DateTimeField): The date and time the job succeeded or failed for good.
+    
+    Attributes inherits from Model:
+        - id (AutoField): The primary key for the job.
+    
+    Methods:
+        - __str__: Returns a string representation of the job.
+    
+    Meta:
+        - indexes: (status, run_at) so the workers claim the due jobs with an index range scan, and
+          (status, finished_at) so prune_jobs finds the finished jobs the same way.
+    """
+    STATUS_CHOICES = [('pending', 'Pending'), ('running', 'Running'), ('done', 'Done'), ('failed', 'Failed')]
+
+    task = models.CharField(max_length=200, verbose_name='Tarea')
+    args = models.JSONField(default=list, blank=True, verbose_name='Argumentos')
+    kwargs = models.JSONField(default=dict, blank=True, verbose_name='Argumentos con nombre')
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='pending', verbose_name='Estado')
+    attempts = models.PositiveIntegerField(default=0, verbose_name='Intentos')
+    max_attempts = models.PositiveIntegerField(default=5, verbose_name='Intentos máximos')
+    run_at = models.DateTimeField(verbose_name='Ejecutar desde')
+    locked_at = models.DateTimeField(null=True, blank=True, verbose_name='Tomado en')
+    last_error = models.TextField(blank=True, verbose_name='Último error')
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name='Fecha de creación')
+    finished_at = models.DateTimeField(null=True, blank=True, verbose_name='Fecha de finalización')
+
+    def __str__(self):
+        return f"{self.task} ({self.status})"
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'run_at']),
+            models.Index(fields=['status', 'finished_at']),
+        ]
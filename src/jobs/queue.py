@@ -0,0 +1,115 @@
+"""
+Database-backed job queue.
+
+Jobs are enqueued with enqueue() from any code path, usually in the same transaction as the change that needs
+them, and run by the `manage.py run_jobs` worker. Workers claim batches of due jobs with
+SELECT ... FOR UPDATE SKIP LOCKED, so several workers can poll the table without blocking each other or running
+the same job twice (on SQLite, which has no row locks, a single worker should be used).
+
+Failed jobs are retried with exponential backoff until max_attempts, then marked as failed.
+"""
+import logging
+import random
+import traceback
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import Job
+from .registry import get_task
+
+logger = logging.getLogger(__name__)
+
+
+def enqueue(task, *args, run_at=None, delay=None, max_attempts=5, **kwargs):
+    """
+    Creates a job that calls the registered task with the given JSON serializable arguments.
+    The job is visible to the workers once the current transaction commits.
+    """
+    name = task if isinstance(task, str) else task.task_name
+    get_task(name) # fail early on unknown tasks
+    if run_at is None:
+        run_at = timezone.now() + (delay or timedelta())
+    return Job.objects.create(task=name, args=list(args), kwargs=kwargs, run_at=run_at, max_attempts=max_attempts)
+
+
+def enqueue_many(task, args_list, run_at=None, max_attempts=5):
+    """
+    Creates one job per tuple of positional arguments in args_list with a single INSERT.
+    """
+    name = task if isinstance(task, str) else task.task_name
+    get_task(name)
+    run_at = run_at or timezone.now()
+    return Job.objects.bulk_create(Job(task=name, args=list(args), kwargs={}, run_at=run_at, max_attempts=max_attempts) for args in args_list)
+
+
+def claim_jobs(batch_size=10):
+    """
+    Marks up to batch_size due jobs as running and returns them. Rows locked by other workers are skipped.
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        jobs = list(
+            Job.objects.select_for_update(skip_locked=True)
+            .filter(status='pending', run_at__lte=now)
+            .order_by('run_at', 'id')[:batch_size]
+        )
+        if jobs:
+            Job.objects.filter(pk__in=[job.pk for job in jobs]).update(status='running', locked_at=now, attempts=F('attempts') + 1)
+    for job in jobs:
+        job.status, job.locked_at, job.attempts = 'running', now, job.attempts + 1
+    return jobs
+
+
+def get_backoff(attempts):
+    base = getattr(settings, 'JOBS_RETRY_BACKOFF', 30)
+    return timedelta(seconds=base * 2 ** (attempts - 1) * random.uniform(0.8, 1.2))
+
+
+def run_job(job):
+    """
+    Runs a claimed job and stores its result: done, pending again with a backoff, or failed.
+    Returns True if the job succeeded.
+    """
+    try:
+        get_task(job.task)(*job.args, **job.kwargs)
+    except Exception:
+        error = traceback.format_exc()
+        logger.warning('Job %s (%s) failed on attempt %s', job.pk, job.task, job.attempts)
+        if job.attempts >= job.max_attempts:
+            Job.objects.filter(pk=job.pk).update(status='failed', last_error=error, locked_at=None, finished_at=timezone.now())
+        else:
+            Job.objects.filter(pk=job.pk).update(status='pending', last_error=error, locked_at=None, run_at=timezone.now() + get_backoff(job.attempts))
+        return False
+    Job.objects.filter(pk=job.pk).update(status='done', locked_at=None, finished_at=timezone.now())
+    return True
+
+
+def requeue_stale_jobs():
+    """
+    Puts back in the queue the running jobs whose worker died, i.e. claimed more than JOBS_LOCK_TIMEOUT seconds ago.
+    The lost run counts as an attempt (claim_jobs() already counted it), so a job that keeps killing its worker is
+    marked as failed once it reaches max_attempts instead of being requeued forever.
+    Returns the number of jobs put back in the queue.
+    """
+    timeout = timedelta(seconds=getattr(settings, 'JOBS_LOCK_TIMEOUT', 600))
+    now = timezone.now()
+    stale = Job.objects.filter(status='running', locked_at__lt=now - timeout)
+    error = f'The worker stopped responding for more than {timeout.total_seconds():.0f} seconds'
+    failed = stale.filter(attempts__gte=F('max_attempts')).update(status='failed', last_error=error, locked_at=None, finished_at=now)
+    if failed:
+        logger.warning('%s stale jobs failed after their last attempt', failed)
+    return stale.update(status='pending', last_error=error, locked_at=None)
+
+
+def run_pending(batch_size=10):
+    """
+    Claims and runs one batch of jobs, returning the number of jobs claimed.
+    """
+    jobs = claim_jobs(batch_size)
+    for job in jobs:
+        run_job(job)
+    return len(jobs)
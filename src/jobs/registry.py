@@ -0,0 +1,28 @@
+_tasks = {}
+
+
+class UnknownTaskError(KeyError):
+    pass
+
+
+def task(function=None, *, name=None):
+    """
+    Registers a function as a task that can be enqueued. The task name defaults to `<module>.<function>`.
+
+        @task
+        def send_trip_created_email(trip_id):
+            ...
+    """
+    def register(function):
+        function.task_name = name or f'{function.__module__}.{function.__name__}'
+        _tasks[function.task_name] = function
+        return function
+
+    return register(function) if function is not None else register
+
+
+def get_task(name):
+    try:
+        return _tasks[name]
+    except KeyError:
+        raise UnknownTaskError(f'Unknown task {name}')
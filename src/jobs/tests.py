@@ -0,0 +1,154 @@
+import io
+import threading
+from datetime import date, time, timedelta
+from unittest import skipUnless
+
+from django.core import mail
+from django.core.management import call_command
+from django.db import connection, connections, transaction
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+
+from carpool.testing import TripTestData
+from trip.models import Trip, Vehicle
+from .models import Job
+from .queue import enqueue, claim_jobs, run_pending, requeue_stale_jobs
+from .registry import task, UnknownTaskError
+
+calls = []
+
+
+@task(name='jobs.tests.record')
+def record(value):
+    calls.append(value)
+
+
+@task(name='jobs.tests.fail')
+def fail():
+    raise RuntimeError('boom')
+
+
+class JobQueueTests(TestCase):
+    def setUp(self):
+        calls.clear()
+
+    def test_enqueue_unknown_task(self):
+        with self.assertRaises(UnknownTaskError):
+            enqueue('jobs.tests.missing')
+
+    def test_run_pending(self):
+        enqueue(record, 1)
+        enqueue('jobs.tests.record', value=2)
+        enqueue(record, 3, delay=timedelta(hours=1))
+
+        self.assertEqual(run_pending(), 2)
+        self.assertEqual(calls, [1, 2])
+        self.assertEqual(Job.objects.filter(status='done').count(), 2)
+        self.assertEqual(run_pending(), 0)
+
+    def test_claimed_jobs_are_not_claimed_again(self):
+        enqueue(record, 1)
+        self.assertEqual(len(claim_jobs()), 1)
+        self.assertEqual(claim_jobs(), [])
+
+    @override_settings(JOBS_RETRY_BACKOFF=60)
+    def test_retry_with_backoff(self):
+        job = enqueue(fail, max_attempts=2)
+
+        run_pending()
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), ('pending', 1))
+        self.assertGreater(job.run_at, timezone.now() + timedelta(seconds=30))
+        self.assertIn('boom', job.last_error)
+
+        Job.objects.filter(pk=job.pk).update(run_at=timezone.now())
+        run_pending()
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), ('failed', 2))
+
+    def test_requeue_stale_jobs(self):
+        job = enqueue(record, 1)
+        claim_jobs()
+        Job.objects.filter(pk=job.pk).update(locked_at=timezone.now() - timedelta(hours=1))
+
+        self.assertEqual(requeue_stale_jobs(), 1)
+        run_pending()
+        self.assertEqual(calls, [1])
+
+    def test_stale_jobs_fail_at_max_attempts(self):
+        job = enqueue(record, 1, max_attempts=2)
+        for attempts, status in ((1, 'pending'), (2, 'failed')):
+            claim_jobs()
+            Job.objects.filter(pk=job.pk).update(locked_at=timezone.now() - timedelta(hours=1))
+            requeue_stale_jobs()
+            job.refresh_from_db()
+            self.assertEqual((job.status, job.attempts), (status, attempts))
+        self.assertIn('stopped responding', job.last_error)
+        self.assertEqual(run_pending(), 0)
+        self.assertEqual(calls, [])
+
+    @override_settings(PURGE_BATCH_SIZE=1)
+    def test_prune_jobs(self):
+        done, old_done, failed, old_failed, pending = (enqueue(record, value) for value in range(5))
+        long_ago = timezone.now() - timedelta(days=10)
+        Job.objects.filter(pk=done.pk).update(status='done', finished_at=timezone.now())
+        Job.objects.filter(pk=old_done.pk).update(status='done', finished_at=long_ago)
+        Job.objects.filter(pk=failed.pk).update(status='failed', finished_at=long_ago)
+        Job.objects.filter(pk=old_failed.pk).update(status='failed', finished_at=long_ago - timedelta(days=30))
+
+        call_command('prune_jobs', stdout=io.StringIO())
+        self.assertEqual(set(Job.objects.values_list('pk', flat=True)), {done.pk, failed.pk, pending.pk})
+
+
+class TripEmailTests(TripTestData, TestCase):
+    """
+    The e-mail jobs enqueued by the trips must be sent by the queue.
+    """
+    def test_trip_created_email(self):
+        vehicle = Vehicle.objects.create(owner=self.driver, license_plate='AB123CD', brand='Fiat', model='Uno')
+        trip = Trip.objects.create(
+            origin_city=self.origin, destination_city=self.destination, departure_date=date.today() + timedelta(days=1),
+            departure_time=time(10), creator=self.driver, vehicle=vehicle,
+        )
+
+        enqueue('trip.tasks.send_trip_created_email', trip.id)
+        run_pending()
+
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(mail.outbox[0].to, ['driver@carpool.com'])
+
+
+@skipUnless(connection.vendor == 'postgresql', 'SKIP LOCKED needs row locks, which SQLite does not have')
+class ConcurrentClaimTests(TransactionTestCase):
+    """
+    Workers polling the queue at the same time must claim disjoint batches without waiting for each other.
+    """
+    def claim_in_thread(self, results, barrier=None):
+        def claim():
+            try:
+                if barrier is not None:
+                    barrier.wait()
+                results.append([job.pk for job in claim_jobs(batch_size=5)])
+            finally:
+                connections.close_all()
+        thread = threading.Thread(target=claim)
+        thread.start()
+        return thread
+
+    def test_locked_jobs_are_skipped(self):
+        ids = [job.pk for job in (enqueue(record, value) for value in range(4))]
+        results = []
+        with transaction.atomic():
+            # another worker holding the first two jobs
+            list(Job.objects.select_for_update().filter(pk__in=ids[:2]))
+            self.claim_in_thread(results).join(timeout=10)
+        self.assertEqual(results, [ids[2:]])
+
+    def test_concurrent_claims_are_disjoint(self):
+        ids = [job.pk for job in (enqueue(record, value) for value in range(10))]
+        results, barrier = [], threading.Barrier(2)
+        for thread in [self.claim_in_thread(results, barrier) for _ in range(2)]:
+            thread.join(timeout=10)
+        claimed = [pk for batch in results for pk in batch]
+        self.assertEqual(len(results), 2)
+        self.assertEqual(sorted(claimed), ids)
@@ -1,3 +1,29 @@
 from django.contrib import admin
 
-# Register your models here.
+from .models import Review
+
+
+class RatingListFilter(admin.SimpleListFilter):
+    """
+    Filters the reviews by rating with fixed choices, so the sidebar doesn't run a DISTINCT query on the ratings.
+    """
+    title = 'calificación'
+    parameter_name = 'rating'
+
+    def lookups(self, request, model_admin):
+        return [(str(rating), str(rating)) for rating in range(1, 6)]
+
+    def queryset(self, request, queryset):
+        if self.value() in {str(rating) for rating in range(1, 6)}:
+            return queryset.filter(rating=int(self.value()))
+        return queryset
+
+
+@admin.register(Review)
+class ReviewAdmin(admin.ModelAdmin):
+    list_display = ('id', 'user', 'reviewer', 'trip', 'rating')
+    list_select_related = ('user', 'reviewer', 'trip__origin_city__state', 'trip__destination_city__state')
+    list_filter = (RatingListFilter,)
+    search_fields = ('=user__email', '=reviewer__email', '=trip__id')
+    autocomplete_fields = ('user', 'reviewer', 'trip')
+    show_full_result_count = False
@@ -29,7 +29,7 @@ class Review(models.Model):
     comment = models.TextField(verbose_name='Comentario', null=True, blank=True)
 
     def clean(self):
-        if not self.trip.participants.filter(user=self.reviewer).exists():
+        if not self.trip.trip_participants.filter(user=self.reviewer).exists():
             raise ValidationError('El usuario no puede realizar la calificación, debido a que no participó en el viaje.')
         
     class Meta:
@@ -1,3 +1,32 @@
+from datetime import date, time, timedelta
+
 from django.test import TestCase
 
-# Create your tests here.
+from authentication.models import CustomUser
+from carpool.testing import TripTestData
+from trip.models import Trip
+from .models import Review
+
+
+class ReviewAdminTests(TripTestData, TestCase):
+    """
+    The rating filter of the review admin offers fixed choices and filters the list by them.
+    """
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.admin = CustomUser.objects.create_superuser('admin@carpool.com', 'password', first_name='admin', last_name='user')
+        passenger = CustomUser.objects.create_user('passenger@carpool.com', 'password', first_name='passenger', last_name='user')
+        trip = Trip.objects.create(origin_city=cls.origin, destination_city=cls.destination, departure_date=date.today() + timedelta(days=1), departure_time=time(10), creator=cls.driver)
+        cls.good = Review.objects.create(user=cls.driver, reviewer=passenger, trip=trip, rating=5)
+        cls.bad = Review.objects.create(user=passenger, reviewer=cls.driver, trip=trip, rating=2)
+
+    def test_rating_filter(self):
+        self.client.force_login(self.admin)
+
+        response = self.client.get('/admin/review/review/')
+        choices = [choice['display'] for choice in response.context['cl'].filter_specs[0].choices(response.context['cl'])]
+        self.assertEqual(choices[1:], ['1', '2', '3', '4', '5'])
+
+        response = self.client.get('/admin/review/review/', {'rating': '2'})
+        self.assertEqual([review.pk for review in response.context['cl'].result_list], [self.bad.pk])
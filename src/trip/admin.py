@@ -1,3 +1,181 @@
 from django.contrib import admin
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
 
-# Register your models here.
+from api.purge import soft_delete_trip
+from api.signals import record_bulk_create
+from .models import State, City, Vehicle, Trip, TripParticipant, TripJoinRequest, TripStop, RouteDailyStat, CityDistance, TripMapCell, RouteSubscription, Notification
+from .digests import notify_join_request_statuses
+from .rollups import rebuild_pending_requests
+
+# The admins below are built for big tables: every changelist selects the relations shown by its columns, skips
+# the exact COUNT(*) of the whole table, only filters on choice fields covered by an index and on indexed date
+# fields (their sidebar doesn't run a DISTINCT query and the filtered list is an index scan) and picks related rows
+# with autocomplete widgets instead of loading every user and city into a dropdown.
+
+
+@admin.register(State)
+class StateAdmin(admin.ModelAdmin):
+    list_display = ('id', 'name', 'abbreviation', 'country')
+    search_fields = ('^name', '=abbreviation')
+    ordering = ('name',)
+
+
+@admin.register(City)
+class CityAdmin(admin.ModelAdmin):
+    list_display = ('id', 'name', 'state', 'latitude', 'longitude')
+    list_select_related = ('state',)
+    search_fields = ('^name',)
+    autocomplete_fields = ('state',)
+    ordering = ('name',)
+    show_full_result_count = False
+
+
+@admin.register(Vehicle)
+class VehicleAdmin(admin.ModelAdmin):
+    list_display = ('id', 'license_plate', 'brand', 'model', 'owner')
+    list_select_related = ('owner',)
+    search_fields = ('=license_plate',)
+    autocomplete_fields = ('owner',)
+    show_full_result_count = False
+
+
+class TripStopInline(admin.TabularInline):
+    model = TripStop
+    autocomplete_fields = ('city',)
+    readonly_fields = ('seats_taken',)
+    extra = 0
+
+
+@admin.register(Trip)
+class TripAdmin(admin.ModelAdmin):
+    list_display = ('id', 'origin_city', 'destination_city', 'departure_at', 'seats', 'pending_requests', 'creator')
+    date_hierarchy = 'departure_at'
+    search_fields = ('=id', '=creator__email')
+    autocomplete_fields = ('origin_city', 'destination_city', 'vehicle', 'creator')
+    readonly_fields = ('departure_at', 'version', 'pending_requests')
+    ordering = ('-departure_at', '-id')
+    inlines = [TripStopInline]
+    show_full_result_count = False
+
+    def get_queryset(self, request):
+        # Also used by the trip autocomplete of the other admins, which renders Trip.__str__ for every result.
+        return super().get_queryset(request).select_related('origin_city__state', 'destination_city__state', 'creator')
+
+    def delete_model(self, request, obj):
+        soft_delete_trip(obj)
+
+    def delete_queryset(self, request, queryset):
+        for trip in queryset:
+            soft_delete_trip(trip)
+
+
+_TRIP_RELATED = ('trip__origin_city__state', 'trip__destination_city__state')
+
+
+@admin.register(TripParticipant)
+class TripParticipantAdmin(admin.ModelAdmin):
+    list_display = ('id', 'user', 'trip', 'role')
+    list_select_related = ('user', *_TRIP_RELATED)
+    search_fields = ('=user__email', '=trip__id')
+    autocomplete_fields = ('user', 'trip')
+    show_full_result_count = False
+
+
+@admin.register(TripJoinRequest)
+class TripJoinRequestAdmin(admin.ModelAdmin):
+    list_display = ('id', 'user', 'trip', 'status', 'created_at')
+    list_select_related = ('user', *_TRIP_RELATED)
+    list_filter = ('status',)
+    search_fields = ('=user__email', '=trip__id')
+    autocomplete_fields = ('user', 'trip', 'pickup_city', 'dropoff_city')
+    actions = ('reject_pending',)
+    show_full_result_count = False
+
+    @admin.action(description='Rechazar las solicitudes pendientes seleccionadas')
+    @transaction.atomic
+    def reject_pending(self, request, queryset):
+        """
+        Rejects the selected pending requests with one UPDATE, then fixes the counters and versions of their
+        trips with one UPDATE each, logs and publishes the changes and notifies the requesters, since a queryset
+        update doesn't send the model signals.
+        """
+        rejected = list(queryset.filter(status='pending').select_related(None).select_for_update().only('id', 'user_id', 'trip_id', 'trip_creator_id'))
+        trip_ids = list({join_request.trip_id for join_request in rejected})
+        updated = TripJoinRequest.objects.filter(pk__in=[join_request.pk for join_request in rejected]).update(status='rejected', updated_at=timezone.now())
+        for join_request in rejected:
+            join_request.status = 'rejected'
+        record_bulk_create('join_request', rejected, lambda join_request: (join_request.user_id, join_request.trip_creator_id))
+        notify_join_request_statuses((join_request.user_id, join_request.trip_id, 'rejected') for join_request in rejected)
+        Trip.objects.filter(pk__in=trip_ids).update(version=F('version') + 1)
+        rebuild_pending_requests(trip_ids)
+        self.message_user(request, f'{updated} solicitudes rechazadas')
+
+
+@admin.register(RouteDailyStat)
+class RouteDailyStatAdmin(admin.ModelAdmin):
+    list_display = ('departure_date', 'origin_city', 'destination_city', 'trip_count', 'seat_count')
+    list_select_related = ('origin_city__state', 'destination_city__state')
+    date_hierarchy = 'departure_date'
+    ordering = ('-departure_date',)
+    show_full_result_count = False
+
+    def has_add_permission(self, request):
+        return False # maintained by the trip signals
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(TripMapCell)
+class TripMapCellAdmin(admin.ModelAdmin):
+    list_display = ('zoom', 'x', 'y', 'trip_count')
+    list_filter = ('zoom',)
+    ordering = ('zoom', 'x', 'y')
+    show_full_result_count = False
+
+    def has_add_permission(self, request):
+        return False # maintained by the trip signals and the map rebuild job
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(RouteSubscription)
+class RouteSubscriptionAdmin(admin.ModelAdmin):
+    list_display = ('id', 'user', 'origin_city', 'destination_city', 'created_at')
+    list_select_related = ('user', 'origin_city__state', 'destination_city__state')
+    search_fields = ('=user__email',)
+    autocomplete_fields = ('user', 'origin_city', 'destination_city')
+    show_full_result_count = False
+
+
+@admin.register(Notification)
+class NotificationAdmin(admin.ModelAdmin):
+    list_display = ('id', 'user', 'kind', 'trip', 'status', 'created_at', 'sent_at')
+    list_select_related = ('user', *_TRIP_RELATED)
+    list_filter = ('kind',)
+    date_hierarchy = 'created_at'
+    search_fields = ('=user__email', '=trip__id')
+    show_full_result_count = False
+
+    def has_add_permission(self, request):
+        return False # created by the trip and join request signals
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(CityDistance)
+class CityDistanceAdmin(admin.ModelAdmin):
+    list_display = ('from_city', 'to_city', 'distance_m')
+    list_select_related = ('from_city__state', 'to_city__state')
+    search_fields = ('=from_city__id', '=to_city__id')
+    show_full_result_count = False
+
+    def has_add_permission(self, request):
+        return False # computed by the compute_city_distances command
+
+    def has_change_permission(self, request, obj=None):
+        return False
@@ -0,0 +1,182 @@
+"""
+Map clusters of the upcoming trips, by origin city.
+
+The TripMapCell table holds, for every zoom level up to TRIP_MAP_MAX_ZOOM, the number of upcoming trips leaving
+from each cell of the map grid and the sums of the coordinates of their origin cities, so the centroid of a
+cluster is sum / count and a bounding box query at any zoom reads a handful of indexed rows.
+
+The cells are kept up to date incrementally:
+
+    - The Trip signals add or subtract a trip from the cells of its origin city when it's created, moved to
+      another origin, deleted or rescheduled into the past (see trip/signals.py).
+    - The bulk paths that bypass the signals call add_trips_to_map() and remove_trips_from_map().
+
+Trips leave the map when they depart, which no signal sees, so the table is also rebuilt from the Trip table by
+rebuild_trip_map(). The map endpoint enqueues a rebuild at most every TRIP_MAP_REBUILD_INTERVAL seconds, and
+moving a city enqueues one right away. The incremental updates hold the TRIP_MAP lock shared until their
+transaction ends and the rebuild holds it exclusive, so a rebuild counts the trips of every update that got in
+before it and the updates that come after it apply on top of the rebuilt cells.
+"""
+import numpy as np
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connection, transaction
+from django.db.models import Count, Q
+from django.utils import timezone
+
+from jobs.queue import enqueue
+from . import locks
+from .models import City, Trip, TripMapCell
+
+MAX_LATITUDE = 85.05112878 # limit of the Web Mercator projection
+UPSERT_BATCH_SIZE = 1000
+
+
+def get_max_zoom():
+    return getattr(settings, 'TRIP_MAP_MAX_ZOOM', 12)
+
+
+def tile_xy(latitude, longitude, zoom):
+    """
+    Returns the columns and rows of the Web Mercator tiles of zoom that contain the points (arrays of degrees).
+    """
+    n = 2 ** zoom
+    latitude = np.radians(np.clip(np.asarray(latitude, dtype=np.float64), -MAX_LATITUDE, MAX_LATITUDE))
+    x = np.floor((np.asarray(longitude, dtype=np.float64) + 180) / 360 * n)
+    y = np.floor((1 - np.log(np.tan(latitude) + 1 / np.cos(latitude)) / np.pi) / 2 * n)
+    return np.clip(x, 0, n - 1).astype(np.int64), np.clip(y, 0, n - 1).astype(np.int64)
+
+
+def cell_xy(latitude, longitude, zoom):
+    return tile_xy(latitude, longitude, zoom + getattr(settings, 'TRIP_MAP_CELL_ZOOM_OFFSET', 3))
+
+
+def get_cells(city_counts):
+    """
+    Returns {(zoom, x, y): [trip_count, latitude_sum, longitude_sum]} at every zoom level for the given
+    {city id: trip count}, computing the cells of all the cities of a zoom level at once.
+    """
+    cities = list(City.objects.filter(pk__in=list(city_counts)).values_list('id', 'latitude', 'longitude'))
+    if not cities:
+        return {}
+    ids, latitudes, longitudes = zip(*cities)
+    counts = [city_counts[city_id] for city_id in ids]
+    cells = {}
+    for zoom in range(get_max_zoom() + 1):
+        xs, ys = cell_xy(latitudes, longitudes, zoom)
+        for x, y, count, latitude, longitude in zip(xs.tolist(), ys.tolist(), counts, latitudes, longitudes):
+            cell = cells.setdefault((zoom, x, y), [0, 0.0, 0.0])
+            cell[0] += count
+            cell[1] += count * latitude
+            cell[2] += count * longitude
+    return cells
+
+
+def shift_map_cells(city_counts):
+    """
+    Adds the given signed {city id: trip count} to the cells of the cities, with one
+    INSERT ... ON CONFLICT DO UPDATE per UPSERT_BATCH_SIZE cells.
+    """
+    cells = list(get_cells({city_id: count for city_id, count in city_counts.items() if city_id is not None and count}).items())
+    if not cells:
+        return
+    table = connection.ops.quote_name(TripMapCell._meta.db_table)
+    zoom, x, y, trip_count, latitude_sum, longitude_sum = (
+        connection.ops.quote_name(TripMapCell._meta.get_field(name).column)
+        for name in ('zoom', 'x', 'y', 'trip_count', 'latitude_sum', 'longitude_sum')
+    )
+    with transaction.atomic():
+        locks.lock(locks.TRIP_MAP, shared=True)
+        with connection.cursor() as cursor:
+            for start in range(0, len(cells), UPSERT_BATCH_SIZE):
+                batch = cells[start:start + UPSERT_BATCH_SIZE]
+                cursor.execute(
+                    f'INSERT INTO {table} ({zoom}, {x}, {y}, {trip_count}, {latitude_sum}, {longitude_sum}) '
+                    f'VALUES {", ".join(["(%s, %s, %s, %s, %s, %s)"] * len(batch))} '
+                    f'ON CONFLICT ({zoom}, {x}, {y}) DO UPDATE SET '
+                    f'{trip_count} = {table}.{trip_count} + EXCLUDED.{trip_count}, '
+                    f'{latitude_sum} = {table}.{latitude_sum} + EXCLUDED.{latitude_sum}, '
+                    f'{longitude_sum} = {table}.{longitude_sum} + EXCLUDED.{longitude_sum}',
+                    [value for key, sums in batch for value in (*key, *sums)],
+                )
+
+
+def _count_by_city(trips):
+    return dict(
+        trips.filter(departure_at__gt=timezone.now())
+        .values('origin_city').annotate(count=Count('id')).order_by()
+        .values_list('origin_city', 'count')
+    )
+
+
+def add_trips_to_map(trips):
+    """
+    Adds the upcoming trips of the given queryset to the map, for bulk operations that bypass the model signals.
+    """
+    shift_map_cells(_count_by_city(trips))
+
+
+def remove_trips_from_map(trips):
+    """
+    Subtracts the upcoming trips of the given queryset from the map, for bulk operations that bypass the model signals.
+    """
+    shift_map_cells({city_id: -count for city_id, count in _count_by_city(trips).items()})
+
+
+def rebuild_trip_map():
+    """
+    Recomputes every cell from the upcoming trips, which also drops the trips that already departed.
+    """
+    with transaction.atomic():
+        locks.lock(locks.TRIP_MAP) # before counting, so the trips of the updates still running are not missed
+        cells = get_cells(_count_by_city(Trip.objects.all()))
+        TripMapCell.objects.all().delete()
+        TripMapCell.objects.bulk_create(
+            (TripMapCell(zoom=zoom, x=x, y=y, trip_count=count, latitude_sum=latitude_sum, longitude_sum=longitude_sum)
+             for (zoom, x, y), (count, latitude_sum, longitude_sum) in cells.items()),
+            batch_size=1000,
+        )
+    return len(cells)
+
+
+def schedule_rebuild(force=False):
+    """
+    Enqueues a rebuild of the map, unless one was enqueued less than TRIP_MAP_REBUILD_INTERVAL seconds ago.
+    """
+    from .tasks import refresh_trip_map
+
+    shared = caches['default']
+    interval = getattr(settings, 'TRIP_MAP_REBUILD_INTERVAL', 300)
+    if force:
+        shared.set('trip-map:rebuild', True, interval)
+    elif not shared.add('trip-map:rebuild', True, interval):
+        return
+    enqueue(refresh_trip_map)
+
+
+def update_trip_map(previous_city_id, city_id):
+    """
+    Moves a trip from the cells of previous_city_id to the cells of city_id, either of them None when the
+    trip was not or is no longer on the map.
+    """
+    if previous_city_id != city_id:
+        shift_map_cells({previous_city_id: -1, city_id: 1})
+
+
+def get_clusters(min_longitude, min_latitude, max_longitude, max_latitude, zoom):
+    """
+    Returns the clusters of the cells of zoom inside the bounding box, as dicts with the number of trips and the
+    centroid of their origin cities. A box with min_longitude > max_longitude crosses the antimeridian.
+    """
+    zoom = min(max(zoom, 0), get_max_zoom())
+    (min_x, max_x), (max_y, min_y) = (values.tolist() for values in cell_xy([min_latitude, max_latitude], [min_longitude, max_longitude], zoom))
+    cells = TripMapCell.objects.filter(zoom=zoom, y__range=(min_y, max_y), trip_count__gt=0)
+    if min_longitude <= max_longitude:
+        cells = cells.filter(x__range=(min_x, max_x))
+    else:
+        cells = cells.filter(Q(x__gte=min_x) | Q(x__lte=max_x))
+    rows = cells.values_list('trip_count', 'latitude_sum', 'longitude_sum')[:getattr(settings, 'TRIP_MAP_MAX_CLUSTERS', 2000)]
+    return [
+        {'latitude': round(latitude_sum / count, 6), 'longitude': round(longitude_sum / count, 6), 'count': count}
+        for count, latitude_sum, longitude_sum in rows
+    ]
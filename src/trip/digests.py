@@ -0,0 +1,128 @@
+"""
+Daily digest emails of the notifications of the users.
+
+The new trips on the routes a user subscribed to and the status changes of the join requests of a user are not
+mailed when they happen: they are stored as pending Notification rows and sent once a day by the send_digests
+command, in a single email per user with everything that happened since the previous digest.
+
+send_digests() walks the users with pending notifications in chunks of DIGEST_BATCH_SIZE. For each chunk it loads
+their notifications with one query, renders one message per user and sends them through a single mail connection,
+so a run opens one SMTP session per chunk instead of one per email. The messages are sent one at a time and the
+notifications of a user are marked as sent right after its message goes out: a message that fails is logged and
+stays pending for the next run, without holding back the other users. A single run should be active at a time.
+"""
+import logging
+from collections import defaultdict
+from itertools import groupby
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.template.loader import render_to_string
+from django.utils import timezone
+
+from .models import Notification, RouteSubscription
+
+logger = logging.getLogger(__name__)
+
+STATUS_LABELS = {'accepted': 'aceptada', 'rejected': 'rechazada', 'pending': 'pendiente'}
+
+
+def notify_route_subscribers(trips):
+    """
+    Creates a notification for every user subscribed to the route of each of the new trips, except its creator,
+    with one query for the subscriptions and one INSERT.
+    """
+    routes = defaultdict(list)
+    for trip in trips:
+        routes[(trip.origin_city_id, trip.destination_city_id)].append(trip)
+    if not routes:
+        return
+    subscriptions = RouteSubscription.objects.filter(
+        origin_city__in={origin for origin, _ in routes}, destination_city__in={destination for _, destination in routes},
+    ).values_list('user_id', 'origin_city_id', 'destination_city_id')
+    Notification.objects.bulk_create(
+        (Notification(user_id=user_id, kind='route_trip', trip=trip)
+         for user_id, origin_id, destination_id in subscriptions
+         for trip in routes.get((origin_id, destination_id), ()) if trip.creator_id != user_id),
+        batch_size=1000,
+    )
+
+
+def notify_join_request_statuses(requests):
+    """
+    Creates a notification for each (user id, trip id, status) of join requests whose status changed.
+    """
+    Notification.objects.bulk_create(
+        (Notification(user_id=user_id, kind='join_request', trip_id=trip_id, status=status) for user_id, trip_id, status in requests),
+        batch_size=1000,
+    )
+
+
+def build_digest(user, notifications):
+    """
+    Returns the digest email of the pending notifications of the user, or None when there is nothing left to tell:
+    the trips that were deleted or already departed are skipped, and a join request that changed several times is
+    only listed with its last status.
+    """
+    if not user.is_active or not user.email:
+        return None
+    now = timezone.now()
+    trips, requests = [], {}
+    for notification in notifications:
+        trip = notification.trip
+        if trip.deleted_at is not None or trip.departure_at <= now:
+            continue
+        if notification.kind == 'route_trip':
+            trips.append(trip)
+        else:
+            requests[trip.pk] = (trip, STATUS_LABELS.get(notification.status, notification.status))
+    if not trips and not requests:
+        return None
+    limit = getattr(settings, 'DIGEST_MAX_ITEMS', 20)
+    body = render_to_string('trip/digest.txt', {
+        'user': user,
+        'trips': trips[:limit],
+        'more_trips': max(len(trips) - limit, 0),
+        'requests': list(requests.values())[:limit],
+        'more_requests': max(len(requests) - limit, 0),
+    })
+    return EmailMessage('Tus novedades en Carpool', body, None, [user.email])
+
+
+def send_digests(batch_size=None):
+    """
+    Sends the digests of every user with pending notifications and returns the number of emails sent.
+    """
+    batch_size = batch_size or getattr(settings, 'DIGEST_BATCH_SIZE', 100)
+    pending = Notification.objects.filter(sent_at__isnull=True)
+    sent, last_user_id = 0, 0
+    while True:
+        user_ids = list(pending.filter(user_id__gt=last_user_id).order_by('user_id').values_list('user_id', flat=True).distinct()[:batch_size])
+        if not user_ids:
+            return sent
+        last_user_id = user_ids[-1]
+        notifications = (
+            pending.filter(user_id__in=user_ids)
+            .select_related('user', 'trip__origin_city', 'trip__destination_city')
+            .order_by('user_id', 'created_at', 'id')
+        )
+        messages, skipped_ids = [], []
+        for user, group in groupby(notifications, key=lambda notification: notification.user):
+            group = list(group)
+            message = build_digest(user, group)
+            if message is None:
+                skipped_ids.extend(notification.pk for notification in group) # nothing left to tell
+            else:
+                messages.append((user, message, [notification.pk for notification in group]))
+        Notification.objects.filter(pk__in=skipped_ids).update(sent_at=timezone.now())
+        if messages:
+            with get_connection() as connection:
+                for user, message, notification_ids in messages:
+                    try:
+                        delivered = connection.send_messages([message])
+                    except Exception:
+                        logger.exception('Could not send the digest of user %s', user.pk)
+                        connection.close() # the session may be broken, the next message opens a new one
+                        continue
+                    Notification.objects.filter(pk__in=notification_ids).update(sent_at=timezone.now())
+                    sent += delivered or 0
@@ -0,0 +1,120 @@
+"""
+Precomputed great-circle distances between cities.
+
+The distances are stored in the CityDistance table, once per unordered pair, so reading the distance of a
+route is a single indexed lookup instead of a computation per request. compute_distances() fills the table in
+batches: the coordinates are loaded once, and each batch of cities is compared to every city with a larger id
+with a single NumPy broadcast. A full rebuild and the updates of single cities hold the same lock, so they run one
+after the other and never delete each other's rows.
+"""
+import operator
+from functools import reduce
+
+import numpy as np
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+
+from . import locks
+from .geo import haversine_km
+from .models import City, CityDistance
+
+DEFAULT_BATCH_SIZE = 200
+
+
+def _max_km():
+    return getattr(settings, 'CITY_DISTANCE_MAX_KM', 2000)
+
+
+def _load_coordinates():
+    rows = np.array(City.objects.order_by('id').values_list('id', 'latitude', 'longitude'), dtype=np.float64).reshape(-1, 3)
+    return rows[:, 0].astype(np.int64), rows[:, 1], rows[:, 2]
+
+
+def _iter_pairs(ids, latitudes, longitudes, positions, batch_size, skip=None):
+    """
+    Yields (from_ids, to_ids, distances_m) arrays with the pairs between the cities at the given positions and
+    the cities with a larger id, plus the cities with a smaller id that are not in skip (those pairs are found
+    from the other city), closer than CITY_DISTANCE_MAX_KM. Pairs are oriented from the smaller to the larger id.
+    """
+    max_km = _max_km()
+    for start in range(0, len(positions), batch_size):
+        batch = positions[start:start + batch_size]
+        distances = haversine_km(latitudes[batch, None], longitudes[batch, None], latitudes[None, :], longitudes[None, :])
+        wanted = ids[None, :] > ids[batch, None]
+        if skip is not None:
+            wanted |= (ids[None, :] < ids[batch, None]) & ~skip[None, :]
+        rows, columns = np.nonzero(wanted & (distances <= max_km))
+        from_ids, to_ids = ids[batch][rows], ids[columns]
+        yield np.minimum(from_ids, to_ids), np.maximum(from_ids, to_ids), np.rint(distances[rows, columns] * 1000).astype(np.int64)
+
+
+def compute_distances(city_ids=None, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Computes and stores the distances of the given cities to every other city, replacing their previous rows.
+    Without city_ids the whole table is rebuilt. Returns the number of rows written.
+    """
+    written = 0
+    with transaction.atomic():
+        locks.lock(locks.CITY_DISTANCES)
+        ids, latitudes, longitudes = _load_coordinates() # after the lock, so a city moved meanwhile is not missed
+        if city_ids is None:
+            positions, skip = np.arange(len(ids)), None
+            CityDistance.objects.all().delete()
+        else:
+            skip = np.isin(ids, list(city_ids))
+            positions = np.flatnonzero(skip)
+            CityDistance.objects.filter(Q(from_city__in=city_ids) | Q(to_city__in=city_ids)).delete()
+        for from_ids, to_ids, distances in _iter_pairs(ids, latitudes, longitudes, positions, batch_size, skip):
+            CityDistance.objects.bulk_create(
+                (CityDistance(from_city_id=from_id, to_city_id=to_id, distance_m=distance) for from_id, to_id, distance in zip(from_ids.tolist(), to_ids.tolist(), distances.tolist())),
+                batch_size=5000,
+            )
+            written += len(from_ids)
+    return written
+
+
+def get_distances_km(pairs):
+    """
+    Returns a dict with the distance in kilometers of each (city_id, city_id) pair. The pairs missing from
+    the table (too far apart, or not computed yet) are computed on the fly.
+    """
+    keys = {tuple(sorted(pair)) for pair in pairs if pair[0] != pair[1]}
+    stored = {}
+    if keys:
+        condition = reduce(operator.or_, (Q(from_city_id=from_id, to_city_id=to_id) for from_id, to_id in keys))
+        stored = {(from_id, to_id): distance / 1000 for from_id, to_id, distance in CityDistance.objects.filter(condition).values_list('from_city_id', 'to_city_id', 'distance_m')}
+    missing = keys - stored.keys()
+    if missing:
+        cities = City.objects.in_bulk({city_id for pair in missing for city_id in pair})
+        for from_id, to_id in missing:
+            if from_id in cities and to_id in cities:
+                origin, destination = cities[from_id], cities[to_id]
+                stored[(from_id, to_id)] = float(haversine_km(origin.latitude, origin.longitude, destination.latitude, destination.longitude))
+    return {pair: stored.get(tuple(sorted(pair)), 0.0) for pair in pairs}
+
+
+def get_route_distance_km(trip):
+    """
+    Returns the great-circle length of the route of the trip, through its stops if it has any.
+    """
+    cities = list(trip.stops.order_by('order').values_list('city_id', flat=True)) or [trip.origin_city_id, trip.destination_city_id]
+    legs = list(zip(cities, cities[1:]))
+    distances = get_distances_km(legs)
+    return sum(distances[leg] for leg in legs)
+
+
+def suggest_seat_cost(trip):
+    """
+    Suggests the cost each occupant pays to share the trip: the road distance (the great-circle distance times
+    TRIP_ROAD_FACTOR) times TRIP_COST_PER_KM, split between the driver and the seats offered.
+    """
+    distance_km = get_route_distance_km(trip)
+    road_distance_km = distance_km * getattr(settings, 'TRIP_ROAD_FACTOR', 1.25)
+    total_cost = road_distance_km * getattr(settings, 'TRIP_COST_PER_KM', 100)
+    return {
+        'distance_km': round(distance_km, 1),
+        'road_distance_km': round(road_distance_km, 1),
+        'total_cost': round(total_cost, 2),
+        'cost_per_seat': round(total_cost / (trip.seats + 1), 2),
+    }
@@ -0,0 +1,23 @@
+import numpy as np
+
+EARTH_RADIUS_KM = 6371.0088
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    """
+    Great-circle distance in kilometers between two points or two arrays of points (in degrees).
+    Works element-wise on NumPy arrays and broadcasts like any NumPy operation.
+    """
+    lat1, lon1, lat2, lon2 = (np.radians(np.asarray(value, dtype=np.float64)) for value in (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+
+def bounding_box(latitude, longitude, radius_km):
+    """
+    Returns the (min_lat, max_lat, min_lon, max_lon) box that contains every point within radius_km of the
+    given point. Used to narrow candidates with indexed range filters before computing exact distances.
+    """
+    delta_lat = np.degrees(radius_km / EARTH_RADIUS_KM)
+    delta_lon = np.degrees(radius_km / (EARTH_RADIUS_KM * max(np.cos(np.radians(latitude)), 1e-6)))
+    return latitude - delta_lat, latitude + delta_lat, longitude - delta_lon, longitude + delta_lon
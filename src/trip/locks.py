@@ -0,0 +1,23 @@
+"""
+Locks that serialize the jobs rebuilding a precomputed table with the jobs updating part of it.
+
+The locks are PostgreSQL advisory locks held until the end of the current transaction, so they must be taken
+inside transaction.atomic(). The incremental updates that may run side by side take them shared, and the rebuilds
+exclusive. SQLite runs one write transaction at a time, so there is nothing to take there.
+"""
+from django.db import connection
+
+CITY_DISTANCES = 'trip.city_distances'
+TRIP_MAP = 'trip.trip_map'
+
+
+def lock(name, shared=False):
+    """
+    Waits for the advisory lock of the given name and holds it until the current transaction ends. Shared locks
+    only wait for the exclusive ones.
+    """
+    if connection.vendor != 'postgresql':
+        return
+    function = 'pg_advisory_xact_lock_shared' if shared else 'pg_advisory_xact_lock'
+    with connection.cursor() as cursor:
+        cursor.execute(f'SELECT {function}(hashtext(%s))', [name])
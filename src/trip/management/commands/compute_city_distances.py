@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from trip.distances import DEFAULT_BATCH_SIZE, compute_distances
+
+
+class Command(BaseCommand):
+    help = 'Computes the great-circle distances between cities in vectorized batches and stores them in the CityDistance table.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--city', type=int, action='append', help='Only recompute the distances of this city. Can be repeated.')
+        parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE, help='Number of cities compared to every other city at once.')
+
+    def handle(self, *args, **options):
+        written = compute_distances(options['city'], options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'{written} city distances stored'))
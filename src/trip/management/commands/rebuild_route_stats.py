@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from trip.clusters import rebuild_trip_map
+from trip.models import RouteDailyStat
+from trip.rollups import rebuild_route_stats, rebuild_pending_requests
+
+
+class Command(BaseCommand):
+    help = 'Recomputes the route popularity rollup table, the pending join request counters and the trip map cells from the source tables.'
+
+    def handle(self, *args, **options):
+        rebuild_route_stats()
+        rebuild_pending_requests()
+        cells = rebuild_trip_map()
+        self.stdout.write(self.style.SUCCESS(f'{RouteDailyStat.objects.count()} route stats and {cells} map cells rebuilt'))
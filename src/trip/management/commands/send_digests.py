@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from trip.digests import send_digests
+
+
+class Command(BaseCommand):
+    help = 'Sends the daily digest email of the pending notifications of every user. Meant to run once a day.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=None, help='Users per mail connection (default DIGEST_BATCH_SIZE).')
+
+    def handle(self, *args, **options):
+        sent = send_digests(options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'{sent} digests sent'))
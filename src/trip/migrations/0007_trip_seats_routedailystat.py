@@ -0,0 +1,47 @@
+# Generated by Django 5.1.3 on 2026-10-19 04:16
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count, Sum
+
+
+def backfill_route_stats(apps, schema_editor):
+    Trip = apps.get_model('trip', 'Trip')
+    RouteDailyStat = apps.get_model('trip', 'RouteDailyStat')
+    rows = (
+        Trip.objects.values('origin_city_id', 'destination_city_id', 'departure_date')
+        .annotate(trip_count=Count('id'), seat_count=Sum('seats'))
+        .order_by()
+    )
+    RouteDailyStat.objects.bulk_create((RouteDailyStat(**row) for row in rows.iterator()), batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('trip', '0006_tripjoinrequest'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='trip',
+            name='seats',
+            field=models.PositiveSmallIntegerField(default=4, verbose_name='Asientos'),
+        ),
+        migrations.CreateModel(
+            name='RouteDailyStat',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('departure_date', models.DateField(verbose_name='Fecha de salida')),
+                ('trip_count', models.IntegerField(default=0, verbose_name='Cantidad de viajes')),
+                ('seat_count', models.IntegerField(default=0, verbose_name='Cantidad de asientos')),
+                ('destination_city', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='trip.city', verbose_name='Ciudad de destino')),
+                ('origin_city', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='trip.city', verbose_name='Ciudad de origen')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['departure_date', 'origin_city', 'destination_city'], name='trip_routed_departu_7854f2_idx')],
+                'unique_together': {('origin_city', 'destination_city', 'departure_date')},
+            },
+        ),
+        migrations.RunPython(backfill_route_stats, migrations.RunPython.noop),
+    ]
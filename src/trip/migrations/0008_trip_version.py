@@ -0,0 +1,18 @@
+# Generated by Django 5.1.3 on 2026-10-19 04:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('trip', '0007_trip_seats_routedailystat'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='trip',
+            name='version',
+            field=models.PositiveBigIntegerField(default=1, editable=False, verbose_name='Versión'),
+        ),
+    ]
@@ -0,0 +1,50 @@
+# Generated by Django 5.1.3 on 2026-10-19 04:28
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def create_route_stops(apps, schema_editor):
+    Trip = apps.get_model('trip', 'Trip')
+    TripStop = apps.get_model('trip', 'TripStop')
+    stops = (
+        TripStop(trip_id=trip_id, city_id=city_id, order=order)
+        for trip_id, origin_city_id, destination_city_id in Trip.objects.values_list('id', 'origin_city_id', 'destination_city_id').iterator()
+        for order, city_id in enumerate((origin_city_id, destination_city_id))
+    )
+    TripStop.objects.bulk_create(stops, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('trip', '0009_city_trip_search_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='tripjoinrequest',
+            name='dropoff_city',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='+', to='trip.city', verbose_name='Ciudad de descenso'),
+        ),
+        migrations.AddField(
+            model_name='tripjoinrequest',
+            name='pickup_city',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='+', to='trip.city', verbose_name='Ciudad de ascenso'),
+        ),
+        migrations.CreateModel(
+            name='TripStop',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('order', models.PositiveSmallIntegerField(verbose_name='Orden')),
+                ('seats_taken', models.PositiveSmallIntegerField(default=0, verbose_name='Asientos ocupados')),
+                ('city', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='trip_stops', to='trip.city', verbose_name='Ciudad')),
+                ('trip', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='stops', to='trip.trip', verbose_name='Viaje')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['city', 'trip', 'order'], name='trip_tripst_city_id_03260d_idx')],
+                'unique_together': {('trip', 'order')},
+            },
+        ),
+        migrations.RunPython(create_route_stops, migrations.RunPython.noop),
+    ]
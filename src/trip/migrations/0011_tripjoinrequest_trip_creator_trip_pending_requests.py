@@ -0,0 +1,40 @@
+# Generated by Django 5.1.3 on 2026-10-19 09:12
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+
+def backfill_inbox(apps, schema_editor):
+    Trip = apps.get_model('trip', 'Trip')
+    TripJoinRequest = apps.get_model('trip', 'TripJoinRequest')
+    TripJoinRequest.objects.update(trip_creator_id=Subquery(Trip.objects.filter(pk=OuterRef('trip_id')).values('creator_id')[:1]))
+    pending = (
+        TripJoinRequest.objects.filter(trip=OuterRef('pk'), status='pending')
+        .order_by().values('trip').annotate(count=Count('id')).values('count')
+    )
+    Trip.objects.update(pending_requests=Coalesce(Subquery(pending), Value(0)))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('trip', '0010_tripstop_segments'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='trip',
+            name='pending_requests',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Solicitudes pendientes'),
+        ),
+        migrations.AddField(
+            model_name='tripjoinrequest',
+            name='trip_creator',
+            field=models.ForeignKey(editable=False, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL, verbose_name='Creador del viaje'),
+        ),
+        migrations.RunPython(backfill_inbox, migrations.RunPython.noop),
+    ]
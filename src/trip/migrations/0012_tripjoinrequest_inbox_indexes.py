@@ -0,0 +1,29 @@
+# Generated by Django 5.1.3 on 2026-10-19 09:12
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('trip', '0011_tripjoinrequest_trip_creator_trip_pending_requests'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='tripjoinrequest',
+            name='trip_creator',
+            field=models.ForeignKey(editable=False, on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL, verbose_name='Creador del viaje'),
+        ),
+        migrations.AddIndex(
+            model_name='tripjoinrequest',
+            index=models.Index(fields=['trip', 'status'], name='trip_tripjo_trip_id_6c2c84_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='tripjoinrequest',
+            index=models.Index(fields=['trip_creator', 'status'], name='trip_tripjo_trip_cr_68bd52_idx'),
+        ),
+    ]
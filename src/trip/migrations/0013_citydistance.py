@@ -0,0 +1,26 @@
+# Generated by Django 5.1.3 on 2026-10-19 04:41
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('trip', '0012_tripjoinrequest_inbox_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CityDistance',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('distance_m', models.PositiveIntegerField(verbose_name='Distancia (m)')),
+                ('from_city', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='trip.city', verbose_name='Ciudad desde')),
+                ('to_city', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='trip.city', verbose_name='Ciudad hasta')),
+            ],
+            options={
+                'unique_together': {('from_city', 'to_city')},
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.3 on 2026-10-19 04:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('trip', '0013_citydistance'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='trip',
+            name='deleted_at',
+            field=models.DateTimeField(blank=True, editable=False, null=True, verbose_name='Fecha de baja'),
+        ),
+    ]
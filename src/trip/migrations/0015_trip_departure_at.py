@@ -0,0 +1,41 @@
+# Generated by Django 5.1.3 on 2026-10-19 05:07
+
+from datetime import datetime
+
+from django.conf import settings
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def backfill_departure_at(apps, schema_editor):
+    Trip = apps.get_model('trip', 'Trip')
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute(
+            f'UPDATE {schema_editor.quote_name(Trip._meta.db_table)} SET departure_at = (departure_date + departure_time) AT TIME ZONE %s',
+            [settings.TIME_ZONE],
+        )
+        return
+    batch = []
+    for trip in Trip.objects.only('departure_date', 'departure_time').iterator(chunk_size=2000):
+        trip.departure_at = timezone.make_aware(datetime.combine(trip.departure_date, trip.departure_time))
+        batch.append(trip)
+        if len(batch) == 2000:
+            Trip.objects.bulk_update(batch, ['departure_at'])
+            batch = []
+    Trip.objects.bulk_update(batch, ['departure_at'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('trip', '0014_trip_deleted_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='trip',
+            name='departure_at',
+            field=models.DateTimeField(editable=False, null=True, verbose_name='Salida'),
+        ),
+        migrations.RunPython(backfill_departure_at, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 5.1.3 on 2026-10-19 05:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('trip', '0015_trip_departure_at'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='trip',
+            name='departure_at',
+            field=models.DateTimeField(editable=False, verbose_name='Salida'),
+        ),
+        migrations.RemoveIndex(
+            model_name='trip',
+            name='trip_trip_departu_139d85_idx',
+        ),
+        migrations.AddIndex(
+            model_name='trip',
+            index=models.Index(fields=['departure_at'], name='trip_trip_departu_8b30c7_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='trip',
+            index=models.Index(fields=['origin_city', 'destination_city', 'departure_at'], name='trip_trip_origin__f1ebbb_idx'),
+        ),
+    ]
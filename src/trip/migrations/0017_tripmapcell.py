@@ -0,0 +1,28 @@
+# Generated by Django 5.1.3 on 2026-10-19 05:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('trip', '0016_trip_departure_at_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TripMapCell',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('zoom', models.PositiveSmallIntegerField(verbose_name='Zoom')),
+                ('x', models.IntegerField(verbose_name='Columna')),
+                ('y', models.IntegerField(verbose_name='Fila')),
+                ('trip_count', models.IntegerField(default=0, verbose_name='Cantidad de viajes')),
+                ('latitude_sum', models.FloatField(default=0, verbose_name='Suma de latitudes')),
+                ('longitude_sum', models.FloatField(default=0, verbose_name='Suma de longitudes')),
+            ],
+            options={
+                'unique_together': {('zoom', 'x', 'y')},
+            },
+        ),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 5.1.3 on 2026-10-19 05:19
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('trip', '0017_tripmapcell'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Notification',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('route_trip', 'Nuevo viaje en una ruta suscripta'), ('join_request', 'Cambio de estado de una solicitud')], max_length=20, verbose_name='Tipo')),
+                ('status', models.CharField(blank=True, max_length=10, verbose_name='Estado')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Fecha de creación')),
+                ('sent_at', models.DateTimeField(blank=True, null=True, verbose_name='Fecha de envío')),
+                ('trip', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='trip.trip', verbose_name='Viaje')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='notifications', to=settings.AUTH_USER_MODEL, verbose_name='Usuario')),
+            ],
+            options={
+                'indexes': [models.Index(condition=models.Q(('sent_at__isnull', True)), fields=['user', 'created_at'], name='trip_notification_pending_idx')],
+            },
+        ),
+        migrations.CreateModel(
+            name='RouteSubscription',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Fecha de creación')),
+                ('destination_city', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='trip.city', verbose_name='Ciudad de destino')),
+                ('origin_city', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='trip.city', verbose_name='Ciudad de origen')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='route_subscriptions', to=settings.AUTH_USER_MODEL, verbose_name='Usuario')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['origin_city', 'destination_city'], name='trip_routes_origin__4c9d33_idx')],
+                'unique_together': {('user', 'origin_city', 'destination_city')},
+            },
+        ),
+    ]
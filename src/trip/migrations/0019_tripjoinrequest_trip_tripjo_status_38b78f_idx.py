@@ -0,0 +1,19 @@
+# Generated by Django 5.1.3 on 2026-10-19 06:37
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('trip', '0018_routesubscription_notification'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='tripjoinrequest',
+            index=models.Index(fields=['status', 'id'], name='trip_tripjo_status_38b78f_idx'),
+        ),
+    ]
@@ -1,4 +1,7 @@
+from datetime import datetime
+
 from django.db import models
+from django.utils import timezone
 
 from authentication.models import CustomUser
 
@@ -49,6 +52,11 @@ class City(models.Model):
     
     def __str__(self):
         return f"{self.name}, {self.state}"
+    
+    class Meta:
+        indexes = [
+            models.Index(fields=['latitude', 'longitude']),
+        ]
 
 
 class Vehicle(models.Model):
@@ -76,6 +84,11 @@ class Vehicle(models.Model):
         return f'{self.brand} {self.model} {self.license_plate}'
 
 
+class TripManager(models.Manager):
+    def get_queryset(self):
+        return super().get_queryset().filter(deleted_at__isnull=True)
+
+
 class Trip(models.Model):
     """
     Trip model representing a trip in the system.
@@ -85,32 +98,90 @@ class Trip(models.Model):
         - destination_city (ForeignKey): The destination city of the trip.
         - departure_date (DateField): The departure date of the trip.
         - departure_time (TimeField): The departure time of the trip.
+        - departure_at (DateTimeField): The departure date and time of the trip as a single timezone-aware
+          timestamp, kept in sync by save() so range queries and ordering on the departure use one index.
         - pet_allowed (BooleanField): Indicates if pets are allowed in the trip.
         - smoking_allowed (BooleanField): Indicates if smoking is allowed in the trip.
         - kids_allowed (BooleanField): Indicates if kids are allowed in the trip.
+        - seats (PositiveSmallIntegerField): The number of seats offered in the trip.
         - vehicle (ForeignKey): The vehicle of the trip.
         - participants (ManyToManyField): The participants of the trip.
         - creator (ForeignKey): The creator of the trip.
+        - version (PositiveBigIntegerField): Monotonically increasing version of the trip, bumped when the trip,
+          its participants, its join requests or the user, vehicle, city and state names it embeds change. Used to build the ETags of the trip endpoints.
+        - pending_requests (PositiveIntegerField): The number of pending join requests of the trip, maintained
+          by the join request signals.
+        - deleted_at (DateTimeField): When the trip was deleted. Deleted trips are hidden by the default manager
+          and purged in the background (see api/purge.py).
+    
+    Managers:
+        - objects (TripManager): Excludes the deleted trips.
+        - all_objects (Manager): Includes the deleted trips.
     
     Attributes inherits from Model:
         - id (AutoField): The primary key for the trip.
         
     Methods:
         - __str__: Returns a string representation of the trip.
+        - combine_departure: Returns the timezone-aware departure of a date and time in the current time zone.
+        - save: Overrides the save method to increment the version of an existing trip in the database and to
+          update departure_at. The pending_requests counter is only written on creation, so saving a stale
+          instance can't overwrite it.
+
+    Meta:
+        - indexes: departure_at for the upcoming trips, and (origin city, destination city, departure_at)
+          for the trips of a route in a time range.
     """
     origin_city = models.ForeignKey(City, related_name='trips_from', on_delete=models.CASCADE, verbose_name='Ciudad de origen') 
     destination_city = models.ForeignKey(City, related_name='trips_to', on_delete=models.CASCADE, verbose_name='Ciudad de destino') 
     departure_date = models.DateField(verbose_name='Fecha de salida')
     departure_time = models.TimeField(verbose_name='Hora de salida')
+    departure_at = models.DateTimeField(editable=False, verbose_name='Salida')
     pet_allowed = models.BooleanField(default=False, verbose_name='Se permiten mascotas')
     smoking_allowed = models.BooleanField(default=False, verbose_name='Se permite fumar')
     kids_allowed = models.BooleanField(default=False, verbose_name='Se permiten niños')
+    seats = models.PositiveSmallIntegerField(default=4, verbose_name='Asientos')
     vehicle = models.ForeignKey(Vehicle, on_delete=models.SET_NULL, null=True, verbose_name='Vehículo')
     participants = models.ManyToManyField(CustomUser, related_name='trips', through='TripParticipant', verbose_name='Participantes')
     creator = models.ForeignKey(CustomUser, related_name='created_trips', on_delete=models.CASCADE, verbose_name='Creador')
+    version = models.PositiveBigIntegerField(default=1, editable=False, verbose_name='Versión')
+    pending_requests = models.PositiveIntegerField(default=0, editable=False, verbose_name='Solicitudes pendientes')
+    deleted_at = models.DateTimeField(null=True, blank=True, editable=False, verbose_name='Fecha de baja')
+
+    objects = TripManager()
+    all_objects = models.Manager()
 
     def __str__(self):
         return f'from {self.origin_city} to {self.destination_city} on {self.departure_date}'
+
+    @staticmethod
+    def combine_departure(departure_date, departure_time):
+        return timezone.make_aware(datetime.combine(departure_date, departure_time))
+
+    def save(self, *args, **kwargs):
+        self.departure_at = self.combine_departure(self.departure_date, self.departure_time)
+        bump = not self._state.adding
+        if bump:
+            self.version = models.F('version') + 1 # incremented in the database so concurrent saves get distinct versions
+            update_fields = kwargs.get('update_fields')
+            if update_fields is None:
+                update_fields = [field.name for field in self._meta.concrete_fields if not field.primary_key and field.name != 'pending_requests']
+            kwargs['update_fields'] = {*update_fields, 'version'}
+            if {'departure_date', 'departure_time'} & kwargs['update_fields']:
+                kwargs['update_fields'].add('departure_at')
+        super().save(*args, **kwargs)
+
+    def _save_table(self, *args, **kwargs):
+        updated = super()._save_table(*args, **kwargs)
+        if isinstance(self.version, models.expressions.Combinable):
+            self.refresh_from_db(fields=['version']) # before post_save, so its receivers see the new version
+        return updated
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['departure_at']),
+            models.Index(fields=['origin_city', 'destination_city', 'departure_at']),
+        ]
     
 
 class TripParticipant(models.Model):
@@ -152,6 +223,10 @@ class TripJoinRequest(models.Model):
         - created_at (DateTimeField): The creation date of the request.
         - updated_at (DateTimeField): The update date of the request.
         - status (CharField): The status of the request.
+        - pickup_city (ForeignKey): The city where the user boards, the origin of the trip if empty.
+        - dropoff_city (ForeignKey): The city where the user gets off, the destination of the trip if empty.
+        - trip_creator (ForeignKey): Copy of the creator of the trip, kept in sync by the trip signals,
+          so the inbox of a driver doesn't need a join through Trip. Empty once the trip is deleted.
     
     Attributes inherits from Model:
         - id (AutoField): The primary key for the request.
@@ -161,15 +236,245 @@ class TripJoinRequest(models.Model):
     
     Meta:
         - unique_together: The user and trip of the request must be unique together.
+        - indexes: (trip, status) for the requests of a trip, (trip_creator, status) for the inbox of a driver and
+          (status, id) for the status filter of the admin.
     """
     user = models.ForeignKey(CustomUser, related_name='join_requests', on_delete=models.CASCADE, verbose_name='Usuario')
     trip = models.ForeignKey(Trip, related_name='join_requests', on_delete=models.CASCADE, verbose_name='Viaje')
     created_at = models.DateTimeField(auto_now_add=True, verbose_name='Fecha de creación')
     updated_at = models.DateTimeField(auto_now=True, verbose_name='Fecha de actualización')
     status = models.CharField(max_length=10, choices=[('pending', 'Pending'),('accepted', 'Accepted'),('rejected', 'Rejected')], verbose_name='Estado', default='pending')
+    pickup_city = models.ForeignKey(City, related_name='+', on_delete=models.PROTECT, null=True, blank=True, verbose_name='Ciudad de ascenso')
+    dropoff_city = models.ForeignKey(City, related_name='+', on_delete=models.PROTECT, null=True, blank=True, verbose_name='Ciudad de descenso')
+    trip_creator = models.ForeignKey(CustomUser, related_name='+', on_delete=models.CASCADE, null=True, editable=False, verbose_name='Creador del viaje')
     
     def __str__(self):
         return f"{self.user.email} request to join trip {self.trip}"
     
     class Meta:
-        unique_together = ('user', 'trip')
\ No newline at end of file
+        unique_together = ('user', 'trip')
+        indexes = [
+            models.Index(fields=['trip', 'status']),
+            models.Index(fields=['trip_creator', 'status']),
+            models.Index(fields=['status', 'id']),
+        ]
+
+
+class TripStop(models.Model):
+    """
+    TripStop model representing a city where a trip stops, including its origin and destination.
+    
+    The stops of a trip are numbered from 0 (the origin city) to the last one (the destination city).
+    The leg of a stop is the part of the trip between the stop and the next one.
+    
+    Attributes:
+        - trip (ForeignKey): The trip of the stop.
+        - city (ForeignKey): The city of the stop.
+        - order (PositiveSmallIntegerField): The position of the stop in the trip.
+        - seats_taken (PositiveSmallIntegerField): The number of seats taken on the leg that starts at this stop.
+    
+    Attributes inherits from Model:
+        - id (AutoField): The primary key for the stop.
+    
+    Methods:
+        - __str__: Returns a string representation of the stop.
+    
+    Meta:
+        - unique_together: The trip and order of the stop must be unique together.
+        - indexes: (city, trip, order) so the segment search is an indexed self join.
+    """
+    trip = models.ForeignKey(Trip, related_name='stops', on_delete=models.CASCADE, verbose_name='Viaje')
+    city = models.ForeignKey(City, related_name='trip_stops', on_delete=models.CASCADE, verbose_name='Ciudad')
+    order = models.PositiveSmallIntegerField(verbose_name='Orden')
+    seats_taken = models.PositiveSmallIntegerField(default=0, verbose_name='Asientos ocupados')
+    
+    def __str__(self):
+        return f"stop {self.order} of trip {self.trip_id} in city {self.city_id}"
+    
+    class Meta:
+        unique_together = ('trip', 'order')
+        indexes = [
+            models.Index(fields=['city', 'trip', 'order']),
+        ]
+
+
+class RouteDailyStat(models.Model):
+    """
+    RouteDailyStat model representing the number of trips and seats offered on a route for a given day.
+    
+    The rows are maintained incrementally by the Trip signals (see trip/signals.py), so the popular routes
+    and the calendar of a route can be read without aggregating the Trip table.
+    
+    Attributes:
+        - origin_city (ForeignKey): The origin city of the route.
+        - destination_city (ForeignKey): The destination city of the route.
+        - departure_date (DateField): The departure date of the trips.
+        - trip_count (IntegerField): The number of trips on the route for the day.
+        - seat_count (IntegerField): The number of seats offered on the route for the day.
+    
+    Attributes inherits from Model:
+        - id (AutoField): The primary key for the stat.
+    
+    Meta:
+        - unique_together: The origin city, destination city and departure date must be unique together.
+    """
+    origin_city = models.ForeignKey(City, related_name='+', on_delete=models.CASCADE, verbose_name='Ciudad de origen')
+    destination_city = models.ForeignKey(City, related_name='+', on_delete=models.CASCADE, verbose_name='Ciudad de destino')
+    departure_date = models.DateField(verbose_name='Fecha de salida')
+    trip_count = models.IntegerField(default=0, verbose_name='Cantidad de viajes')
+    seat_count = models.IntegerField(default=0, verbose_name='Cantidad de asientos')
+    
+    def __str__(self):
+        return f"{self.trip_count} trips from {self.origin_city_id} to {self.destination_city_id} on {self.departure_date}"
+    
+    class Meta:
+        unique_together = ('origin_city', 'destination_city', 'departure_date')
+        indexes = [
+            models.Index(fields=['departure_date', 'origin_city', 'destination_city']),
+        ]
+
+
+class CityDistance(models.Model):
+    """
+    CityDistance model representing the great-circle distance between two cities.
+    
+    The rows are computed in vectorized batches by the compute_city_distances command and kept up to date
+    by a job enqueued when a city is added or moved (see trip/distances.py). Each pair is stored once, with
+    the smaller city id first, and only when the cities are less than CITY_DISTANCE_MAX_KM apart.
+    
+    Attributes:
+        - from_city (ForeignKey): The city with the smaller id of the pair.
+        - to_city (ForeignKey): The city with the larger id of the pair.
+        - distance_m (PositiveIntegerField): The great-circle distance in meters.
+    
+    Attributes inherits from Model:
+        - id (AutoField): The primary key for the distance.
+    
+    Meta:
+        - unique_together: The from city and to city must be unique together.
+    """
+    from_city = models.ForeignKey(City, related_name='+', on_delete=models.CASCADE, verbose_name='Ciudad desde')
+    to_city = models.ForeignKey(City, related_name='+', on_delete=models.CASCADE, verbose_name='Ciudad hasta')
+    distance_m = models.PositiveIntegerField(verbose_name='Distancia (m)')
+    
+    def __str__(self):
+        return f"{self.distance_m / 1000:.1f} km from {self.from_city_id} to {self.to_city_id}"
+    
+    class Meta:
+        unique_together = ('from_city', 'to_city')
+
+
+class TripMapCell(models.Model):
+    """
+    TripMapCell model representing the upcoming trips leaving from the cities of a cell of the map grid
+    at a zoom level.
+    
+    The cells of zoom z are the Web Mercator tiles of zoom z + TRIP_MAP_CELL_ZOOM_OFFSET, so a map tile shows a
+    fixed number of clusters at every zoom. The rows are updated incrementally by the Trip signals and rebuilt
+    from the Trip table by a job, which also drops the trips that already left (see trip/clusters.py).
+    
+    Attributes:
+        - zoom (PositiveSmallIntegerField): The zoom level of the map.
+        - x (IntegerField): The column of the cell.
+        - y (IntegerField): The row of the cell.
+        - trip_count (IntegerField): The number of upcoming trips leaving from the cell.
+        - latitude_sum (FloatField): The sum of the latitudes of the origin cities of the trips.
+        - longitude_sum (FloatField): The sum of the longitudes of the origin cities of the trips.
+    
+    Attributes inherits from Model:
+        - id (AutoField): The primary key for the cell.
+    
+    Methods:
+        - __str__: Returns a string representation of the cell.
+    
+    Meta:
+        - unique_together: The zoom, column and row must be unique together, which also indexes the
+          bounding box queries of a zoom level.
+    """
+    zoom = models.PositiveSmallIntegerField(verbose_name='Zoom')
+    x = models.IntegerField(verbose_name='Columna')
+    y = models.IntegerField(verbose_name='Fila')
+    trip_count = models.IntegerField(default=0, verbose_name='Cantidad de viajes')
+    latitude_sum = models.FloatField(default=0, verbose_name='Suma de latitudes')
+    longitude_sum = models.FloatField(default=0, verbose_name='Suma de longitudes')
+    
+    def __str__(self):
+        return f"{self.trip_count} trips in cell {self.zoom}/{self.x}/{self.y}"
+    
+    class Meta:
+        unique_together = ('zoom', 'x', 'y')
+
+
+class RouteSubscription(models.Model):
+    """
+    RouteSubscription model representing a user who wants to hear about the new trips on a route.
+    
+    Attributes:
+        - user (ForeignKey): The subscribed user.
+        - origin_city (ForeignKey): The origin city of the route.
+        - destination_city (ForeignKey): The destination city of the route.
+        - created_at (DateTimeField): The creation date of the subscription.
+    
+    Attributes inherits from Model:
+        - id (AutoField): The primary key for the subscription.
+    
+    Methods:
+        - __str__: Returns a string representation of the subscription.
+    
+    Meta:
+        - unique_together: The user, origin city and destination city must be unique together.
+        - indexes: (origin_city, destination_city) for the subscribers of the route of a new trip.
+    """
+    user = models.ForeignKey(CustomUser, related_name='route_subscriptions', on_delete=models.CASCADE, verbose_name='Usuario')
+    origin_city = models.ForeignKey(City, related_name='+', on_delete=models.CASCADE, verbose_name='Ciudad de origen')
+    destination_city = models.ForeignKey(City, related_name='+', on_delete=models.CASCADE, verbose_name='Ciudad de destino')
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name='Fecha de creación')
+    
+    def __str__(self):
+        return f"{self.user_id} subscribed from {self.origin_city_id} to {self.destination_city_id}"
+    
+    class Meta:
+        unique_together = ('user', 'origin_city', 'destination_city')
+        indexes = [
+            models.Index(fields=['origin_city', 'destination_city']),
+        ]
+
+
+class Notification(models.Model):
+    """
+    Notification model representing an event a user has to hear about, sent grouped with the other pending
+    notifications of the user in a daily digest email (see trip/digests.py).
+    
+    Attributes:
+        - user (ForeignKey): The notified user.
+        - kind (CharField): A new trip on a subscribed route or a status change of a join request of the user.
+        - trip (ForeignKey): The trip of the event.
+        - status (CharField): The new status of the join request, empty for the other kinds.
+        - created_at (DateTimeField): The creation date of the notification.
+        - sent_at (DateTimeField): When the notification was sent in a digest, empty while pending.
+    
+    Attributes inherits from Model:
+        - id (AutoField): The primary key for the notification.
+    
+    Methods:
+        - __str__: Returns a string representation of the notification.
+    
+    Meta:
+        - indexes: The pending notifications by user, which is what the digest reads.
+    """
+    KIND_CHOICES = [('route_trip', 'Nuevo viaje en una ruta suscripta'), ('join_request', 'Cambio de estado de una solicitud')]
+    
+    user = models.ForeignKey(CustomUser, related_name='notifications', on_delete=models.CASCADE, verbose_name='Usuario')
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES, verbose_name='Tipo')
+    trip = models.ForeignKey(Trip, related_name='+', on_delete=models.CASCADE, verbose_name='Viaje')
+    status = models.CharField(max_length=10, blank=True, verbose_name='Estado')
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name='Fecha de creación')
+    sent_at = models.DateTimeField(null=True, blank=True, verbose_name='Fecha de envío')
+    
+    def __str__(self):
+        return f"{self.kind} notification of trip {self.trip_id} for {self.user_id}"
+    
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'created_at'], condition=models.Q(sent_at__isnull=True), name='trip_notification_pending_idx'),
+        ]
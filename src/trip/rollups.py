@@ -0,0 +1,87 @@
+from django.db import transaction
+from django.db.models import Count, Exists, F, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+from .models import Trip, TripJoinRequest, RouteDailyStat
+
+
+def apply_route_delta(origin_city_id, destination_city_id, departure_date, trips, seats):
+    """
+    Adds the given trip and seat deltas to the rollup row of the route and day, creating it if needed.
+    The counters are incremented with F() expressions so concurrent updates are not lost.
+    """
+    stat, created = RouteDailyStat.objects.get_or_create(
+        origin_city_id=origin_city_id,
+        destination_city_id=destination_city_id,
+        departure_date=departure_date,
+        defaults={'trip_count': trips, 'seat_count': seats},
+    )
+    if not created:
+        RouteDailyStat.objects.filter(pk=stat.pk).update(
+            trip_count=F('trip_count') + trips,
+            seat_count=F('seat_count') + seats,
+        )
+
+
+def _shift_route_stats(trips, sign):
+    matching = (
+        trips.filter(origin_city=OuterRef('origin_city'), destination_city=OuterRef('destination_city'), departure_date=OuterRef('departure_date'))
+        .order_by().values('origin_city')
+    )
+    RouteDailyStat.objects.filter(Exists(matching)).update(
+        trip_count=F('trip_count') + sign * Subquery(matching.annotate(count=Count('id')).values('count')),
+        seat_count=F('seat_count') + sign * Subquery(matching.annotate(seats=Sum('seats')).values('seats')),
+    )
+
+
+def add_trips_to_route_stats(trips):
+    """
+    Adds the trips of the given queryset to their rollup rows with a single UPDATE, and creates the missing rows
+    with a single INSERT, for bulk operations that bypass the model signals.
+    """
+    existing = RouteDailyStat.objects.filter(
+        origin_city=OuterRef('origin_city'), destination_city=OuterRef('destination_city'), departure_date=OuterRef('departure_date'),
+    )
+    missing = list(
+        trips.exclude(Exists(existing))
+        .values('origin_city_id', 'destination_city_id', 'departure_date')
+        .annotate(trip_count=Count('id'), seat_count=Sum('seats'))
+        .order_by()
+    )
+    _shift_route_stats(trips, 1)
+    RouteDailyStat.objects.bulk_create(RouteDailyStat(**row) for row in missing)
+
+
+def remove_trips_from_route_stats(trips):
+    """
+    Subtracts the trips of the given queryset from their rollup rows with a single UPDATE, for bulk operations
+    that bypass the model signals.
+    """
+    _shift_route_stats(trips, -1)
+
+
+def rebuild_route_stats():
+    """
+    Recomputes every rollup row from the Trip table. Used to backfill the table and to repair it
+    after bulk operations that bypass the model signals.
+    """
+    rows = (
+        Trip.objects.values('origin_city_id', 'destination_city_id', 'departure_date')
+        .annotate(trip_count=Count('id'), seat_count=Sum('seats'))
+        .order_by()
+    )
+    with transaction.atomic():
+        RouteDailyStat.objects.all().delete()
+        RouteDailyStat.objects.bulk_create((RouteDailyStat(**row) for row in rows.iterator()), batch_size=1000)
+
+
+def rebuild_pending_requests(trip_ids=None):
+    """
+    Recomputes the pending join request counter of the given trips (every trip by default) with a single UPDATE.
+    """
+    pending = (
+        TripJoinRequest.objects.filter(trip=OuterRef('pk'), status='pending')
+        .order_by().values('trip').annotate(count=Count('id')).values('count')
+    )
+    trips = Trip.objects.all() if trip_ids is None else Trip.objects.filter(pk__in=trip_ids)
+    trips.update(pending_requests=Coalesce(Subquery(pending), Value(0)))
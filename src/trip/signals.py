@@ -0,0 +1,226 @@
+from django.db.models import F, Q
+from django.db.models.signals import pre_save, post_save, post_delete
+from django.dispatch import receiver
+from django.utils import timezone
+
+from jobs.queue import enqueue
+from authentication.models import CustomUser
+from .models import State, City, Vehicle, Trip, TripParticipant, TripJoinRequest
+from .clusters import schedule_rebuild, update_trip_map
+from .digests import notify_join_request_statuses, notify_route_subscribers
+from .rollups import apply_route_delta
+from .stops import sync_route_stops
+
+
+def _route_key(trip):
+    return (trip.origin_city_id, trip.destination_city_id, trip.departure_date)
+
+
+def _map_city(origin_city_id, departure_at, deleted_at):
+    # only the upcoming trips that were not deleted are on the map
+    return origin_city_id if deleted_at is None and departure_at is not None and departure_at > timezone.now() else None
+
+
+@receiver(pre_save, sender=Trip)
+def remember_trip_route(sender, instance, **kwargs):
+    """
+    Stores the route, seats, creator, deletion and map cell of the trip before the update, so post_save can move its counts.
+    """
+    instance._previous_route = None
+    instance._previous_creator_id = None
+    instance._was_deleted = False
+    instance._previous_map_city_id = None
+    if instance.pk:
+        previous = Trip.all_objects.filter(pk=instance.pk).values_list('origin_city_id', 'destination_city_id', 'departure_date', 'seats', 'creator_id', 'deleted_at', 'departure_at').first()
+        if previous:
+            instance._previous_route = (previous[:3], previous[3])
+            instance._previous_creator_id = previous[4]
+            instance._was_deleted = previous[5] is not None
+            instance._previous_map_city_id = _map_city(previous[0], previous[6], previous[5])
+
+
+@receiver(post_save, sender=Trip)
+def update_route_stats_on_save(sender, instance, created, raw=False, **kwargs):
+    if raw or getattr(instance, '_was_deleted', False):
+        return
+    previous = getattr(instance, '_previous_route', None)
+    if instance.deleted_at is not None: # soft-deleted, see api/purge.py
+        if previous is not None:
+            apply_route_delta(*previous[0], -1, -previous[1])
+        return
+    if previous is None:
+        apply_route_delta(*_route_key(instance), 1, instance.seats)
+        return
+    previous_key, previous_seats = previous
+    if previous_key != _route_key(instance):
+        apply_route_delta(*previous_key, -1, -previous_seats)
+        apply_route_delta(*_route_key(instance), 1, instance.seats)
+    elif previous_seats != instance.seats:
+        apply_route_delta(*_route_key(instance), 0, instance.seats - previous_seats)
+
+
+@receiver(post_save, sender=Trip)
+def update_route_stops_on_save(sender, instance, raw=False, **kwargs):
+    if raw or instance.deleted_at is not None:
+        return
+    previous = getattr(instance, '_previous_route', None)
+    if previous is None or previous[0][:2] != (instance.origin_city_id, instance.destination_city_id):
+        sync_route_stops(instance)
+
+
+@receiver(post_save, sender=Trip)
+def update_trip_map_on_save(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    update_trip_map(getattr(instance, '_previous_map_city_id', None), _map_city(instance.origin_city_id, instance.departure_at, instance.deleted_at))
+
+
+@receiver(post_save, sender=Trip)
+def notify_route_subscribers_on_create(sender, instance, created, raw=False, **kwargs):
+    if created and not raw and instance.deleted_at is None:
+        notify_route_subscribers([instance])
+
+
+@receiver(post_save, sender=Trip)
+def update_join_request_creator(sender, instance, raw=False, **kwargs):
+    previous = getattr(instance, '_previous_creator_id', None)
+    if raw or previous is None or previous == instance.creator_id or instance.deleted_at is not None:
+        return
+    TripJoinRequest.objects.filter(trip=instance).update(trip_creator_id=instance.creator_id)
+
+
+@receiver(post_delete, sender=Trip)
+def update_route_stats_on_delete(sender, instance, **kwargs):
+    if instance.deleted_at is None: # soft-deleted trips were already subtracted
+        apply_route_delta(*_route_key(instance), -1, -instance.seats)
+
+
+@receiver(post_delete, sender=Trip)
+def update_trip_map_on_delete(sender, instance, **kwargs):
+    update_trip_map(_map_city(instance.origin_city_id, instance.departure_at, instance.deleted_at), None)
+
+
+@receiver(post_save, sender=TripParticipant)
+@receiver(post_delete, sender=TripParticipant)
+def bump_trip_version(sender, instance, raw=False, **kwargs):
+    """
+    Increments the version of the trip when one of its participants changes.
+    """
+    if raw:
+        return
+    Trip.objects.filter(pk=instance.trip_id).update(version=F('version') + 1)
+
+
+# fields of related rows embedded in the serialized trips (the cities by their names), and the trips that embed each row
+TRIP_EMBEDDED_FIELDS = {
+    CustomUser: (('first_name',), lambda pk: Q(trip_participants__user=pk)),
+    Vehicle: (('brand', 'model'), lambda pk: Q(vehicle=pk)),
+    City: (('name', 'state_id'), lambda pk: Q(origin_city=pk) | Q(destination_city=pk)),
+    State: (('name', 'country'), lambda pk: Q(origin_city__state=pk) | Q(destination_city__state=pk)),
+}
+
+
+@receiver(pre_save, sender=CustomUser)
+@receiver(pre_save, sender=Vehicle)
+@receiver(pre_save, sender=City)
+@receiver(pre_save, sender=State)
+def remember_trip_embedded_fields(sender, instance, update_fields=None, **kwargs):
+    """
+    Stores the fields of the row that are embedded in the serialized trips, unless the save can't change them.
+    """
+    fields, _ = TRIP_EMBEDDED_FIELDS[sender]
+    instance._previous_trip_fields = None
+    if instance.pk and (update_fields is None or not set(fields).isdisjoint(update_fields)):
+        instance._previous_trip_fields = sender._default_manager.filter(pk=instance.pk).values_list(*fields).first()
+
+
+@receiver(post_save, sender=CustomUser)
+@receiver(post_save, sender=Vehicle)
+@receiver(post_save, sender=City)
+@receiver(post_save, sender=State)
+def bump_embedding_trip_versions(sender, instance, raw=False, **kwargs):
+    """
+    Increments the version of the trips that embed the row when one of its embedded fields changes,
+    so their ETags and cached representations are not served stale.
+    """
+    previous = getattr(instance, '_previous_trip_fields', None)
+    fields, trips = TRIP_EMBEDDED_FIELDS[sender]
+    if raw or previous is None or previous == tuple(getattr(instance, field) for field in fields):
+        return
+    Trip.objects.filter(trips(instance.pk)).update(version=F('version') + 1)
+
+
+@receiver(pre_save, sender=TripJoinRequest)
+def remember_join_request_state(sender, instance, raw=False, **kwargs):
+    """
+    Stores the trip and status of the request before the update, and copies the creator of the trip
+    onto new requests and requests moved to another trip (none for a deleted trip, see api/purge.py).
+    """
+    instance._previous_state = None
+    if instance.pk:
+        instance._previous_state = TripJoinRequest.objects.filter(pk=instance.pk).values_list('trip_id', 'status').first()
+    if not raw and (instance._previous_state is None or instance._previous_state[0] != instance.trip_id):
+        instance.trip_creator_id = instance.trip.creator_id if instance.trip.deleted_at is None else None
+
+
+def _update_trip_for_request(trip_id, pending_delta):
+    """
+    Increments the version of the trip and moves its pending request counter in a single UPDATE.
+    """
+    changes = {'version': F('version') + 1}
+    if pending_delta:
+        changes['pending_requests'] = F('pending_requests') + pending_delta
+    Trip.objects.filter(pk=trip_id).update(**changes)
+
+
+@receiver(post_save, sender=TripJoinRequest)
+def update_trip_on_request_save(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    pending = int(instance.status == 'pending')
+    previous = getattr(instance, '_previous_state', None)
+    if previous is None:
+        _update_trip_for_request(instance.trip_id, pending)
+        return
+    previous_trip_id, previous_status = previous
+    previous_pending = int(previous_status == 'pending')
+    if previous_trip_id != instance.trip_id:
+        _update_trip_for_request(previous_trip_id, -previous_pending)
+        _update_trip_for_request(instance.trip_id, pending)
+    else:
+        _update_trip_for_request(instance.trip_id, pending - previous_pending)
+
+
+@receiver(post_save, sender=TripJoinRequest)
+def notify_request_status_change(sender, instance, raw=False, **kwargs):
+    previous = getattr(instance, '_previous_state', None)
+    if raw or previous is None or previous[1] == instance.status or instance.status == 'pending':
+        return
+    notify_join_request_statuses([(instance.user_id, instance.trip_id, instance.status)])
+
+
+@receiver(post_delete, sender=TripJoinRequest)
+def update_trip_on_request_delete(sender, instance, **kwargs):
+    _update_trip_for_request(instance.trip_id, -int(instance.status == 'pending'))
+
+
+@receiver(pre_save, sender=City)
+def remember_city_coordinates(sender, instance, **kwargs):
+    instance._previous_coordinates = None
+    if instance.pk:
+        instance._previous_coordinates = City.objects.filter(pk=instance.pk).values_list('latitude', 'longitude').first()
+
+
+@receiver(post_save, sender=City)
+def update_city_distances_on_save(sender, instance, raw=False, **kwargs):
+    """
+    Enqueues the computation of the distances of a city that was added or moved, and the rebuild of the trip map
+    when it was moved.
+    """
+    previous = getattr(instance, '_previous_coordinates', None)
+    if raw or previous == (instance.latitude, instance.longitude):
+        return
+    from .tasks import update_city_distances
+    enqueue(update_city_distances, instance.pk)
+    if previous is not None:
+        schedule_rebuild(force=True)
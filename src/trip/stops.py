@@ -0,0 +1,96 @@
+from django.db import transaction
+from django.db.models import F, Exists, Max, OuterRef, Subquery
+
+from .models import Trip, TripStop
+
+
+class SegmentError(Exception):
+    """
+    Raised when the requested segment is not part of the trip or has no seats left.
+    """
+
+
+def set_trip_stops(trip, intermediate_city_ids):
+    """
+    Replaces the stops of the trip by its origin, the given intermediate cities and its destination.
+    The stops can not be replaced once a seat has been booked on the trip.
+    """
+    if TripStop.objects.filter(trip=trip, seats_taken__gt=0).exists():
+        raise SegmentError('No se pueden modificar las paradas de un viaje con asientos reservados')
+    city_ids = [trip.origin_city_id, *intermediate_city_ids, trip.destination_city_id]
+    TripStop.objects.filter(trip=trip).delete()
+    TripStop.objects.bulk_create(TripStop(trip=trip, city_id=city_id, order=order) for order, city_id in enumerate(city_ids))
+
+
+def sync_route_stops(trip):
+    """
+    Makes the first and last stops of the trip match its origin and destination cities,
+    creating them if the trip has no stops yet.
+    """
+    stops = list(TripStop.objects.filter(trip=trip).order_by('order'))
+    if len(stops) < 2:
+        set_trip_stops(trip, [])
+        return
+    if stops[0].city_id != trip.origin_city_id:
+        TripStop.objects.filter(pk=stops[0].pk).update(city_id=trip.origin_city_id)
+    if stops[-1].city_id != trip.destination_city_id:
+        TripStop.objects.filter(pk=stops[-1].pk).update(city_id=trip.destination_city_id)
+
+
+def get_segment_orders(stops, pickup_city_id=None, dropoff_city_id=None):
+    """
+    Returns the orders of the pickup and dropoff stops in the ordered stops of a trip.
+    An empty pickup or dropoff city means the origin or the destination of the trip.
+    """
+    start = 0 if pickup_city_id is None else next((stop.order for stop in stops if stop.city_id == pickup_city_id), None)
+    if start is None:
+        raise SegmentError('La ciudad de ascenso no es una parada del viaje')
+    if dropoff_city_id is None:
+        return start, stops[-1].order
+    end = next((stop.order for stop in stops if stop.order > start and stop.city_id == dropoff_city_id), None)
+    if end is None:
+        raise SegmentError('La ciudad de descenso no es una parada posterior a la de ascenso')
+    return start, end
+
+
+def book_segment(trip, pickup_city_id=None, dropoff_city_id=None, seats=1):
+    """
+    Takes seats on every leg between the pickup and dropoff stops, raising SegmentError if one of them is full.
+    """
+    with transaction.atomic():
+        stops = list(TripStop.objects.select_for_update().filter(trip=trip).order_by('order'))
+        start, end = get_segment_orders(stops, pickup_city_id, dropoff_city_id)
+        legs = [stop for stop in stops if start <= stop.order < end]
+        if any(stop.seats_taken + seats > trip.seats for stop in legs):
+            raise SegmentError('No hay asientos disponibles en el tramo solicitado')
+        TripStop.objects.filter(pk__in=[stop.pk for stop in legs]).update(seats_taken=F('seats_taken') + seats)
+
+
+def release_segment(trip, pickup_city_id=None, dropoff_city_id=None, seats=1):
+    """
+    Frees the seats taken by book_segment on the legs between the pickup and dropoff stops.
+    """
+    with transaction.atomic():
+        stops = list(TripStop.objects.select_for_update().filter(trip=trip).order_by('order'))
+        start, end = get_segment_orders(stops, pickup_city_id, dropoff_city_id)
+        TripStop.objects.filter(trip=trip, order__gte=start, order__lt=end, seats_taken__gte=seats).update(seats_taken=F('seats_taken') - seats)
+
+
+def find_segments(origin_city_id, destination_city_id, trips=None, limit=None):
+    """
+    Returns (trip id, pickup order, dropoff order, seats left) for every trip that stops at the origin city and later
+    at the destination city with a seat left on each leg in between, the earliest departures first and at most limit
+    of them. The full segments are left out in the query, before the limit is applied. The stop lookups use the
+    (city, trip, order) index.
+    """
+    pickups = TripStop.objects.filter(city_id=origin_city_id)
+    if trips is not None:
+        pickups = pickups.filter(trip__in=trips)
+    dropoffs = TripStop.objects.filter(trip=OuterRef('trip'), city_id=destination_city_id, order__gt=OuterRef('order'))
+    legs = TripStop.objects.filter(trip=OuterRef('trip'), order__gte=OuterRef('order'), order__lt=OuterRef('dropoff_order'))
+    rows = pickups.filter(Exists(dropoffs)).annotate(
+        dropoff_order=Subquery(dropoffs.order_by('order').values('order')[:1]),
+    ).annotate(
+        seats_left=F('trip__seats') - Subquery(legs.order_by().values('trip').annotate(taken=Max('seats_taken')).values('taken')),
+    ).filter(seats_left__gt=0).order_by('trip__departure_at', 'trip_id').values_list('trip_id', 'order', 'dropoff_order', 'seats_left')
+    return list(rows[:limit] if limit else rows)
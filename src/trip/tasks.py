@@ -0,0 +1,29 @@
+from django.core.mail import send_mail
+
+from jobs.registry import task
+from .clusters import rebuild_trip_map
+from .distances import compute_distances
+from .models import Trip
+
+
+@task
+def send_trip_created_email(trip_id):
+    trip = Trip.objects.select_related('creator', 'origin_city__state', 'destination_city__state').filter(pk=trip_id).first()
+    if trip is None: # deleted before the job ran
+        return
+    send_mail(
+        'Tu viaje fue publicado',
+        f'Hola {trip.creator.first_name}, tu viaje {trip} ya está publicado.',
+        None,
+        [trip.creator.email],
+    )
+
+
+@task
+def update_city_distances(city_id):
+    compute_distances([city_id])
+
+
+@task
+def refresh_trip_map():
+    rebuild_trip_map()
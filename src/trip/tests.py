@@ -1,3 +1,400 @@
-from django.test import TestCase
+from datetime import date, datetime, time, timedelta, timezone
+from unittest import mock
 
-# Create your tests here.
+from django.core import mail
+from django.test import TestCase, override_settings
+from rest_framework.test import APIClient
+
+from api.models import ChangeLogEntry
+from authentication.models import CustomUser
+from carpool.testing import TripTestData
+from .clusters import get_clusters, rebuild_trip_map
+from .digests import send_digests
+from .rollups import rebuild_route_stats
+from .stops import SegmentError, set_trip_stops, book_segment, release_segment, find_segments
+from .distances import compute_distances, get_distances_km
+from .geo import haversine_km
+from .models import State, City, CityDistance, Vehicle, Trip, TripStop, TripJoinRequest, TripMapCell, RouteSubscription, Notification, RouteDailyStat
+
+
+class JoinRequestInboxTests(TripTestData, TestCase):
+    """
+    The creator copied onto the join requests and the pending request counter of the trips must follow
+    every change of the requests.
+    """
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.passenger = CustomUser.objects.create_user('passenger@carpool.com', 'password', first_name='passenger', last_name='user')
+        vehicle = Vehicle.objects.create(owner=cls.driver, license_plate='AB123CD', brand='Fiat', model='Uno')
+        cls.trip = Trip.objects.create(
+            origin_city=cls.origin, destination_city=cls.destination, departure_date=date.today() + timedelta(days=1),
+            departure_time=time(10), creator=cls.driver, vehicle=vehicle,
+        )
+
+    def assertPending(self, count):
+        self.trip.refresh_from_db(fields=['pending_requests'])
+        self.assertEqual(self.trip.pending_requests, count)
+
+    def test_pending_counter(self):
+        join_request = TripJoinRequest.objects.create(trip=self.trip, user=self.passenger)
+        self.assertEqual(join_request.trip_creator, self.driver)
+        self.assertPending(1)
+
+        join_request.status = 'accepted'
+        join_request.save()
+        self.assertPending(0)
+
+        join_request.status = 'pending'
+        join_request.save()
+        self.assertPending(1)
+
+        join_request.delete()
+        self.assertPending(0)
+
+    def test_saving_a_stale_trip_keeps_the_counter(self):
+        stale = Trip.objects.get(pk=self.trip.pk)
+        TripJoinRequest.objects.create(trip=self.trip, user=self.passenger)
+        stale.save()
+        self.assertPending(1)
+
+    def test_departure_at_follows_date_and_time(self):
+        self.assertEqual(self.trip.departure_at, datetime.combine(self.trip.departure_date, time(13), tzinfo=timezone.utc)) # 10:00 in Buenos Aires
+
+        trip = Trip.objects.get(pk=self.trip.pk)
+        trip.departure_time = time(23, 30)
+        trip.save(update_fields=['departure_time'])
+        trip.refresh_from_db()
+        self.assertEqual(trip.departure_at, datetime.combine(trip.departure_date + timedelta(days=1), time(2, 30), tzinfo=timezone.utc))
+
+    def test_creator_change_moves_the_inbox(self):
+        TripJoinRequest.objects.create(trip=self.trip, user=self.passenger)
+        self.trip.creator = self.passenger
+        self.trip.save()
+        self.assertEqual(TripJoinRequest.objects.filter(trip_creator=self.passenger).count(), 1)
+
+    def test_admin_reject_pending(self):
+        pending = TripJoinRequest.objects.create(trip=self.trip, user=self.passenger)
+        other = CustomUser.objects.create_user('other@carpool.com', 'password', first_name='other', last_name='user')
+        accepted = TripJoinRequest.objects.create(trip=self.trip, user=other, status='accepted')
+        admin = CustomUser.objects.create_superuser('admin@carpool.com', 'password', first_name='admin', last_name='user')
+        self.client.force_login(admin)
+        ChangeLogEntry.objects.all().delete()
+
+        with mock.patch('api.push.get_broker') as get_broker, self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/admin/trip/tripjoinrequest/', {'action': 'reject_pending', '_selected_action': [pending.pk, accepted.pk]})
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(dict(TripJoinRequest.objects.values_list('pk', 'status')), {pending.pk: 'rejected', accepted.pk: 'accepted'})
+        self.assertPending(0)
+        self.assertEqual(
+            set(ChangeLogEntry.objects.values_list('user_id', 'model', 'object_id', 'action')),
+            {(self.passenger.pk, 'join_request', pending.pk, 'upsert'), (self.driver.pk, 'join_request', pending.pk, 'upsert')},
+        )
+        users, event = get_broker.return_value.publish.call_args.args
+        self.assertEqual(set(users), {self.passenger.pk, self.driver.pk})
+        self.assertEqual(event, {'model': 'join_request', 'id': pending.pk, 'action': 'upsert', 'trip': self.trip.pk, 'status': 'rejected'})
+        self.assertEqual(list(Notification.objects.values_list('user_id', 'status')), [(self.passenger.pk, 'rejected')])
+
+
+@override_settings(CITY_DISTANCE_MAX_KM=500)
+class CityDistanceTests(TestCase):
+    """
+    The stored distances must match the great-circle distance of every pair closer than CITY_DISTANCE_MAX_KM,
+    before and after an incremental update.
+    """
+    @classmethod
+    def setUpTestData(cls):
+        state = State.objects.create(name='Buenos Aires', abbreviation='BA', country='Argentina')
+        coordinates = [(-34.6, -58.38), (-34.92, -57.95), (-38.0, -57.55), (-38.72, -62.27), (-24.78, -65.41)]
+        cls.cities = City.objects.bulk_create(City(name=f'city {index}', latitude=latitude, longitude=longitude, state=state) for index, (latitude, longitude) in enumerate(coordinates))
+
+    def expected_pairs(self):
+        pairs = {}
+        for index, first in enumerate(self.cities):
+            for second in self.cities[index + 1:]:
+                distance = float(haversine_km(first.latitude, first.longitude, second.latitude, second.longitude))
+                if distance <= 500:
+                    pairs[(first.id, second.id)] = round(distance * 1000)
+        return pairs
+
+    def stored_pairs(self):
+        return {(from_id, to_id): distance for from_id, to_id, distance in CityDistance.objects.values_list('from_city_id', 'to_city_id', 'distance_m')}
+
+    def test_compute_distances(self):
+        self.assertEqual(compute_distances(batch_size=2), len(self.expected_pairs()))
+        self.assertEqual(self.stored_pairs(), self.expected_pairs())
+
+        compute_distances([self.cities[0].id, self.cities[2].id], batch_size=1)
+        self.assertEqual(self.stored_pairs(), self.expected_pairs())
+
+    def test_pairs_too_far_apart_are_computed_on_demand(self):
+        compute_distances()
+        first, last = self.cities[0], self.cities[-1]
+
+        distances = get_distances_km([(last.id, first.id)])
+        self.assertAlmostEqual(distances[(last.id, first.id)], float(haversine_km(first.latitude, first.longitude, last.latitude, last.longitude)))
+
+
+    @override_settings(TRIP_ROAD_FACTOR=1.5, TRIP_COST_PER_KM=10)
+    def test_seat_cost(self):
+        compute_distances()
+        buenos_aires, la_plata, mar_del_plata = self.cities[:3]
+        driver = CustomUser.objects.create_user('driver@carpool.com', 'password', first_name='driver', last_name='user')
+        trip = Trip.objects.create(origin_city=la_plata, destination_city=mar_del_plata, departure_date=date.today() + timedelta(days=1), departure_time=time(10), creator=driver, seats=3)
+        set_trip_stops(trip, [buenos_aires.id])
+        client = APIClient()
+        client.force_authenticate(driver)
+
+        distance = sum(float(haversine_km(first.latitude, first.longitude, second.latitude, second.longitude)) for first, second in [(la_plata, buenos_aires), (buenos_aires, mar_del_plata)])
+        cost = client.get(f'/api/trips/{trip.pk}/cost/').data
+        expected = {'distance_km': distance, 'road_distance_km': distance * 1.5, 'total_cost': distance * 15, 'cost_per_seat': distance * 15 / 4}
+        self.assertEqual(cost.keys(), expected.keys())
+        for key, value in expected.items():
+            self.assertAlmostEqual(cost[key], value, delta=0.1, msg=key) # the stored distances are rounded to meters
+
+
+class TripMapTests(TripTestData, TestCase):
+    """
+    The map cells updated by the Trip signals must match a rebuild from the Trip table.
+    """
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.ensenada = City.objects.create(name='Ensenada', latitude=-34.86, longitude=-57.91, state=cls.state)
+
+    def create_trip(self, origin, days=3):
+        return Trip.objects.create(
+            origin_city=origin, destination_city=self.destination, departure_date=date.today() + timedelta(days=days),
+            departure_time=time(10), creator=self.driver, seats=3,
+        )
+
+    def cells(self):
+        return {(zoom, x, y): (count, round(latitude_sum, 6)) for zoom, x, y, count, latitude_sum in TripMapCell.objects.filter(trip_count__gt=0).values_list('zoom', 'x', 'y', 'trip_count', 'latitude_sum')}
+
+    def test_signals_match_rebuild(self):
+        self.create_trip(self.origin)
+        moved = self.create_trip(self.origin)
+        departed = self.create_trip(self.ensenada)
+        deleted = self.create_trip(self.destination)
+        self.create_trip(self.destination, days=-2)
+
+        moved.origin_city = self.ensenada
+        moved.save()
+        departed.departure_date = date.today() - timedelta(days=1)
+        departed.save()
+        deleted.delete()
+
+        incremental = self.cells()
+        rebuild_trip_map()
+        self.assertEqual(incremental, self.cells())
+
+    def test_clusters(self):
+        self.create_trip(self.origin)
+        self.create_trip(self.ensenada)
+        self.create_trip(self.destination)
+        bbox = (-60.0, -39.0, -56.0, -34.0)
+
+        self.assertEqual(sorted(cluster['count'] for cluster in get_clusters(*bbox, 4)), [1, 2])
+        self.assertEqual(sorted(cluster['count'] for cluster in get_clusters(*bbox, 12)), [1, 1, 1])
+        self.assertEqual(get_clusters(-80.0, -39.0, -70.0, -34.0, 12), [])
+
+        # a box that crosses the antimeridian wraps around the world
+        self.assertEqual(sum(cluster['count'] for cluster in get_clusters(170.0, -39.0, -56.0, -34.0, 4)), 3)
+        cluster = get_clusters(*bbox, 0)[0]
+        self.assertAlmostEqual(cluster['latitude'], (-34.92 - 34.86 - 38.0) / 3, places=5)
+
+
+class DigestTests(TripTestData, TestCase):
+    """
+    The pending notifications must be sent in one digest per user and only once.
+    """
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.passengers = [CustomUser.objects.create_user(f'passenger{index}@carpool.com', 'password', first_name='passenger', last_name='user') for index in range(3)]
+        RouteSubscription.objects.bulk_create(RouteSubscription(user=user, origin_city=cls.origin, destination_city=cls.destination) for user in [cls.driver, *cls.passengers])
+
+    def create_trip(self):
+        return Trip.objects.create(
+            origin_city=self.origin, destination_city=self.destination, departure_date=date.today() + timedelta(days=3),
+            departure_time=time(10), creator=self.driver, seats=3,
+        )
+
+    def test_digests(self):
+        first, second, deleted = self.create_trip(), self.create_trip(), self.create_trip()
+        deleted.delete()
+        request = TripJoinRequest.objects.create(trip=first, user=self.passengers[0])
+        request.status = 'accepted'
+        request.save()
+        request.status = 'rejected'
+        request.save()
+
+        self.assertEqual(send_digests(batch_size=2), 3)
+        self.assertEqual(sorted(message.to[0] for message in mail.outbox), [user.email for user in self.passengers])
+        body = next(message.body for message in mail.outbox if message.to == [self.passengers[0].email])
+        self.assertEqual(body.count('La Plata a Mar del Plata'), 3) # two trips and the last status of the request
+        self.assertIn('rechazada', body)
+        self.assertNotIn('aceptada', body)
+
+        self.assertFalse(Notification.objects.filter(sent_at__isnull=True).exists())
+        self.assertEqual(send_digests(), 0)
+
+    def test_failed_message_stays_pending(self):
+        self.create_trip()
+        failing = self.passengers[1].email
+        send_messages = mail.get_connection().send_messages.__func__
+
+        def send_or_fail(connection, messages):
+            if messages[0].to == [failing]:
+                raise ConnectionError('rejected')
+            return send_messages(connection, messages)
+
+        with mock.patch('django.core.mail.backends.locmem.EmailBackend.send_messages', send_or_fail), self.assertLogs('trip.digests', 'ERROR'):
+            self.assertEqual(send_digests(batch_size=2), 2)
+        self.assertEqual(sorted(message.to[0] for message in mail.outbox), [self.passengers[0].email, self.passengers[2].email])
+        self.assertEqual(list(Notification.objects.filter(sent_at__isnull=True).values_list('user__email', flat=True)), [failing])
+
+        self.assertEqual(send_digests(), 1)
+        self.assertEqual(mail.outbox[-1].to, [failing])
+
+
+class RouteStatsTests(TripTestData, TestCase):
+    """
+    The route rollups maintained by the Trip signals must match a rebuild from the Trip table, and feed the
+    trending and calendar endpoints.
+    """
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.tomorrow = date.today() + timedelta(days=1)
+
+    def create_trip(self, origin, destination, departure_date, seats=3):
+        return Trip.objects.create(
+            origin_city=origin, destination_city=destination, departure_date=departure_date,
+            departure_time=time(10), creator=self.driver, seats=seats,
+        )
+
+    def stats(self):
+        return {
+            (origin_id, destination_id, departure_date): (trips, seats)
+            for origin_id, destination_id, departure_date, trips, seats in RouteDailyStat.objects.filter(trip_count__gt=0)
+            .values_list('origin_city_id', 'destination_city_id', 'departure_date', 'trip_count', 'seat_count')
+        }
+
+    def test_signals_move_the_counts(self):
+        route = (self.origin.id, self.destination.id)
+        first = self.create_trip(self.origin, self.destination, self.tomorrow)
+        second = self.create_trip(self.origin, self.destination, self.tomorrow, seats=2)
+        self.assertEqual(self.stats(), {(*route, self.tomorrow): (2, 5)})
+
+        second.departure_date = self.tomorrow + timedelta(days=1)
+        second.save()
+        first.seats = 4
+        first.save()
+        self.assertEqual(self.stats(), {(*route, self.tomorrow): (1, 4), (*route, self.tomorrow + timedelta(days=1)): (1, 2)})
+
+        first.delete()
+        self.create_trip(self.destination, self.origin, self.tomorrow)
+        incremental = self.stats()
+        self.assertEqual(incremental, {(*route, self.tomorrow + timedelta(days=1)): (1, 2), (*route[::-1], self.tomorrow): (1, 3)})
+
+        rebuild_route_stats()
+        self.assertEqual(self.stats(), incremental)
+
+    def test_trending_and_calendar(self):
+        for _ in range(2):
+            self.create_trip(self.origin, self.destination, self.tomorrow)
+        self.create_trip(self.destination, self.origin, self.tomorrow)
+        client = APIClient()
+
+        trending = client.get('/api/routes/trending/').data
+        self.assertEqual([(route['origin_city'], route['trip_count'], route['seat_count']) for route in trending], [(self.origin.id, 2, 6), (self.destination.id, 1, 3)])
+
+        calendar = client.get('/api/routes/calendar/', {'origin': self.origin.id, 'destination': self.destination.id}).data
+        self.assertEqual([dict(day) for day in calendar], [{'departure_date': self.tomorrow.isoformat(), 'trip_count': 2, 'seat_count': 6}])
+        self.assertEqual(client.get('/api/routes/calendar/').status_code, 400)
+
+
+class SegmentTests(TripTestData, TestCase):
+    """
+    Booking a segment takes a seat on each of its legs only, and the seats left on a segment are those of its
+    fullest leg. Join requests take their seats when they are accepted, never when they are created.
+    """
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.passenger = CustomUser.objects.create_user('passenger@carpool.com', 'password', first_name='passenger', last_name='user')
+        cls.chascomus = City.objects.create(name='Chascomús', latitude=-35.57, longitude=-58.01, state=cls.state)
+        cls.dolores = City.objects.create(name='Dolores', latitude=-36.31, longitude=-57.68, state=cls.state)
+        cls.trip = Trip.objects.create(
+            origin_city=cls.origin, destination_city=cls.destination, departure_date=date.today() + timedelta(days=1),
+            departure_time=time(10), creator=cls.driver, seats=1,
+        )
+        set_trip_stops(cls.trip, [cls.chascomus.id, cls.dolores.id])
+
+    def seats_taken(self):
+        return list(TripStop.objects.filter(trip=self.trip).order_by('order').values_list('seats_taken', flat=True))
+
+    def available(self, origin, destination):
+        segments = {trip_id: seats for trip_id, _, _, seats in find_segments(origin.id, destination.id)}
+        return segments.get(self.trip.id, 0) # full segments are left out
+
+    def test_book_and_release(self):
+        book_segment(self.trip, self.origin.id, self.chascomus.id)
+        self.assertEqual(self.seats_taken(), [1, 0, 0, 0])
+        self.assertEqual(self.available(self.origin, self.dolores), 0)
+        self.assertEqual(self.available(self.chascomus, self.destination), 1)
+
+        book_segment(self.trip, self.chascomus.id)
+        self.assertEqual(self.seats_taken(), [1, 1, 1, 0])
+        with self.assertRaises(SegmentError):
+            book_segment(self.trip, self.dolores.id, self.origin.id)
+        with self.assertRaises(SegmentError):
+            book_segment(self.trip, self.dolores.id)
+        self.assertEqual(self.seats_taken(), [1, 1, 1, 0])
+
+        release_segment(self.trip, self.origin.id, self.chascomus.id)
+        self.assertEqual(self.seats_taken(), [0, 1, 1, 0])
+        self.assertEqual(self.available(self.origin, self.chascomus), 1)
+        self.assertEqual(self.available(self.origin, self.destination), 0)
+
+    def test_seats_can_not_go_below_booked(self):
+        self.trip.seats = 3
+        self.trip.save()
+        book_segment(self.trip, self.chascomus.id, seats=2)
+        client = APIClient()
+        client.force_authenticate(self.driver)
+
+        self.assertEqual(client.patch(f'/api/trips/{self.trip.pk}/', {'seats': 1}, format='json').status_code, 400)
+        self.assertEqual(client.patch(f'/api/trips/{self.trip.pk}/', {'seats': 2}, format='json').status_code, 200)
+
+    def test_join_requests(self):
+        client = APIClient()
+        client.force_authenticate(self.driver)
+        data = {'user': self.passenger.id, 'trip': self.trip.id, 'pickup_city': self.chascomus.id, 'dropoff_city': self.dolores.id}
+
+        self.assertEqual(client.post('/api/join-requests/', {**data, 'status': 'accepted'}).status_code, 400)
+        join_request = client.post('/api/join-requests/', data).data
+        self.assertEqual(join_request['status'], 'pending')
+        self.assertEqual(self.seats_taken(), [0, 0, 0, 0])
+
+        self.assertEqual(client.patch(f'/api/join-requests/{join_request["id"]}/', {'status': 'accepted'}).status_code, 200)
+        self.assertEqual(self.seats_taken(), [0, 1, 0, 0])
+        self.assertEqual(client.patch(f'/api/join-requests/{join_request["id"]}/', {'status': 'rejected'}).status_code, 200)
+        self.assertEqual(self.seats_taken(), [0, 0, 0, 0])
+
+    def test_segments_endpoint(self):
+        later = Trip.objects.create(
+            origin_city=self.origin, destination_city=self.destination, departure_date=date.today() + timedelta(days=2),
+            departure_time=time(10), creator=self.driver,
+        )
+        client = APIClient()
+        client.force_authenticate(self.passenger)
+        response = client.get('/api/trips/segments/', {'origin': self.origin.id, 'destination': self.destination.id, 'limit': 1})
+        self.assertEqual([trip['id'] for trip in response.data], [self.trip.id])
+
+        book_segment(self.trip, self.origin.id, self.chascomus.id)
+        response = client.get('/api/trips/segments/', {'origin': self.chascomus.id, 'destination': self.destination.id})
+        self.assertEqual([(trip['id'], trip['available_seats']) for trip in response.data], [(self.trip.id, 1)])
+        response = client.get('/api/trips/segments/', {'origin': self.origin.id, 'destination': self.destination.id, 'limit': 1})
+        self.assertEqual([trip['id'] for trip in response.data], [later.id]) # the full trip does not take the only place